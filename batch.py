@@ -0,0 +1,255 @@
+"""
+batch.py
+Copyright 2007 Thomas McGrew
+
+This file is part of The Python Image Manipulation Project.
+
+The Python Image Manipulation Project is free software: you can
+redistribute it and/or modify it under the terms of the GNU General
+Public License as published by the Free Software Foundation, either
+version 2 of the License, or (at your option) any later version.
+
+The Python Image Manipulation Project is distributed in the hope
+that it will be useful, but WITHOUT ANY WARRANTY; without even the
+implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with The Python Image Manipulation Project.  If not, see
+<http://www.gnu.org/licenses/>.
+
+Applies a chain of filters to many image files without the GUI. Files are
+read and written by the file format extensions, and the filters are the
+execute functions of the menu extensions, so this never imports wx.
+
+    pimp.py batch -o out -f sepia -f quick_scale:new_width=800 'photos/*.jpg'
+"""
+
+# library imports
+import os
+import sys
+import multiprocessing
+from argparse import ArgumentParser
+from ast import literal_eval
+from concurrent.futures import ProcessPoolExecutor
+from glob import glob
+from importlib import import_module
+
+from image import Image
+from error import ExtensionError
+import extensions.lib.core
+import formats
+
+# the number of files handed to a worker process at a time
+CHUNK_SIZE = 4
+
+
+def parse_filter(text):
+    """
+    Parses a filter given on the command line. Filters are the name of a
+    module in extensions/menu, optionally followed by a colon and a comma
+    separated list of arguments to its execute function, e.g.
+    "quick_scale:800,600" or "median_filter:filter_size=5". Values are read as
+    python literals where possible and as strings otherwise.
+
+    :Parameters:
+        text : string
+            The filter as given on the command line.
+
+    :rtype: tuple
+    :returns: A tuple (module_name, args, kwargs).
+    """
+    name, _, arguments = text.partition(':')
+    args = list()
+    kwargs = dict()
+    for argument in filter(None, arguments.split(',')):
+        key, equals, value = argument.rpartition('=')
+        try:
+            value = literal_eval(value)
+        except (ValueError, SyntaxError):
+            pass
+        if equals:
+            kwargs[key] = value
+        elif kwargs:
+            raise ValueError(f"Positional argument '{argument}' follows a "
+                f"keyword argument in filter '{text}'")
+        else:
+            args.append(value)
+    return (name, tuple(args), kwargs)
+
+
+def get_filter(name):
+    """
+    Gets the execute function of a menu extension.
+
+    :Parameters:
+        name : string
+            The name of the module in extensions/menu.
+
+    :rtype: function
+    :returns: The module's execute function.
+    """
+    try:
+        module = import_module(f"extensions.menu.{name}")
+    except ImportError as error:
+        raise ExtensionError(f"No filter named '{name}' could be loaded: "
+            f"{error}")
+    if not hasattr(module, "execute"):
+        raise ExtensionError(f"extensions.menu.{name} is not a filter")
+    return module.execute
+
+
+def apply_chain(width, height, data, chain):
+    """
+    Runs image data through a chain of filters.
+
+    :Parameters:
+        width : int
+            The width of the image in pixels.
+        height : int
+            The height of the image in pixels.
+        data : buffer
+            The image data.
+        chain : list
+            The (module_name, args, kwargs) tuples for the filters to apply,
+            in order.
+
+    :rtype: tuple
+    :returns: A tuple (width, height, data) for the filtered image.
+    """
+    for name, args, kwargs in chain:
+        result = get_filter(name)(width, height, data, *args, **kwargs)
+        if not result or len(result) != 3:
+            raise ExtensionError(f"The filter '{name}' did not return an "
+                "image")
+        width, height, data = result
+    return (width, height, data)
+
+
+def process_file(filename, output, chain, scale=1):
+    """
+    Reads an image, runs it through a chain of filters and writes the result.
+
+    :Parameters:
+        filename : string
+            The image file to read.
+        output : string
+            The image file to write.
+        chain : list
+            The (module_name, args, kwargs) tuples for the filters to apply,
+            in order.
+        scale : float
+            The smallest fraction of the full size the image is needed at,
+            see formats.read. Defaults to 1.
+
+    :rtype: tuple
+    :returns: A tuple (filename, error). error is None on success, otherwise
+        a message describing what went wrong.
+    """
+    try:
+        image = formats.read(filename, scale)
+        formats.write(output, Image(*apply_chain(image.get_width(),
+            image.get_height(), image.get_data(), chain)))
+    except Exception as error:
+        return (filename, f"{type(error).__name__}: {error}")
+    return (filename, None)
+
+
+def _start_worker(threads):
+    """
+    Internal Function. Sets up a worker process.
+    """
+    extensions.lib.core.set_thread_count(threads)
+
+
+def main(argv=None):
+    """
+    Runs the batch mode.
+
+    :Parameters:
+        argv : list
+            The command line arguments, not including the program name.
+            Defaults to sys.argv[1:].
+
+    :rtype: int
+    :returns: The exit status, 0 if every file was processed.
+    """
+    parser = ArgumentParser(prog="pimp.py batch",
+        description="Apply a chain of filters to many image files.")
+    parser.add_argument("inputs", nargs="+", metavar="INPUT",
+        help="image files or glob patterns (** matches any directories)")
+    parser.add_argument("-f", "--filter", action="append", default=[],
+        dest="filters", metavar="FILTER[:ARGS]",
+        help="a module in extensions/menu to apply, with optional comma "
+            "separated arguments, e.g. quick_scale:new_width=800. May be "
+            "repeated, filters are applied in order.")
+    parser.add_argument("-o", "--output", required=True, metavar="DIR",
+        help="the directory to write the results to")
+    parser.add_argument("-t", "--type", metavar="EXT",
+        help="the file type to write, e.g. png. Defaults to the type of each "
+            "input file.")
+    parser.add_argument("-d", "--draft", type=float, default=1,
+        metavar="SCALE", help="read images at as little as SCALE of their "
+            "size where the file type can do it quickly (jpeg can read 1/2, "
+            "1/4 and 1/8 size), e.g. 0.125 before scaling down to thumbnails")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+        help="the number of worker processes (default: one per processor)")
+    parser.add_argument("--threads", type=int, default=1,
+        help="the number of threads each worker's C filters use (default: 1)")
+    parser.add_argument("-v", "--verbose", action="store_true",
+        help="print each file as it is finished")
+    options = parser.parse_args(argv)
+
+    try:
+        chain = [parse_filter(text) for text in options.filters]
+        for name, args, kwargs in chain:
+            get_filter(name)
+    except (ValueError, ExtensionError) as error:
+        parser.error(str(error))
+    if options.jobs < 1 or options.threads < 1:
+        parser.error("--jobs and --threads must be at least 1")
+    if not 0 < options.draft <= 1:
+        parser.error("--draft must be more than 0 and at most 1")
+
+    filenames = list()
+    for pattern in options.inputs:
+        matches = sorted(glob(pattern, recursive=True)) or [pattern]
+        filenames.extend(f for f in matches if not os.path.isdir(f))
+
+    outputs = list()
+    for filename in filenames:
+        name = os.path.basename(filename)
+        if options.type:
+            name = f"{os.path.splitext(name)[0]}.{options.type.lstrip('.')}"
+        outputs.append(os.path.join(options.output, name))
+    if len(set(outputs)) != len(outputs):
+        parser.error("Several input files would be written to the same output "
+            "file")
+    if not filenames:
+        parser.error("No input files were found")
+    os.makedirs(options.output, exist_ok=True)
+
+    # fork where it's available so the workers don't re-import the program.
+    context = None
+    if "fork" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("fork")
+    failures = 0
+    with ProcessPoolExecutor(max_workers=options.jobs, mp_context=context,
+            initializer=_start_worker, initargs=(options.threads,)) \
+            as executor:
+        for filename, error in executor.map(process_file, filenames, outputs,
+                [chain] * len(filenames), [options.draft] * len(filenames),
+                chunksize=CHUNK_SIZE):
+            if error:
+                failures += 1
+                print(f"{filename}: {error}", file=sys.stderr)
+            elif options.verbose:
+                print(filename)
+
+    print(f"Processed {len(filenames) - failures} of {len(filenames)} files",
+        file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+"""
+bench.py
+Copyright 2007 Thomas McGrew
+
+This file is part of The Python Image Manipulation Project.
+
+The Python Image Manipulation Project is free software: you can
+redistribute it and/or modify it under the terms of the GNU General
+Public License as published by the Free Software Foundation, either
+version 2 of the License, or (at your option) any later version.
+
+The Python Image Manipulation Project is distributed in the hope
+that it will be useful, but WITHOUT ANY WARRANTY; without even the
+implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with The Python Image Manipulation Project.  If not, see
+<http://www.gnu.org/licenses/>.
+
+Times the filters and file formats on generated images, without the GUI.
+
+    ./bench.py run --sizes 1,4,16 -o before.json
+    ./bench.py run --sizes 1,4,16 -o after.json
+    ./bench.py compare before.json after.json
+
+Each case runs in a process of its own so its peak memory use can be
+measured. Results are written as JSON, with the throughput of each case in
+megapixels per second. compare exits with status 1 if any case got slower by
+more than the threshold.
+"""
+
+# library imports
+import os
+import sys
+import json
+import math
+import random
+import platform
+import resource
+import tempfile
+import multiprocessing
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from fnmatch import fnmatch
+from importlib import import_module
+from time import perf_counter
+
+import extensions.lib.core
+from extensions.lib.resample import METHODS as RESAMPLE_METHODS
+import formats
+from image import Image
+
+# the sizes (in megapixels) and numbers of channels benchmarked by default
+SIZES = (1, 4, 16)
+CHANNELS = (3, 4)
+# the filter sizes the median filter is timed with
+MEDIAN_SIZES = (3, 5, 15, 51)
+# the change in throughput compare reports, as a fraction
+THRESHOLD = 0.1
+
+
+def _menu(name, *args):
+    """
+    Internal Function. Gets a function which runs the execute function of a
+    menu extension.
+
+    :Parameters:
+        name : string
+            The name of the module in extensions/menu.
+        args : tuple
+            Extra arguments for execute, so no dialog is shown.
+
+    :rtype: function
+    :returns: A function taking (width, height, data).
+    """
+    execute = import_module(f"extensions.menu.{name}").execute
+    return lambda width, height, data: execute(width, height, data, *args)
+
+
+def _codec(file_type, operation):
+    """
+    Internal Function. Gets a function which writes an image to a temporary
+    file of the given type, or reads it back.
+
+    :Parameters:
+        file_type : string
+            The file extension, e.g. "bmp".
+        operation : string
+            "write" to time writing the file, "read" to time reading it.
+
+    :rtype: tuple
+    :returns: A tuple (setup, run). setup writes the file to be read and
+        returns a function removing the file, run takes (width, height,
+        data).
+    """
+    def setup(width, height, data):
+        filename = os.path.join(tempfile.gettempdir(),
+                f"pimp-bench-{os.getpid()}.{file_type}")
+        files.append(filename)
+        if operation == "read":
+            formats.write(filename, Image(width, height, data))
+        return lambda: os.path.exists(filename) and os.remove(filename)
+
+    def run(width, height, data):
+        if operation == "write":
+            return formats.write(files[-1], Image(width, height, data))
+        return formats.read(files[-1])
+
+    files = list()
+    return (setup, run)
+
+
+def get_cases():
+    """
+    Gets the benchmark cases.
+
+    :rtype: list
+    :returns: A list of (name, setup, run) tuples. setup is None or a
+        function called with (width, height, data) before the case is timed,
+        which may return a function to clean up afterwards. run is the
+        function timed.
+    """
+    quick_scale = import_module("extensions.menu.quick_scale").execute
+    cases = [
+        ("spatial:normal_smooth", None, _menu("normal_smooth")),
+        ("spatial:gaussian", None, _menu("gaussian")),
+        ("spatial:edge_detect", None, _menu("edge_detect")),
+        ("spatial:laplacian_sharpen", None, _menu("laplacian_sharpen")),
+        ("canny_edge", None, _menu("canny_edge")),
+    ]
+    cases += [(f"median_filter:{size}", None, _menu("median_filter", size))
+        for size in MEDIAN_SIZES]
+    cases += [
+        ("nintendize", None, _menu("nintendize", 4, 8)),
+        ("table:gamma", None, _menu("gamma", 10, 1.2, 0.8)),
+        ("swap_channels:red_blue", None, _menu("swap_red_blue")),
+        ("greyscale", None, _menu("greyscale")),
+        ("pseudocolor:thermal", None, _menu("thermal")),
+        ("pipeline:sepia", None, _menu("sepia")),
+        ("histogram_eq", None, _menu("histogram_eq")),
+        ("invert", None, _menu("invert")),
+        ("quick_scale:half", None, lambda width, height, data:
+            quick_scale(width, height, data, width // 2, height // 2)),
+    ]
+    cases += [(f"resample:{method}:half", None,
+        lambda width, height, data, method=method: quick_scale(width, height,
+            data, width // 2, height // 2, method))
+        for method in RESAMPLE_METHODS]
+    # one file type for each format extension
+    file_types = dict()
+    for file_type, module in sorted(formats.file_reader['ext'].items()):
+        file_types.setdefault(module.__name__, file_type)
+    for file_type in file_types.values():
+        for operation in ("write", "read"):
+            cases.append((f"codec:{file_type}:{operation}",
+                *_codec(file_type, operation)))
+    return cases
+
+
+def make_image(megapixels, channels, seed=0):
+    """
+    Generates an image of random noise with a 4:3 aspect ratio.
+
+    :Parameters:
+        megapixels : float
+            The size of the image in millions of pixels.
+        channels : int
+            The number of channels, 3 or 4.
+        seed : int
+            The seed for the random data, so runs can be compared.
+
+    :rtype: tuple
+    :returns: A tuple (width, height, data).
+    """
+    width = max(1, round(math.sqrt(megapixels * 1e6 * 4 / 3)))
+    height = max(1, round(megapixels * 1e6 / width))
+    data = bytearray(random.Random(seed).randbytes(width * height * channels))
+    return (width, height, data)
+
+
+def run_case(name, megapixels, channels, repeat):
+    """
+    Times one case. This is run in a process of its own.
+
+    :Parameters:
+        name : string
+            The name of the case.
+        megapixels : float
+            The size of the image in millions of pixels.
+        channels : int
+            The number of channels, 3 or 4.
+        repeat : int
+            The number of times to run the case. The fastest is reported.
+
+    :rtype: dict
+    :returns: The result of the case.
+    """
+    setup, run = {case[0]: case[1:] for case in get_cases()}[name]
+    width, height, data = make_image(megapixels, channels)
+    result = {"name": name, "megapixels": megapixels, "width": width,
+        "height": height, "channels": channels}
+    cleanup = None
+    try:
+        if setup:
+            cleanup = setup(width, height, data)
+        times = list()
+        for i in range(repeat):
+            start = perf_counter()
+            run(width, height, data)
+            times.append(perf_counter() - start)
+    except Exception as error:
+        result["error"] = f"{type(error).__name__}: {error}"
+        return result
+    finally:
+        if cleanup:
+            cleanup()
+    result["seconds"] = min(times)
+    result["mean_seconds"] = sum(times) / len(times)
+    result["mp_per_s"] = width * height / 1e6 / min(times)
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != "darwin":
+        peak *= 1024
+    result["peak_rss_mb"] = peak / 2 ** 20
+    return result
+
+
+def run(options):
+    """
+    Runs the benchmarks selected on the command line.
+
+    :Parameters:
+        options : Namespace
+            The parsed command line.
+
+    :rtype: int
+    :returns: The exit status.
+    """
+    extensions.lib.core.set_thread_count(options.threads)
+    names = [case[0] for case in get_cases()
+        if not options.filter or any(fnmatch(case[0], pattern)
+            for pattern in options.filter)]
+    context = None
+    if "fork" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("fork")
+
+    results = list()
+    for megapixels in options.sizes:
+        for channels in options.channels:
+            for name in names:
+                # a new process for each case so ru_maxrss is its own.
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) \
+                        as executor:
+                    result = executor.submit(run_case, name, megapixels,
+                            channels, options.repeat).result()
+                results.append(result)
+                if "error" in result:
+                    print(f"{name:28} {megapixels:6g} MP {channels}ch "
+                        f"{result['error']}", file=sys.stderr)
+                else:
+                    print(f"{name:28} {megapixels:6g} MP {channels}ch "
+                        f"{result['seconds']:9.4f} s "
+                        f"{result['mp_per_s']:9.2f} MP/s "
+                        f"{result['peak_rss_mb']:8.1f} MB", file=sys.stderr)
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "threads": extensions.lib.core.get_thread_count(),
+        "repeat": options.repeat,
+        "results": results,
+    }
+    if options.output:
+        with open(options.output, 'w') as output:
+            json.dump(report, output, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+        print()
+    return 0
+
+
+def compare(options):
+    """
+    Compares two sets of results and reports the cases whose throughput
+    changed by more than the threshold.
+
+    :Parameters:
+        options : Namespace
+            The parsed command line.
+
+    :rtype: int
+    :returns: 1 if any case got slower, otherwise 0.
+    """
+    def key(result):
+        return (result["name"], result["megapixels"], result["channels"])
+
+    with open(options.old) as old_file, open(options.new) as new_file:
+        old = {key(result): result for result in json.load(old_file)["results"]
+            if "mp_per_s" in result}
+        new = [result for result in json.load(new_file)["results"]
+            if "mp_per_s" in result]
+
+    regressions = 0
+    for result in new:
+        if key(result) not in old:
+            continue
+        before = old[key(result)]["mp_per_s"]
+        change = result["mp_per_s"] / before - 1
+        if change < -options.threshold:
+            status = "REGRESSION"
+            regressions += 1
+        elif change > options.threshold:
+            status = "faster"
+        elif options.verbose:
+            status = ""
+        else:
+            continue
+        print(f"{result['name']:28} {result['megapixels']:6g} MP "
+            f"{result['channels']}ch {before:9.2f} -> "
+            f"{result['mp_per_s']:9.2f} MP/s {change:+7.1%} {status}")
+    print(f"{regressions} regression(s)", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+def main(argv=None):
+    """
+    Runs the benchmark command line.
+
+    :Parameters:
+        argv : list
+            The command line arguments, not including the program name.
+            Defaults to sys.argv[1:].
+
+    :rtype: int
+    :returns: The exit status.
+    """
+    def numbers(kind):
+        return lambda text: tuple(kind(value) for value in text.split(','))
+
+    parser = ArgumentParser(prog="bench.py",
+        description="Benchmark the filters and file formats.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument("--sizes", type=numbers(float), default=SIZES,
+        help="comma separated image sizes in megapixels (default: "
+            f"{','.join(map(str, SIZES))})")
+    run_parser.add_argument("--channels", type=numbers(int), default=CHANNELS,
+        help="comma separated numbers of channels (default: 3,4)")
+    run_parser.add_argument("-f", "--filter", action="append",
+        metavar="PATTERN", help="only run cases matching this pattern, e.g. "
+            "'median*'. May be repeated.")
+    run_parser.add_argument("-r", "--repeat", type=int, default=3,
+        help="the number of times each case is run (default: 3)")
+    run_parser.add_argument("--threads", type=int, default=None,
+        help="the number of threads the C filters use (default: one per "
+            "processor)")
+    run_parser.add_argument("-o", "--output", metavar="FILE",
+        help="the file to write the results to (default: standard output)")
+    run_parser.add_argument("-l", "--list", action="store_true",
+        help="list the cases and exit")
+
+    compare_parser = commands.add_parser("compare",
+        help="compare two sets of results")
+    compare_parser.add_argument("old", help="the results to compare against")
+    compare_parser.add_argument("new", help="the new results")
+    compare_parser.add_argument("-t", "--threshold", type=float,
+        default=THRESHOLD, help="the change in throughput to report, as a "
+            f"fraction (default: {THRESHOLD})")
+    compare_parser.add_argument("-v", "--verbose", action="store_true",
+        help="also list the cases which didn't change")
+
+    options = parser.parse_args(argv)
+    if options.command == "compare":
+        return compare(options)
+    if options.list:
+        for case in get_cases():
+            print(case[0])
+        return 0
+    if options.repeat < 1:
+        parser.error("--repeat must be at least 1")
+    return run(options)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
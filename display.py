@@ -0,0 +1,446 @@
+"""
+display.py
+Copyright 2007 Thomas McGrew
+
+This file is part of The Python Image Manipulation Project.
+
+The Python Image Manipulation Project is free software: you can
+redistribute it and/or modify it under the terms of the GNU General
+Public License as published by the Free Software Foundation, either
+version 2 of the License, or (at your option) any later version.
+
+The Python Image Manipulation Project is distributed in the hope
+that it will be useful, but WITHOUT ANY WARRANTY; without even the
+implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with The Python Image Manipulation Project.  If not, see
+<http://www.gnu.org/licenses/>.
+
+Displays an image as a grid of fixed size tiles. Only the tiles in the
+visible part of the window are converted to bitmaps, and the most recently
+used ones are kept, so repainting a large image only costs the conversion of
+tiles which weren't on screen before.
+
+Zooming out draws from a Pyramid of the image at half, quarter, ... size, so
+the work done for a repaint depends on the size of the window rather than the
+size of the image. Zooming in magnifies the tiles of the full size image.
+"""
+
+# library imports
+from collections import OrderedDict
+
+import extensions.lib.core
+from image import Image
+
+# the width and height of a tile in pixels
+TILE_SIZE = 256
+# the number of tile bitmaps kept (256 RGB tiles of 256x256 are 48MB)
+MAX_TILES = 256
+# the number of bytes compared at a time when looking for changed rows
+BAND_SIZE = 1 << 16
+
+
+def crop(width, height, data, x, y, crop_width, crop_height):
+    """
+    Copies a rectangle out of an image.
+
+    :Parameters:
+        width : int
+            The width of the image in pixels.
+        height : int
+            The height of the image in pixels.
+        data : buffer
+            The image data.
+        x : int
+            The left edge of the rectangle.
+        y : int
+            The top edge of the rectangle.
+        crop_width : int
+            The width of the rectangle.
+        crop_height : int
+            The height of the rectangle.
+
+    :rtype: tuple
+    :returns: a tuple containing the width, height and data of the rectangle.
+    """
+    view = memoryview(data).cast('B')
+    channels = view.nbytes // (width * height)
+    row_length = crop_width * channels
+    start = (y * width + x) * channels
+    stride = width * channels
+    return (crop_width, crop_height, b''.join(
+        view[offset:offset + row_length] for offset in
+            range(start, start + crop_height * stride, stride)))
+
+
+class TileCache:
+    """
+    Converts an image to display bitmaps a tile at a time.
+    """
+    def __init__(self, convert=extensions.lib.core.data_to_bitmap,
+            tile_size=TILE_SIZE, max_tiles=MAX_TILES):
+        """
+        Creates an empty TileCache.
+
+        :Parameters:
+            convert : function
+                The function turning (width, height, data) into a bitmap.
+            tile_size : int
+                The width and height of a tile in pixels.
+            max_tiles : int
+                The number of tile bitmaps to keep.
+        """
+        self._convert = convert
+        self._tile_size = tile_size
+        self._max_tiles = max_tiles
+        self._image = None
+        self._generation = None
+        self._magnification = 1
+        self._tiles = OrderedDict()
+
+    def set_image(self, image, magnification=1):
+        """
+        Sets the image to display. Cached tiles are kept if the image is the
+        same size as the last one and the pixels under them are unchanged, so
+        a filter which only alters part of an image only costs the conversion
+        of the tiles it changed.
+
+        :Parameters:
+            image : Image
+                The image to display, or None.
+            magnification : int
+                The number of screen pixels each image pixel is drawn as in
+                each direction, a power of 2 up to the tile size.
+        """
+        if magnification != self._magnification:
+            self._magnification = magnification
+            self._tiles.clear()
+        if image is self._image:
+            self._check_generation()
+            return
+        old, self._image = self._image, image
+        if image:
+            self._generation = image.get_generation()
+        if not (old and image and old.get_size() == image.get_size() and
+                old.has_alpha() == image.has_alpha()):
+            self._tiles.clear()
+        elif old.get_data() is not image.get_data():
+            for key in self._changed_tiles(old, image):
+                self._tiles.pop(key, None)
+
+    def _check_generation(self):
+        """
+        Internal Function. Drops every tile if the image's pixels were
+        replaced or changed in place since the tiles were made. The old
+        pixels are gone by then, so they can't be compared.
+        """
+        if self._image and self._image.get_generation() != self._generation:
+            self._generation = self._image.get_generation()
+            self._tiles.clear()
+
+    def invalidate(self, x=0, y=0, width=None, height=None):
+        """
+        Drops the tiles covering a rectangle of the image, for when its pixels
+        are changed in place. With no arguments every tile is dropped. The
+        other tiles are kept even if the image was touched.
+
+        :Parameters:
+            x : int
+                The left edge of the rectangle.
+            y : int
+                The top edge of the rectangle.
+            width : int
+                The width of the rectangle. Defaults to the rest of the image.
+            height : int
+                The height of the rectangle. Defaults to the rest of the image.
+        """
+        if self._image:
+            self._generation = self._image.get_generation()
+        if width is None and height is None and not (x or y):
+            self._tiles.clear()
+            return
+        if not self._image:
+            return
+        size = self._tile_size // self._magnification
+        if width is None:
+            width = self._image.get_width() - x
+        if height is None:
+            height = self._image.get_height() - y
+        for column, row in list(self._tiles):
+            if (column * size < x + width and x < (column + 1) * size and
+                    row * size < y + height and y < (row + 1) * size):
+                del self._tiles[(column, row)]
+
+    def _changed_tiles(self, old, new):
+        """
+        Internal Function. Finds the cached tiles whose pixels differ between
+        two images of the same size.
+
+        :Parameters:
+            old : Image
+                The image the tiles were made from.
+            new : Image
+                The new image.
+
+        :rtype: set
+        :returns: The (column, row) of each changed tile.
+        """
+        width = old.get_width()
+        channels = 4 if old.has_alpha() else 3
+        stride = width * channels
+        size = self._tile_size // self._magnification
+        tile_length = size * channels
+        old_data = memoryview(old.get_data()).cast('B')
+        new_data = memoryview(new.get_data()).cast('B')
+        cached = set(self._tiles)
+        cached_rows = {row for column, row in cached}
+        changed = set()
+        for y in range(old.get_height()):
+            row = y // size
+            if row not in cached_rows:
+                continue
+            start = y * stride
+            # compare whole rows first, most are either unchanged or changed
+            # everywhere.
+            if (old_data[start:start + stride].tobytes() ==
+                    new_data[start:start + stride].tobytes()):
+                continue
+            for column, tile_row in cached - changed:
+                if tile_row != row:
+                    continue
+                offset = start + column * tile_length
+                end = min(offset + tile_length, start + stride)
+                if (old_data[offset:end].tobytes() !=
+                        new_data[offset:end].tobytes()):
+                    changed.add((column, tile_row))
+        return changed
+
+    def get_tile(self, column, row):
+        """
+        Gets the bitmap for a tile, converting it if it isn't cached.
+
+        :Parameters:
+            column : int
+                The column of the tile, counting from the left.
+            row : int
+                The row of the tile, counting from the top.
+
+        :rtype: object
+        :returns: The bitmap returned by the convert function.
+        """
+        key = (column, row)
+        if key in self._tiles:
+            self._tiles.move_to_end(key)
+            return self._tiles[key]
+        magnification = self._magnification
+        size = self._tile_size // magnification
+        width, height = self._image.get_size()
+        x, y = column * size, row * size
+        tile = crop(width, height, self._image.get_data(), x, y,
+            min(size, width - x), min(size, height - y))
+        if magnification > 1:
+            tile = extensions.lib.core.quick_scale(*tile,
+                tile[0] * magnification, tile[1] * magnification)
+        bitmap = self._convert(*tile)
+        self._tiles[key] = bitmap
+        while len(self._tiles) > self._max_tiles:
+            self._tiles.popitem(last=False)
+        return bitmap
+
+    def visible_tiles(self, x, y, width, height):
+        """
+        Gets the tiles which cover part of a rectangle of the display (the
+        image after magnification).
+
+        :Parameters:
+            x : int
+                The left edge of the rectangle.
+            y : int
+                The top edge of the rectangle.
+            width : int
+                The width of the rectangle.
+            height : int
+                The height of the rectangle.
+
+        :rtype: list
+        :returns: The (column, row) of each tile.
+        """
+        if not self._image:
+            return list()
+        self._check_generation()
+        size = self._tile_size
+        image_width, image_height = self.get_display_size()
+        left, top = max(x, 0) // size, max(y, 0) // size
+        right = (min(x + width, image_width) - 1) // size
+        bottom = (min(y + height, image_height) - 1) // size
+        return [(column, row) for row in range(top, bottom + 1)
+            for column in range(left, right + 1)]
+
+    def get_display_size(self):
+        """
+        Get the size of the image on screen.
+
+        :rtype: tuple
+        :returns: A tuple containing the width and height of the image after
+            magnification, in pixels.
+        """
+        if not self._image:
+            return (0, 0)
+        width, height = self._image.get_size()
+        return (width * self._magnification, height * self._magnification)
+
+    def draw(self, dc, x, y, width, height):
+        """
+        Draws the part of the image inside a rectangle.
+
+        :Parameters:
+            dc : wx.DC
+                The device context to draw on. Display coordinates are
+                used.
+            x : int
+                The left edge of the rectangle.
+            y : int
+                The top edge of the rectangle.
+            width : int
+                The width of the rectangle.
+            height : int
+                The height of the rectangle.
+        """
+        size = self._tile_size
+        for column, row in self.visible_tiles(x, y, width, height):
+            dc.DrawBitmap(self.get_tile(column, row), column * size,
+                    row * size)
+
+
+def _changed_rows(old, new, stride, height):
+    """
+    Internal Function. Finds the rows which differ between two images of the
+    same size.
+
+    :Parameters:
+        old : memoryview
+            The data of the first image.
+        new : memoryview
+            The data of the second image.
+        stride : int
+            The length of a row in bytes.
+        height : int
+            The number of rows.
+
+    :rtype: tuple
+    :returns: A tuple (first, end) of the first changed row and the row
+        after the last changed one, or None if the images are the same.
+    """
+    band = max(1, BAND_SIZE // stride)
+
+    def same(start, end):
+        return (old[start * stride:end * stride].tobytes() ==
+                new[start * stride:end * stride].tobytes())
+
+    first = 0
+    while first < height and same(first, min(first + band, height)):
+        first += band
+    if first >= height:
+        return None
+    end = height
+    while same(max(end - band, first), end):
+        end -= band
+    # narrow the bands down to rows.
+    while same(first, first + 1):
+        first += 1
+    while same(end - 1, end):
+        end -= 1
+    return (first, end)
+
+
+class Pyramid:
+    """
+    An image along with copies of it at half, quarter, eighth... size, each
+    made by averaging 2x2 blocks of the one before. Levels are only made when
+    they are first asked for, and when a new version of the image is set only
+    the rows under the changed ones are remade.
+    """
+    def __init__(self):
+        """
+        Creates an empty Pyramid.
+        """
+        self._levels = list()
+
+    def set_image(self, image):
+        """
+        Sets the full size image.
+
+        :Parameters:
+            image : Image
+                The image, or None.
+        """
+        levels, self._levels = self._levels, [image] if image else list()
+        if not (image and levels and levels[0].get_size() ==
+                image.get_size() and levels[0].has_alpha() ==
+                image.has_alpha()) or len(levels) < 2:
+            return
+        width, height = image.get_size()
+        stride = memoryview(image.get_data()).nbytes // height
+        rows = _changed_rows(memoryview(levels[0].get_data()).cast('B'),
+            memoryview(image.get_data()).cast('B'), stride, height)
+        if rows is None:
+            self._levels = [image] + levels[1:]
+            return
+        first, end = rows
+        for level in levels[1:]:
+            source = self._levels[-1]
+            # blocks start on even rows of the level above.
+            first -= first % 2
+            end = min(end + end % 2, source.get_height())
+            source_stride = stride
+            width, height = level.get_size()
+            stride = memoryview(level.get_data()).nbytes // height
+            data = bytearray(level.get_data())
+            band = memoryview(source.get_data()).cast('B')[
+                first * source_stride:end * source_stride]
+            first, end = first // 2, (end + 1) // 2
+            extensions.lib.core.half_scale(source.get_width(),
+                band.nbytes // source_stride, band,
+                out=memoryview(data)[first * stride:end * stride])
+            self._levels.append(Image(width, height, data))
+
+    def get_level(self, level):
+        """
+        Gets the image at a level of the pyramid, making it (and the levels
+        before it) if needed.
+
+        :Parameters:
+            level : int
+                0 for the full size image, 1 for half size, 2 for quarter
+                size and so on. Levels past get_level_count() - 1 are the
+                last level.
+
+        :rtype: Image
+        :returns: The image at that level, or None if no image is set.
+        """
+        if not self._levels:
+            return None
+        level = min(level, self.get_level_count() - 1)
+        while len(self._levels) <= level:
+            last = self._levels[-1]
+            self._levels.append(Image(*extensions.lib.core.half_scale(
+                last.get_width(), last.get_height(), last.get_data())))
+        return self._levels[level]
+
+    def get_level_count(self):
+        """
+        Get the number of levels, the last being 1 pixel wide or high.
+
+        :rtype: int
+        :returns: The number of levels.
+        """
+        if not self._levels:
+            return 0
+        width, height = self._levels[0].get_size()
+        count = 1
+        while width > 1 and height > 1:
+            width, height = (width + 1) // 2, (height + 1) // 2
+            count += 1
+        return count
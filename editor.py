@@ -21,75 +21,68 @@ along with The Python Image Manipulation Project.  If not, see
 
 # library imports
 import os
-from glob import glob
-from sys import argv, platform
-from importlib import reload
+import inspect
+import threading
+from math import floor, log2
+from sys import argv
 import wx
 
-from image import Image
+import registry
+from image import Image, MappedImage
+from display import TileCache, Pyramid, crop
+from history import History
 
 # import the core module
-from error import ImageFormatError, UnsupportedImageTypeError, ExtensionError
 import extensions.lib.core
+from extensions.lib import gui
+# file reading and writing is shared with the batch mode, which runs without wx
+from formats import file_reader, reload_extensions, load_extensions, read, \
+        write, probe, debug
 
 
 
 # constants
 VERSION = "0.1"
 TITLE = "The PIMP"
-DEBUG = False
-MAXIMUM_UNDO_LIMIT = 10
+# the largest magnification, as a power of 2 (8x)
+MAXIMUM_ZOOM = 3
+
+# the memory and temporary file space the undo history may use
+UNDO_MEMORY_BUDGET = 256 << 20
+UNDO_DISK_BUDGET = 4 << 30
+# images with more bytes of pixels than this are kept in a memory mapped
+# temporary file instead of memory
+MAPPED_SIZE = 1 << 30
+
+# how often the progress of a running filter is shown, in milliseconds
+PROGRESS_INTERVAL = 100
+# how long the options of a filter have to stay the same before they are
+# previewed, in milliseconds
+PREVIEW_DELAY = 150
 
 #make sure we are in the right directory
 os.chdir(os.path.abspath(os.path.dirname(argv[0])))
 
-# C extensions
-if platform == "win32":
-    C_EXTENSIONS = ".pyd"
-else:
-    C_EXTENSIONS = ".so"
 
-# create dictionaries for storing file reader extensions.
-file_reader = {'ext' : dict(), 'marker' : dict()}
+def _takes_out(function):
+    """
+    Internal Function. Checks whether a filter's execute takes an out buffer
+    to write its result into, as the filters which keep the size of the
+    image do.
 
+    :Parameters:
+        function : function
+            The filter's execute function.
 
-def reload_extensions():
-    """
-    Reloads file reader extensions. Currently does not re-parse already loaded
-    extensions but will load new ones.
+    :rtype: bool
+    :returns: True if function has an out parameter.
     """
-    load_extensions()
+    try:
+        return "out" in inspect.signature(function).parameters
+    except (TypeError, ValueError):
+        # the C filters have no signature, and all of them take out.
+        return True
 
-def load_extensions():
-    """
-    Scans extension directories for available extensions and attempts to load
-    them.
-    """
-    # file reader extension path
-    format_ext_pkg = ("extensions", "format")
-    format_ext_dir = os.path.join(os.getcwd(), *format_ext_pkg)
-
-    debug("Loading file format extensions")
-    file_fmt_ext = \
-            glob(f'{format_ext_dir}{os.sep}*.py') + \
-            glob(f'{format_ext_dir}{os.sep}*{C_EXTENSIONS}')
-    for f in file_fmt_ext:
-        module = os.path.basename(f)
-        # import the module into a temporary variable for checking
-        module_name = '.'.join(format_ext_pkg + (module[:module.rindex(".")],))
-        exec ("import %s" % module_name)
-        tmp = eval(module_name)
-        if hasattr(tmp, "FILE_EXTENSION"):
-            if type(tmp.FILE_EXTENSION) in (list, tuple):
-                for ext in tmp.FILE_EXTENSION:
-                    file_reader['ext'][ext.lower()] = tmp
-            else:
-                file_reader['ext'][tmp.FILE_EXTENSION.lower()] = tmp
-        if hasattr(tmp, "FILE_MARKER"):
-            file_reader['marker'][tmp.FILE_MARKER] = tmp
-    for ext in file_reader['ext']:
-        debug(f"Loaded fileHandler for {ext} files")
-    debug()
 
 # ================================ FRAME CLASS =================================
 class Frame(wx.Frame):
@@ -104,23 +97,38 @@ class Frame(wx.Frame):
                 wx.DefaultSize)
         self._extra_menus = {}
         self._image = None
+        self._tiles = TileCache()
+        self._pyramid = Pyramid()
+        # the zoom as a power of 2, 0 is actual size, -1 half size...
+        self._zoom_level = 0
         self.set_image_file(None)
         self._scroller = wx.ScrolledWindow(self)
         self._panel = wx.Panel(self._scroller)
         self._scroller.EnableScrolling(True, True)
         self._extensions = dict()
-        self.CreateStatusBar()
+        # the Progress of the filter running on the worker thread, if any.
+        self._job = None
+        self._job_label = None
+        # the filter and options to preview, the Progress of the preview
+        # being made and the (x, y, bitmap) on screen.
+        self._preview_request = None
+        self._preview_job = None
+        self._preview = None
+        self._preview_timer = None
+        gui.set_preview_handler(self.show_preview)
+        self._build_status_bar()
         self._build_menu()
         self._load_menu_extensions()
-        self._undo_stack = list()
-        self._redo_stack = list()
+        self._history = History(UNDO_MEMORY_BUDGET, UNDO_DISK_BUDGET)
         self._window_is_dirty = False
 
         #self.Bind(wx.EVT_SIZE, self.onSize)
         self._panel.Bind(wx.EVT_SIZE, self.onPanelSize)
+        self._scroller.Bind(wx.EVT_SCROLLWIN, self.onScroll)
         self.Bind(wx.EVT_PAINT, self.onPaint)
         self.Bind(wx.EVT_MOVE, self.onMove)
         self.Bind(wx.EVT_IDLE, self.onIdle)
+        self.Bind(wx.EVT_TIMER, self.onProgressTimer, self._progress_timer)
 
     def set_image(self, image):
         """
@@ -130,15 +138,51 @@ class Frame(wx.Frame):
             image : Image
                 The image to be displayed.
         """
-        width = image.get_width()
-        height = image.get_height()
-        # set the sizes of our main frame and inner panel
-        self._scroller.SetScrollbars(1, 1, width, height)
+        self._image = image
+        self._pyramid.set_image(image)
+        width, height = self._update_display()
+        # fit the main frame around the image
         self.SetSize((width + 5, height + 52))
+
+    def _new_image(self, width, height, data):
+        """
+        Internal Function. Makes an Image of pixels read from a file or
+        returned by a filter, in a memory mapped file if it is larger than
+        MAPPED_SIZE.
+
+        :Parameters:
+            width : int
+                The width of the image in pixels.
+            height : int
+                The height of the image in pixels.
+            data : buffer
+                The image data.
+
+        :rtype: Image
+        :returns: An Image, or a MappedImage for a large image.
+        """
+        if memoryview(data).nbytes <= MAPPED_SIZE:
+            return Image(width, height, data)
+        return MappedImage(width, height, data)
+
+    def _update_display(self):
+        """
+        Internal Function. Shows the image at the current zoom, drawing from
+        the pyramid level nearest to it.
+
+        :rtype: tuple
+        :returns: The width and height of the image on screen.
+        """
+        level = max(0, -self._zoom_level)
+        magnification = 1 << max(0, self._zoom_level)
+        # Only the tiles a new image changed are converted again.
+        self._tiles.set_image(self._pyramid.get_level(level), magnification)
+        width, height = self._tiles.get_display_size()
+        # set the sizes of our inner panel and repaint the frame.
+        self._scroller.SetScrollbars(1, 1, width, height)
         self._panel.SetSize((width, height))
-        # set the image and repaint the frame to display it.
-        self._image = image
         self.Refresh()
+        return (width, height)
 
     # ============================== EVENT HANDLERS ============================
     def Refresh(self):
@@ -161,6 +205,17 @@ class Frame(wx.Frame):
         """
         self.Refresh()
 
+    def onScroll(self, event=None):
+        """
+        Internal Function. Called when the window is scrolled, which brings new
+        tiles into view.
+        """
+        self.Refresh()
+        if self._preview_request:
+            self.show_preview(*self._preview_request)
+        if event:
+            event.Skip()
+
     def onIdle(self, event=None):
         """
         Internal Function. Called when the application becomes idle.
@@ -181,11 +236,37 @@ class Frame(wx.Frame):
 
     def paint(self):
         """
-        Internal Function. Called when the window needs to be repainted.
+        Internal Function. Called when the window needs to be repainted. Only
+        the tiles in the visible part of the image are drawn.
         """
         if self._image:
             dc = wx.WindowDC(self._panel)
-            dc.DrawBitmap(self._get_bitmap(), 0, 0)
+            x, y = self._scroller.CalcUnscrolledPosition(0, 0)
+            width, height = self._scroller.GetClientSize()
+            self._tiles.draw(dc, x, y, width, height)
+            if self._preview:
+                dc.DrawBitmap(*self._preview)
+
+    def onStatusBarSize(self, event=None):
+        """
+        Internal Function. Keeps the progress bar in its field of the status
+        bar.
+        """
+        rect = self.GetStatusBar().GetFieldRect(1)
+        self._progress_bar.SetPosition((rect.x + 2, rect.y + 2))
+        self._progress_bar.SetSize((rect.width - 4, rect.height - 4))
+        if event:
+            event.Skip()
+
+    def onProgressTimer(self, event=None):
+        """
+        Internal Function. Shows how far the running filter has got.
+        """
+        if self._job:
+            percent = int(self._job.get_fraction() * 100)
+            self._progress_bar.SetValue(percent)
+            self.SetStatusText(f"{self._job_label}: {percent}% "
+                    "(Esc to cancel)")
 
     def _check_scrollbars(self, event=None):
         if self._image:
@@ -200,20 +281,64 @@ class Frame(wx.Frame):
 
     # ================================ END EVENT HANDLERS ==================================
 
-    def _get_bitmap(self):
+    def _zoom(self, zoom_level):
+        """
+        Internal Function. Sets the zoom.
+
+        :Parameters:
+            zoom_level : int
+                The zoom as a power of 2, e.g. 1 for double size, -2 for
+                quarter size. It is limited to between the size at which the
+                whole image is a single pixel wide or high and MAXIMUM_ZOOM.
+        """
+        if self._image:
+            minimum = 1 - self._pyramid.get_level_count()
+            self._zoom_level = min(max(zoom_level, minimum), MAXIMUM_ZOOM)
+            self._update_display()
+            if self._preview_request:
+                self._preview = None
+                self.show_preview(*self._preview_request)
+
+    def zoom_in(self, event=None):
+        """
+        Doubles the size of the image on screen.
+        """
+        self._zoom(self._zoom_level + 1)
+
+    def zoom_out(self, event=None):
+        """
+        Halves the size of the image on screen.
+        """
+        self._zoom(self._zoom_level - 1)
+
+    def zoom_actual(self, event=None):
         """
-        Returns a copy of the application's image for display. This allows a
-        different image to be displayed on the screen than is stored internally,
-        i.e. for zooming.
+        Shows the image at its actual size.
         """
-        return extensions.lib.core.data_to_bitmap(self._image.get_width(),
-                                                  self._image.get_height(),
-                                                  self._image.get_data())
+        self._zoom(0)
 
-    def _zoom(self, event=None):
+    def zoom_fit(self, event=None):
         """
-        As of yet, this does nothing.
+        Shows the image at the largest zoom at which it fits in the window.
         """
+        if self._image:
+            width, height = self._scroller.GetClientSize()
+            fit = min(width / self._image.get_width(),
+                    height / self._image.get_height())
+            self._zoom(floor(log2(fit)) if fit > 0 else 0)
+
+    def _build_status_bar(self):
+        """
+        Internal Function. Creates the status bar, with a progress bar for
+        running filters in its second field.
+        """
+        status_bar = self.CreateStatusBar(2)
+        status_bar.SetStatusWidths([-1, 150])
+        self._progress_bar = wx.Gauge(status_bar, range=100)
+        self._progress_bar.Hide()
+        self._progress_timer = wx.Timer(self)
+        status_bar.Bind(wx.EVT_SIZE, self.onStatusBarSize)
+        self.onStatusBarSize()
 
     def _build_menu(self):
         """
@@ -226,6 +351,8 @@ class Frame(wx.Frame):
         self.menu_bar.Append(file_menu, "&File")
         edit_menu = wx.Menu()
         self.menu_bar.Append(edit_menu, "&Edit")
+        view_menu = wx.Menu()
+        self.menu_bar.Append(view_menu, "&View")
         # ============ ADD ITEMS TO THE MENU =============
         self.Bind(wx.EVT_MENU, self.open_file,
                 file_menu.Append(-1, "&Open", "Open a file"))
@@ -243,6 +370,16 @@ class Frame(wx.Frame):
             "&Undo", "Undo the last change"))
         self.Bind(wx.EVT_MENU, self.redo,
                 edit_menu.Append(-1, "&Redo", "Redo the last undone change"))
+        self.Bind(wx.EVT_MENU, self.cancel_filter, edit_menu.Append(-1,
+            "&Cancel Filter\tEsc", "Stop the filter which is running"))
+        self.Bind(wx.EVT_MENU, self.zoom_in, view_menu.Append(-1,
+            "Zoom &In\tCtrl++", "Double the size of the image on screen"))
+        self.Bind(wx.EVT_MENU, self.zoom_out, view_menu.Append(-1,
+            "Zoom &Out\tCtrl+-", "Halve the size of the image on screen"))
+        self.Bind(wx.EVT_MENU, self.zoom_actual, view_menu.Append(-1,
+            "&Actual Size\tCtrl+0", "Show the image at its actual size"))
+        self.Bind(wx.EVT_MENU, self.zoom_fit, view_menu.Append(-1,
+            "Zoom to &Fit", "Fit the image in the window"))
 
     def set_image_file(self, filename):
         """
@@ -271,10 +408,11 @@ class Frame(wx.Frame):
             dialog.Destroy()
         if filename:
             self.set_image_file(filename)
-            self.set_image(read(filename))
+            image = read(filename)
+            self.set_image(self._new_image(image.get_width(),
+                image.get_height(), image.get_data()))
             # clear the undo and redo stacks
-            self._undo_stack = list()
-            self._redo_stack = list()
+            self._history.clear()
 
     def save_file(self, event=None):
         """
@@ -299,17 +437,25 @@ class Frame(wx.Frame):
         """
         Rolls back the last change made to an image.
         """
-        if self._undo_stack:
-            self._redo_stack.append(self._image)
-            self.set_image(self._undo_stack.pop())
+        image = self._history.undo(self._image)
+        if image:
+            self.set_image(image)
 
     def redo(self, event=None):
         """
         Reapplies the last undone change to an image.
         """
-        if self._redo_stack:
-            self._undo_stack.append(self._image)
-            self.set_image(self._redo_stack.pop())
+        image = self._history.redo(self._image)
+        if image:
+            self.set_image(image)
+
+    def cancel_filter(self, event=None):
+        """
+        Stops the filter which is running. The image is left as it was.
+        """
+        if self._job:
+            self._job.cancel()
+            self.SetStatusText(f"{self._job_label}: cancelling")
 
 
     # ====================== EXTENSION LOADING METHODS =========================
@@ -329,22 +475,13 @@ class Frame(wx.Frame):
 
     def _load_menu_extensions(self):
         """
-        Internal Function. Loads Extensions that create menu items.
+        Internal Function. Loads Extensions that create menu items. The menus
+        are built from the registry, each extension is imported the first time
+        its menu item is used.
         """
-        # menu item extension path
-        menu_ext_pkg = ("extensions", "menu")
-        menu_ext_dir = os.path.join(os.getcwd(), *menu_ext_pkg)
-
         debug("Loading menu items")
-        menu_ext = \
-                glob(f'{menu_ext_dir}{os.sep}*.py') + \
-                glob(f'{menu_ext_dir}{os.sep}*{C_EXTENSIONS}')
-        for f in menu_ext:
-            module_file = os.path.basename(f)
-            module_name = '.'.join((*menu_ext_pkg,
-                module_file[: module_file.index(".")]))
-            module = getattr(__import__(module_name).menu,
-                    module_name[module_name.rfind('.')+1:])
+        for module in registry.load(("extensions", "menu")):
+            module_file = module.__name__
 
             if hasattr(module, "MENU") and hasattr(module, "LABEL"):
                 self._extensions['.'.join((module.MENU, module.LABEL))] = module
@@ -358,7 +495,7 @@ class Frame(wx.Frame):
                             Menu(self, self.menu_bar, menu_path[0])
                 menu = self._extra_menus[menu_path[0].replace('&', '')]
                 if not menu.add_item(menu_path[1:], module):
-                    reload(module)
+                    registry.reload(module)
 
 
                 debug(f"Loaded module {module_file}")
@@ -367,35 +504,215 @@ class Frame(wx.Frame):
                 # the module does not have the correct 'constants' defined.
                 debug(f"{module_file} is not a valid module.")
 
-    def _filter_handler(self, handler):
+    def _filter_handler(self, module):
         """
         Internal Function. Creates a custom dynamic handler for menu items.
+        The filter runs on a worker thread so the window keeps responding,
+        with its progress shown in the status bar.
         """
         # define a new function and return it.
         def f(evt):
-            if self._image:
-                new_img_data = handler(self._image.get_width(),
-                        self._image.get_height(),
-                        extensions.lib.core.string_copy(
-                            bytes(self._image.get_data())))
-            else:
-                handler(1, 1, "\x00")
-                new_img_data = False
-            # set this frame's image to the one returned by the filter.
-            if (new_img_data and len(new_img_data) == 3):
-                self._redo_stack = list()
-                self._undo_stack.append(self._image)
-                while len(self._undo_stack) > MAXIMUM_UNDO_LIMIT:
-                    del self._undo_stack[0]
-                self.set_image(Image(*new_img_data))
+            if self._job:
+                # one at a time, the next would start from the image this one
+                # is about to replace.
+                wx.Bell()
+                return
+            self._job = extensions.lib.core.Progress()
+            self._job_label = module.LABEL.replace('&', '')
+            self.SetStatusText(f"{self._job_label}: 0% (Esc to cancel)")
+            self._progress_bar.SetValue(0)
+            self._progress_bar.Show()
+            self._progress_timer.Start(PROGRESS_INTERVAL)
+            threading.Thread(target=self._run_filter,
+                    args=(module, self._image, self._job),
+                    name=f"filter {module.__name__}", daemon=True).start()
         return f
+
+    def _run_filter(self, module, image, progress):
+        """
+        Internal Function. Runs a filter on the worker thread and hands the
+        result to _filter_done on the main thread.
+
+        :Parameters:
+            module : LazyModule
+                The menu extension.
+            image : Image
+                The image to filter. It isn't changed.
+            progress : Progress
+                Follows the filter's kernels, and stops them if it is
+                cancelled.
+        """
+        result = error = target = None
+        try:
+            with progress:
+                # looked up here so the module is only imported once it's used.
+                handler = module.execute
+                if isinstance(image, MappedImage) and _takes_out(handler):
+                    # the result is written straight into a new mapped file,
+                    # rather than into memory and then copied.
+                    target = MappedImage(image.get_width(), image.get_height(),
+                            channels=4 if image.has_alpha() else 3)
+                    result = handler(image.get_width(), image.get_height(),
+                            image.get_data(), out=target.get_data())
+                elif image:
+                    result = handler(image.get_width(), image.get_height(),
+                            image.get_data())
+                else:
+                    handler(1, 1, "\x00")
+        except extensions.lib.core.Cancelled:
+            pass
+        except Exception as e:
+            error = e
+        wx.CallAfter(self._filter_done, image, progress, result, error, target)
+
+    def _filter_done(self, image, progress, result, error, target=None):
+        """
+        Internal Function. Called on the main thread when a filter finishes,
+        to replace the image with the filter's result.
+
+        :Parameters:
+            image : Image
+                The image the filter was run on.
+            progress : Progress
+                The Progress the filter ran with.
+            result : tuple
+                The (width, height, data) returned by the filter, or None.
+            error : Exception
+                The exception raised by the filter, or None.
+            target : MappedImage
+                The image the filter was given as out, or None.
+        """
+        self._job = None
+        self._progress_timer.Stop()
+        self._progress_bar.Hide()
+        self._clear_preview()
+        # the result is dropped if the image was replaced (by undo, or opening
+        # a file) while the filter ran.
+        accepted = not progress.is_cancelled() and not error and result and \
+            len(result) == 3 and image is self._image
+        if target is not None and not (accepted and
+                result[2] is target.get_data()):
+            # the filter failed or didn't write into it.
+            target.close()
+            target = None
+        if progress.is_cancelled():
+            self.SetStatusText(f"{self._job_label}: cancelled")
+            return
+        self.SetStatusText("")
+        if error:
+            raise error
+        if accepted:
+            self._history.push(self._image)
+            self.set_image(target if target is not None else
+                self._new_image(*result))
     # =================== END EXTENSION LOADING METHODS ========================
 
+    # ============================ PREVIEW METHODS =============================
+    def show_preview(self, function, args):
+        """
+        Previews a filter on the part of the image on screen, once the options
+        stop changing. The filter is applied to the pyramid level being
+        displayed, so a zoomed out image is previewed at low resolution. This
+        is the preview handler extensions reach through gui.preview.
+
+        :Parameters:
+            function : function
+                The filter, called as function(width, height, data, *args).
+            args : tuple
+                The options to pass to the filter.
+        """
+        self._preview_request = (function, args)
+        if self._preview_timer:
+            self._preview_timer.Start(PREVIEW_DELAY)
+        else:
+            self._preview_timer = wx.CallLater(PREVIEW_DELAY,
+                    self._start_preview)
+
+    def _start_preview(self):
+        """
+        Internal Function. Starts making the preview on a worker thread,
+        cancelling the one being made.
+        """
+        if not (self._image and self._preview_request):
+            return
+        if self._preview_job:
+            self._preview_job.cancel()
+        function, args = self._preview_request
+        image = self._pyramid.get_level(max(0, -self._zoom_level))
+        magnification = 1 << max(0, self._zoom_level)
+        x, y = self._scroller.CalcUnscrolledPosition(0, 0)
+        width, height = self._scroller.GetClientSize()
+        # the part of the pyramid level on screen
+        left = max(0, x // magnification)
+        top = max(0, y // magnification)
+        right = min(image.get_width(), -(-(x + width) // magnification))
+        bottom = min(image.get_height(), -(-(y + height) // magnification))
+        if right <= left or bottom <= top:
+            return
+        region = crop(image.get_width(), image.get_height(), image.get_data(),
+                left, top, right - left, bottom - top)
+        self._preview_job = extensions.lib.core.Progress()
+        threading.Thread(target=self._run_preview, args=(function, args,
+                region, (left * magnification, top * magnification),
+                magnification, self._preview_job), daemon=True).start()
+
+    def _run_preview(self, function, args, region, position, magnification,
+            progress):
+        """
+        Internal Function. Applies a filter to the previewed region on a
+        worker thread and hands the result to _preview_done.
+        """
+        result = None
+        try:
+            with progress:
+                result = function(*region, *args)
+                if result and magnification > 1:
+                    result = extensions.lib.core.quick_scale(*result,
+                            result[0] * magnification,
+                            result[1] * magnification)
+        except extensions.lib.core.Cancelled:
+            return
+        except Exception as e:
+            # the filter reports its errors when it is run for real.
+            debug(f"The preview failed: {e}")
+            return
+        wx.CallAfter(self._preview_done, progress, position, result)
+
+    def _preview_done(self, progress, position, result):
+        """
+        Internal Function. Shows a finished preview, unless it has been
+        replaced or dropped since it was started.
+        """
+        if progress is not self._preview_job or progress.is_cancelled():
+            return
+        self._preview_job = None
+        if result and len(result) == 3:
+            self._preview = (extensions.lib.core.data_to_bitmap(*result),
+                    *position)
+            self.Refresh()
+
+    def _clear_preview(self):
+        """
+        Internal Function. Drops the preview and any preview being made.
+        """
+        if self._preview_timer:
+            self._preview_timer.Stop()
+        if self._preview_job:
+            self._preview_job.cancel()
+        self._preview_request = None
+        self._preview_job = None
+        if self._preview:
+            self._preview = None
+            self.Refresh()
+    # ========================== END PREVIEW METHODS ===========================
+
 
     def onExit(self, event):
         """
         Internal function. Closes the program.
         """
+        self.cancel_filter()
+        self._history.close()
         self.Close(True)
 
 # ============================ END FRAME CLASS =================================
@@ -427,86 +744,6 @@ class Menu:
             self._items[label] = \
                     wx.MenuItem(self._menu, -1, module.LABEL, module.DESCRIPTION)
             self._editor.Bind(
-                    wx.EVT_MENU, self._editor._filter_handler(module.execute),
+                    wx.EVT_MENU, self._editor._filter_handler(module),
                     self._menu.Append(-1, module.LABEL, module.DESCRIPTION))
             return True
-
-def write(filename, image):
-    """
-    Writes an image out to file. The image format must be supported by a file
-    format extension.
-
-    :Parameters:
-        filename : string
-            The path to the file to be written.
-        image : Image
-            The Image containing the data to be written.
-    """
-    width, height = image.get_size()
-    img_ext = filename[filename.index('.') + 1 :].lower() # get the file ext
-
-    if img_ext not in file_reader['ext']:
-        raise UnsupportedImageTypeError(f"File extension '{img_ext}' has no "
-            "extension associated with it")
-    if not hasattr(file_reader['ext'][img_ext], "write"):
-        raise UnsupportedImageTypeError("The extension for handling files of "
-            f"type '{img_ext}' contains no method for writing.")
-    try:
-        return file_reader['ext'][img_ext].write(filename, width, height,
-                extensions.lib.core.string_copy(bytes(image.get_data())))
-    except:
-        raise # TODO: show an error dialog
-
-
-def read(filename):
-    """
-    Calls the appropriate extension to read the image file, if one exists.
-
-    :Paramters:
-        filename : string
-            The name of the file to be read.
-    """
-    img_ext = filename[filename.index('.') + 1:].lower() # get the file ext
-    try:
-        if not img_ext in file_reader['ext']:
-            raise UnsupportedImageTypeError(f"File extension '{img_ext}' has "
-                "no extension associated with it")
-        if not hasattr(file_reader['ext'][img_ext], "read"):
-            raise UnsupportedImageTypeError("The extension for handling files "
-                f"of type '{img_ext}' contains no method for reading.")
-        img_data =  file_reader['ext'][img_ext].read(filename)
-
-    except ImageFormatError as message:
-        debug(message)
-        image_file = open(filename, 'rb')
-        file_marker = image_file.read(2)
-        image_file.close()
-        if not file_marker not in file_reader['marker']:
-            image_file.close()
-            raise UnsupportedImageTypeError(
-                    "This image type has no extension associated with it")
-
-        if hasattr(file_reader['marker'][file_marker], 'DESCRIPTION'):
-            debug(f"File '{filename}' was found to be an incorrectly named as "
-                f"a '{file_reader['marker'][file_marker].DESCRIPTION}' file)")
-        else:
-            debug("File '{filename}' was found to be an incorrectly named file")
-        img_data = file_reader['marker'][file_marker].read(filename)
-
-    if len(img_data) != 3:
-        raise ExtensionError(f"File format extension for '{img_ext}' returned "
-           "an invalid number of arguments")
-    width, height, data = img_data
-    returnvalue = Image(width, height, data)
-
-    return returnvalue
-
-
-def debug(string=""):
-    """
-    Internal Function that handles debug output for the program.
-    """
-    if DEBUG:
-        print(string)
-
-load_extensions() # call the function to load all available extensions.
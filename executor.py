@@ -0,0 +1,291 @@
+"""
+executor.py
+Copyright 2007 Thomas McGrew
+
+This file is part of The Python Image Manipulation Project.
+
+The Python Image Manipulation Project is free software: you can
+redistribute it and/or modify it under the terms of the GNU General
+Public License as published by the Free Software Foundation, either
+version 2 of the License, or (at your option) any later version.
+
+The Python Image Manipulation Project is distributed in the hope
+that it will be useful, but WITHOUT ANY WARRANTY; without even the
+implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with The Python Image Manipulation Project.  If not, see
+<http://www.gnu.org/licenses/>.
+
+Runs chains of filters on images which are already in memory in a pool of
+worker processes. Image data is not pickled: each image is copied once into
+a block of shared memory, and the workers are only sent the name of the
+block. A worker runs the filters on the data in shared memory and writes
+the result back into the same block when it fits (or into a new block when
+the image got bigger). When the worker has finished, the result is copied
+out into a new bytearray for the Image returned and the block is freed, so
+the only copies made are the one into shared memory and the one back out of
+it.
+
+    with SharedMemoryExecutor(max_in_flight=8) as executor:
+        for image in executor.map(images, [("sepia", (), {})]):
+            ...
+
+The number of images being filtered at once is limited, and submit blocks
+until one of them is done, so feeding the executor from a generator keeps
+the memory used bounded however many images there are.
+"""
+
+# library imports
+import os
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from threading import BoundedSemaphore
+
+from image import Image
+from batch import apply_chain, _start_worker
+
+
+def _run_chain(name, size, width, height, chain):
+    """
+    Internal Function. Runs in a worker process. Applies a chain of filters
+    to an image held in shared memory and stores the result in shared memory.
+
+    :Parameters:
+        name : string
+            The name of the shared memory block holding the image.
+        size : int
+            The number of bytes of image data in the block.
+        width : int
+            The width of the image in pixels.
+        height : int
+            The height of the image in pixels.
+        chain : list
+            The (module_name, args, kwargs) tuples for the filters to apply,
+            in order.
+
+    :rtype: tuple
+    :returns: A tuple (name, width, height, size) describing the result.
+        name is the name of the block the result is in, which is the block
+        passed in unless the result was too big for it.
+    """
+    block = SharedMemory(name)
+    data = block.buf[:size]
+    result = None
+    try:
+        width, height, result = apply_chain(width, height, data, chain)
+        if result is data:
+            # nothing was changed, or the filters wrote their result into
+            # the data they were given.
+            return (name, width, height, size)
+        result = memoryview(result).cast('B')
+        if result.nbytes > block.size:
+            name = _store(result)
+        else:
+            block.buf[:result.nbytes] = result
+        return (name, width, height, result.nbytes)
+    finally:
+        # the block can only be closed once nothing refers to its memory.
+        if result is not None:
+            result.release()
+        data.release()
+        block.close()
+
+
+def _store(data):
+    """
+    Internal Function. Copies data into a new block of shared memory. The
+    block is not unlinked here, the process it is handed to owns it.
+
+    :Parameters:
+        data : memoryview
+            The bytes to store.
+
+    :rtype: string
+    :returns: The name of the new block.
+    """
+    block = SharedMemory(create=True, size=max(data.nbytes, 1))
+    block.buf[:data.nbytes] = data
+    name = block.name
+    block.close()
+    return name
+
+
+class SharedMemoryExecutor:
+    """
+    Applies chains of filters from extensions/menu to Images in a pool of
+    worker processes, passing the images through shared memory.
+
+    Chains are lists of (module_name, args, kwargs) tuples, as returned by
+    batch.parse_filter. The arguments must include everything the filter
+    would otherwise ask for with a dialog. The Images submitted are not
+    changed, each result is a new Image.
+    """
+    def __init__(self, max_workers=None, max_in_flight=None, threads=1):
+        """
+        Starts the worker processes.
+
+        :Parameters:
+            max_workers : int
+                The number of worker processes. Defaults to one per
+                processor.
+            max_in_flight : int
+                The most images which may be in shared memory at once. An
+                image's block is held from submit until its worker finishes,
+                when the result is copied out and the block freed, so submit
+                blocks while this many are queued or being filtered. map
+                also holds back at most this many finished results. Defaults
+                to twice the number of workers, which keeps every worker
+                busy.
+            threads : int
+                The number of threads each worker's C filters use. Defaults
+                to 1.
+        """
+        max_workers = max_workers or os.cpu_count() or 1
+        max_in_flight = max_in_flight or max_workers * 2
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least 1")
+
+        # fork where it's available so the workers don't re-import the
+        # program.
+        context = None
+        if "fork" in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context("fork")
+        self._pool = ProcessPoolExecutor(max_workers=max_workers,
+            mp_context=context, initializer=_start_worker,
+            initargs=(threads,))
+        self._slots = BoundedSemaphore(max_in_flight)
+        self._max_in_flight = max_in_flight
+
+    def submit(self, image, chain):
+        """
+        Schedules a chain of filters to be applied to an image. Blocks while
+        the maximum number of images are in flight.
+
+        :Parameters:
+            image : Image
+                The image to filter. It is copied, so it may be changed as
+                soon as this returns.
+            chain : list
+                The (module_name, args, kwargs) tuples for the filters to
+                apply, in order.
+
+        :rtype: concurrent.futures.Future
+        :returns: A Future for the filtered Image.
+        """
+        self._slots.acquire()
+        try:
+            data = memoryview(image.get_data()).cast('B')
+            block = SharedMemory(create=True, size=max(data.nbytes, 1))
+        except BaseException:
+            self._slots.release()
+            raise
+        try:
+            block.buf[:data.nbytes] = data
+            job = self._pool.submit(_run_chain, block.name, data.nbytes,
+                image.get_width(), image.get_height(), chain)
+        except BaseException:
+            self._release(block)
+            raise
+        future = Future()
+        job.add_done_callback(
+            lambda job: self._collect(job, block, future))
+        return future
+
+    def map(self, images, chain):
+        """
+        Applies a chain of filters to each of a sequence of images. Images
+        are taken from the sequence only as slots become free, so it may be
+        a generator which reads them from disk.
+
+        :Parameters:
+            images : iterable
+                The Images to filter.
+            chain : list
+                The (module_name, args, kwargs) tuples for the filters to
+                apply, in order.
+
+        :rtype: generator
+        :returns: The filtered Images, in the order of images.
+        """
+        pending = deque()
+        for image in images:
+            # finished results wait here until the ones before them are
+            # done, so they are limited the same way as images in flight.
+            if len(pending) >= self._max_in_flight:
+                yield pending.popleft().result()
+            pending.append(self.submit(image, chain))
+            while pending[0].done():
+                yield pending.popleft().result()
+                if not pending:
+                    break
+        while pending:
+            yield pending.popleft().result()
+
+    def _collect(self, job, block, future):
+        """
+        Internal Function. Called when a worker has finished with an image.
+        Copies the result out of shared memory, frees the shared memory and
+        the slot, and completes the Future.
+
+        :Parameters:
+            job : concurrent.futures.Future
+                The Future for _run_chain.
+            block : SharedMemory
+                The block the image was passed in.
+            future : concurrent.futures.Future
+                The Future returned by submit.
+        """
+        try:
+            name, width, height, size = job.result()
+            if name == block.name:
+                result = Image(width, height, bytearray(block.buf[:size]))
+            else:
+                other = SharedMemory(name)
+                try:
+                    result = Image(width, height, bytearray(other.buf[:size]))
+                finally:
+                    self._release(other, False)
+        except BaseException as error:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+        finally:
+            self._release(block)
+
+    def _release(self, block, slot=True):
+        """
+        Internal Function. Frees a block of shared memory.
+
+        :Parameters:
+            block : SharedMemory
+                The block to free.
+            slot : bool
+                Whether the block held an image submitted to this executor,
+                in which case its slot is released. Defaults to True.
+        """
+        block.close()
+        block.unlink()
+        if slot:
+            self._slots.release()
+
+    def shutdown(self, wait=True):
+        """
+        Stops the worker processes once the images already submitted are
+        done.
+
+        :Parameters:
+            wait : bool
+                Whether to wait for the workers to finish. Defaults to True.
+        """
+        self._pool.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        return False
@@ -19,8 +19,18 @@ along with The Python Image Manipulation Project.  If not, see
 <http://www.gnu.org/licenses/>.
 
 
-This extension currently only supports the reading of 4 and 24-bit bitmaps
-and the writing of 24-bit bitmaps. Other formats are planned for later implementation.
+This extension reads uncompressed 1, 4, 8, 24 and 32-bit bitmaps with any of
+the headers below (and the larger V4/V5 headers, whose extra fields are only
+used for the alpha mask). Images without alpha are written as 24-bit bitmaps
+with a Windows V3 header, images with alpha as 32-bit bitmaps with a V4 header.
+wxPython is not needed.
+
+The pixel array is memory mapped and converted one row at a time, so reading
+a file doesn't need more memory than the image itself. Rows are stored bottom
+to top (top to bottom if the height is negative), each padded to a multiple of
+4 bytes, with the colors in blue, green, red order. Files with fewer than 16
+bits per pixel store palette indexes, the palette follows the header with 4
+bytes (blue, green, red, unused) per color, or 3 bytes for the OS/2 V1 header.
 
 Bitmap Header Information:
 
@@ -54,7 +64,20 @@ offset  length  purpose
 46      4       Store the number of colors used.
 50      4       Store the number of important colors used. This field can be 0 when every color is important.
 
-Compression Methods (not currently supported)
+Windows V4 header (the V3 header followed by):
+offset  length  purpose
+54      4       The red channel bit mask, used with compression method 3.
+58      4       The green channel bit mask, used with compression method 3.
+62      4       The blue channel bit mask, used with compression method 3.
+66      4       The alpha channel bit mask.
+70      4       The color space type.
+74      36      The color space end points.
+110     12      The red, green and blue gamma.
+With a V3 header the red, green and blue masks follow the header instead if
+the compression method is 3.
+
+Compression Methods (only 0, and 3 with masks covering whole bytes, are
+supported)
 number  type              comments
 0       none              Most common
 1       RLE 8-bit/pixel   Can be used only with 8-bit/pixel bitmaps
@@ -64,8 +87,13 @@ number  type              comments
 5       PNG               The bitmap contains a PNG image
 """
 
-from wx import Image, BITMAP_TYPE_BMP
-from extensions.lib.core import to_rgb
+
+import os
+from mmap import mmap, ACCESS_READ
+from struct import pack, unpack_from
+
+from error import ImageFormatError, ImageReadError
+from extensions.lib.core import open_file
 
 # register the extension(s) for this to read
 FILE_EXTENSION = "bmp"
@@ -74,27 +102,308 @@ FILE_MARKER = b"BM"
 # description of this format
 DESCRIPTION = "Windows Bitmap Format"
 
+# header sizes
+V1_HEADER = 12
+V3_HEADER = 40
+V4_HEADER = 108
+# the smallest headers containing the red, green and blue masks and the alpha
+# mask (BITMAPV2INFOHEADER and BITMAPV3INFOHEADER)
+MASK_HEADER = 52
+ALPHA_HEADER = 56
+
+# compression methods
+BI_RGB = 0
+BI_BITFIELDS = 3
+
+# the masks used for 32-bit pixels (blue, green, red, alpha in memory)
+RED_MASK = 0x00ff0000
+GREEN_MASK = 0x0000ff00
+BLUE_MASK = 0x000000ff
+ALPHA_MASK = 0xff000000
+
+# LCS_sRGB, the color space written to V4 headers
+SRGB = 0x73524742
+# the resolution written to new files, 72 dpi in pixels per meter
+RESOLUTION = 2835
+
+
+def _stride(width, bits):
+    """
+    Internal Function. Gets the length of a row of pixels in the file.
+
+    :Parameters:
+        width : int
+            The width of the image in pixels.
+        bits : int
+            The number of bits per pixel.
+
+    :rtype: int
+    :returns: The length of a row including its padding, in bytes.
+    """
+    return (width * bits + 31) // 32 * 4
+
+
+def _mask_byte(mask):
+    """
+    Internal Function. Gets the position within a 32-bit pixel of the channel
+    selected by a bit mask.
+
+    :Parameters:
+        mask : int
+            The bit mask for the channel.
+
+    :rtype: int
+    :returns: The index of the byte holding the channel.
+    """
+    for i in range(4):
+        if mask == 0xff << (i * 8):
+            return i
+    raise ImageReadError(f"Unsupported bitmap channel mask 0x{mask:08x}, "
+        "only masks covering a whole byte can be read")
+
+
+def _unpack_tables(bits):
+    """
+    Internal Function. Builds translation tables for splitting bytes holding
+    several palette indexes into one index per byte.
+
+    :Parameters:
+        bits : int
+            The number of bits per pixel, 1, 2 or 4.
+
+    :rtype: list
+    :returns: A list of 8 / bits tables. Table k gives the index of pixel k
+        of each byte, counting from the most significant bits.
+    """
+    mask = (1 << bits) - 1
+    return [bytes((value >> (8 - bits * (k + 1))) & mask
+        for value in range(256)) for k in range(8 // bits)]
+
+
+def _read_rows(view, offset, stride, width, height, top_down, bits, palette,
+        positions, channels):
+    """
+    Internal Function. Converts the pixel array of a bitmap one row at a time.
+
+    :Parameters:
+        view : memoryview
+            The contents of the file.
+        offset : int
+            The position of the pixel array in the file.
+        stride : int
+            The length of a row in the file.
+        width : int
+            The width of the image in pixels.
+        height : int
+            The height of the image in pixels.
+        top_down : bool
+            Whether the first row in the file is the top of the image.
+        bits : int
+            The number of bits per pixel.
+        palette : tuple
+            The red, green and blue translation tables for palette images,
+            otherwise None.
+        positions : tuple
+            The byte positions of red, green, blue (and alpha) within a pixel
+            for images without a palette.
+        channels : int
+            The number of channels to produce, 3 or 4.
+
+    :rtype: bytearray
+    :returns: The image data.
+    """
+    data = bytearray(width * height * channels)
+    out = memoryview(data)
+    length = width * channels
+    if bits < 8:
+        unpack = _unpack_tables(bits)
+        per_byte = len(unpack)
+        used = (width + per_byte - 1) // per_byte
+        indexes = bytearray(used * per_byte)
+
+    for row in range(height):
+        start = offset + (row if top_down else height - 1 - row) * stride
+        dest = out[row * length:(row + 1) * length]
+        if palette:
+            if bits == 8:
+                source = bytes(view[start:start + width])
+            else:
+                source = bytes(view[start:start + used])
+                for k, table in enumerate(unpack):
+                    indexes[k::per_byte] = source.translate(table)
+                source = bytes(indexes[:width])
+            for channel, table in enumerate(palette):
+                dest[channel::3] = source.translate(table)
+        else:
+            size = bits // 8
+            source = view[start:start + width * size]
+            for channel, position in enumerate(positions):
+                dest[channel::channels] = source[position::size]
+    return data
+
+
+def _read_header(contents, filename):
+    """
+    Internal Function. Reads the fields of a bitmap's headers.
+
+    :Parameters:
+        contents : buffer
+            The start of the file, at least up to the end of the headers and
+            the masks following them.
+        filename : string
+            The name of the file, for error messages.
+
+    :rtype: tuple
+    :returns: A tuple (offset, header_size, width, height, top_down, bits,
+        compression, colors, entry_size). height is positive, entry_size is
+        the size of a palette entry.
+    """
+    if len(contents) < 18:
+        raise ImageReadError(f"The header of '{filename}' is truncated")
+    offset, header_size = unpack_from("<2I", contents, 10)
+    if len(contents) < 14 + min(header_size, V3_HEADER):
+        raise ImageReadError(f"The header of '{filename}' is truncated")
+    if header_size == V1_HEADER:
+        width, height, planes, bits = unpack_from("<2H2H", contents, 18)
+        compression, colors = BI_RGB, 0
+        entry_size = 3
+    elif header_size >= V3_HEADER:
+        width, height, planes, bits, compression = unpack_from("<2i2HI",
+                contents, 18)
+        colors = unpack_from("<I", contents, 46)[0]
+        entry_size = 4
+    else:
+        raise ImageReadError(f"Unsupported bitmap header size ({header_size} "
+            "bytes)")
+    top_down = height < 0
+    height = abs(height)
+    if width <= 0 or height == 0:
+        raise ImageReadError(f"Invalid bitmap size {width}x{height}")
+    return (offset, header_size, width, height, top_down, bits, compression,
+        colors, entry_size)
+
+
+def _masks(contents, header_size, compression, filename):
+    """
+    Internal Function. Gets the channel masks of a 32-bit bitmap.
+
+    :Parameters:
+        contents : buffer
+            The start of the file, at least up to the end of the headers and
+            the masks following them.
+        header_size : int
+            The size of the header.
+        compression : int
+            The compression method.
+        filename : string
+            The name of the file, for error messages.
+
+    :rtype: tuple
+    :returns: The red, green, blue and alpha masks. The alpha mask is 0 if
+        there is no alpha channel.
+    """
+    masks = (RED_MASK, GREEN_MASK, BLUE_MASK, 0)
+    if compression == BI_BITFIELDS:
+        if header_size < MASK_HEADER:
+            end = 14 + header_size + 12
+        else:
+            end = 70 if header_size >= ALPHA_HEADER else 66
+        if len(contents) < end:
+            raise ImageReadError(f"The masks of '{filename}' are truncated")
+        if header_size < MASK_HEADER:
+            # the masks follow a V3 header.
+            masks = unpack_from("<3I", contents, 14 + header_size) + (0,)
+        else:
+            masks = unpack_from("<3I", contents, 54) + (0,)
+        if header_size >= ALPHA_HEADER:
+            masks = masks[:3] + unpack_from("<I", contents, 66)
+    return masks
+
+
+def probe(filename):
+    """
+    Reads the size of a bitmap from its header.
+
+    :Parameters:
+        filename : string or file
+            the name of the file to be read, or the file itself opened in
+            binary mode.
+
+    :rtype: tuple
+    :returns: A tuple (width, height, channels), as read would return them.
+    """
+    with open_file(filename) as image_file:
+        filename = getattr(image_file, "name", filename)
+        # the largest header used, and the masks which may follow a V3 header
+        contents = image_file.read(14 + V4_HEADER)
+    if len(contents) < 14 + V1_HEADER or contents[:2] != FILE_MARKER:
+        raise ImageFormatError(f"'{filename}' is not a bitmap file")
+    offset, header_size, width, height, top_down, bits, compression, colors, \
+        entry_size = _read_header(contents, filename)
+    channels = 3
+    if bits == 32 and _masks(contents, header_size, compression, filename)[3]:
+        channels = 4
+    return (width, height, channels)
+
+
 def read(filename):
     """
     Reads a bitmap file.
 
     :Parameters:
-        filename : string
-            the name of the file to be read.
+        filename : string or file
+            the name of the file to be read, or the file itself opened in
+            binary mode.
 
     :rtype: tuple
     :returns: A tuple (width, height, data). Width and height are in pixels,
-        data is a string containing chr(red) + chr(green) + chr(blue) for each
-        pixel.
+        data is a bytearray containing red, green, blue (and alpha if the
+        bitmap has an alpha channel) for each pixel.
     """
-    image = Image(name = filename)
-    return (image.GetWidth(), image.GetHeight(),image.GetData())
+    with open_file(filename) as image_file:
+        filename = getattr(image_file, "name", filename)
+        size = os.fstat(image_file.fileno()).st_size
+        if size < 14 + V1_HEADER or image_file.read(2) != FILE_MARKER:
+            raise ImageFormatError(f"'{filename}' is not a bitmap file")
+        with mmap(image_file.fileno(), 0, access=ACCESS_READ) as contents, \
+                memoryview(contents) as view:
+            offset, header_size, width, height, top_down, bits, \
+                compression, colors, entry_size = _read_header(contents,
+                    filename)
+
+            palette = None
+            positions = None
+            channels = 3
+            masks_end = 14 + header_size
+            if bits in (1, 2, 4, 8) and compression == BI_RGB:
+                colors = colors or 1 << bits
+                entries = contents[masks_end:masks_end + colors * entry_size]
+                # missing colors (and indexes past the palette) are black.
+                entries = entries.ljust(256 * entry_size, b'\x00')
+                palette = tuple(entries[i:256 * entry_size:entry_size]
+                    for i in (2, 1, 0))
+            elif bits == 24 and compression == BI_RGB:
+                positions = (2, 1, 0)
+            elif bits == 32 and compression in (BI_RGB, BI_BITFIELDS):
+                masks = _masks(contents, header_size, compression, filename)
+                positions = tuple(_mask_byte(mask) for mask in masks if mask)
+                channels = len(positions)
+            else:
+                raise ImageReadError(f"Unsupported bitmap type ({bits} bits "
+                    f"per pixel, compression method {compression})")
 
+            stride = _stride(width, bits)
+            if offset + stride * (height - 1) + (width * bits + 7) // 8 > size:
+                raise ImageReadError(f"'{filename}' is truncated")
+            data = _read_rows(view, offset, stride, width, height, top_down,
+                bits, palette, positions, channels)
+    return (width, height, data)
 
 
 def write(filename, width, height, data):
     """
-    Writes data out to a bitmap file.
+    Writes data out to a bitmap file. Images with an alpha channel are written
+    as 32-bit bitmaps, others as 24-bit bitmaps.
 
     :Parameters:
         filename : string
@@ -103,14 +412,43 @@ def write(filename, width, height, data):
             The width of the image in pixels
         height : int
             The height of the image in pixels
-        data : string
-            The data as a string.
+        data : buffer
+            The image data.
 
     :rtype: boolean
     :returns: True on success
     """
-    data = to_rgb(width, height, data)[2]
-    image = Image(width, height)
-    image.SetData(data)
-    image.SaveFile(name = filename, type = BITMAP_TYPE_BMP)
+    source = memoryview(data).cast('B')
+    channels = source.nbytes // (width * height)
+    if channels == 4:
+        bits, header_size, compression = 32, V4_HEADER, BI_BITFIELDS
+    else:
+        bits, header_size, compression = 24, V3_HEADER, BI_RGB
+    stride = _stride(width, bits)
+    offset = 14 + header_size
+
+    header = pack("<2sI2HI", FILE_MARKER, offset + stride * height, 0, 0,
+            offset)
+    header += pack("<I2i2H6I", header_size, width, height, 1, bits,
+            compression, stride * height, RESOLUTION, RESOLUTION, 0, 0)
+    if channels == 4:
+        header += pack("<5I", RED_MASK, GREEN_MASK, BLUE_MASK, ALPHA_MASK,
+                SRGB)
+        header += bytes(V4_HEADER - V3_HEADER - 20)
+
+    # rows are written bottom to top with the channels in blue, green, red
+    # (alpha) order, and the padding left as zeros.
+    row = bytearray(stride)
+    pixels = memoryview(row)[:width * channels]
+    length = width * channels
+    with open(filename, 'wb') as image_file:
+        image_file.write(header)
+        for y in range(height - 1, -1, -1):
+            line = source[y * length:(y + 1) * length]
+            pixels[0::channels] = line[2::channels]
+            pixels[1::channels] = line[1::channels]
+            pixels[2::channels] = line[0::channels]
+            if channels == 4:
+                pixels[3::4] = line[3::4]
+            image_file.write(row)
     return True
@@ -17,36 +17,150 @@ PURPOSE. See the GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with The Python Image Manipulation Project.  If not, see
 <http://www.gnu.org/licenses/>.
+
+
+Baseline JPEG files (what cameras and most programs write) are decoded by
+extensions.lib.jpeg, which can also decode them at 1/2, 1/4 or 1/8 of their
+size much faster than decoding the whole image and scaling it down. Other
+JPEG files (e.g. progressive ones) are read with wxPython, as are all JPEG
+files written.
 """
 
-# I'm taking the easy way out for now in this one.
+import os
+from struct import unpack
+from mmap import mmap, ACCESS_READ
 
-from wx import Image, BITMAP_TYPE_JPEG
-from extensions.lib.core import to_rgb
+from error import ImageFormatError, ImageReadError, \
+        UnsupportedImageTypeError
+from extensions.lib import jpeg
+from extensions.lib.core import to_rgb, open_file
+from extensions.lib.resample import resample
 
 # register the extension(s) for this to read
 FILE_EXTENSION = ("jpg", "jpeg")
 # register the file marker for this format (beginning of the file data)
-FILE_MARKER = b"\xff\xe0"
+FILE_MARKER = b"\xff\xd8\xff"
 # description of this format
 DESCRIPTION = "Jpeg Format"
+# the reduced sizes read can decode directly, as fractions of the full size
+SCALES = (1, 1 / 2, 1 / 4, 1 / 8)
+# the start of frame markers, which hold the size of the image (the others
+# in 0xc0 to 0xcf are 0xc4 DHT, 0xc8 JPG and 0xcc DAC).
+FRAME_MARKERS = frozenset(range(0xc0, 0xd0)) - {0xc4, 0xc8, 0xcc}
 
-def read( filename ):
+
+def probe(filename):
+    """
+    Reads the size of a jpeg file from its frame header. The segments before
+    it are skipped over, so none of the image data is read.
+
+    :Parameters:
+        filename : string or file
+            the name of the file to be read, or the file itself opened in
+            binary mode.
+
+    :rtype: tuple
+    :returns: A tuple (width, height, channels), as read would return them.
+    """
+    with open_file(filename) as image_file:
+        filename = getattr(image_file, "name", filename)
+        if image_file.read(2) != FILE_MARKER[:2]:
+            raise ImageFormatError(f"'{filename}' is not a jpeg file")
+        while True:
+            marker = image_file.read(2)
+            # markers may be padded with any number of 0xff bytes.
+            while marker == b"\xff\xff":
+                marker = marker[1:] + image_file.read(1)
+            if len(marker) < 2 or marker[0] != 0xff:
+                raise ImageReadError(f"'{filename}' is truncated or corrupt")
+            if 0xd0 <= marker[1] <= 0xd7 or marker[1] == 0x01:
+                # markers without a segment.
+                continue
+            if marker[1] in (0xd9, 0xda):
+                raise ImageReadError(f"'{filename}' has no frame header")
+            segment = image_file.read(2)
+            if len(segment) < 2:
+                raise ImageReadError(f"'{filename}' is truncated")
+            length = unpack(">H", segment)[0]
+            if marker[1] in FRAME_MARKERS:
+                frame = image_file.read(5)
+                if len(frame) < 5:
+                    raise ImageReadError(f"'{filename}' is truncated")
+                height, width = unpack(">xHH", frame)
+                if not width or not height:
+                    raise ImageReadError(f"Invalid jpeg size {width}x"
+                        f"{height}")
+                # greyscale images are read as RGB too.
+                return (width, height, 3)
+            image_file.seek(length - 2, 1)
+
+
+def read(filename, scale=1):
     """
     Reads a jpeg file.
 
     :Parameters:
-        filename : string
-            the name of the file to be read.
+        filename : string or file
+            the name of the file to be read, or the file itself opened in
+            binary mode.
+        scale : float
+            The smallest fraction of the full size needed. The image is
+            decoded at the smallest of SCALES which is at least this, with
+            its size rounded up. Defaults to 1.
 
     :rtype: tuple
     :returns: A tuple (width, height, data). Width and height are in pixels,
-        data is a string containing chr(red) + chr(green) + chr(blue) for each
-        pixel.
+        data is a bytearray containing red, green and blue for each pixel.
     """
-    image = Image(name = filename)
-    return (image.GetWidth(), image.GetHeight(), image.GetData())
+    reduction = 1
+    while reduction < 8 and scale <= 1 / (reduction * 2):
+        reduction *= 2
 
+    with open_file(filename) as image_file:
+        filename = getattr(image_file, "name", filename)
+        size = os.fstat(image_file.fileno()).st_size
+        if size < len(FILE_MARKER) or \
+                image_file.read(len(FILE_MARKER)) != FILE_MARKER:
+            raise ImageFormatError(f"'{filename}' is not a jpeg file")
+        with mmap(image_file.fileno(), 0, access=ACCESS_READ) as contents:
+            try:
+                return jpeg.decode(contents, reduction)
+            except jpeg.Unsupported:
+                pass
+            except ValueError as error:
+                raise ImageReadError(f"'{filename}': {error}")
+        width, height, data = _read_wx(image_file, filename)
+
+    if reduction > 1:
+        width, height, data = resample(width, height, data,
+            -(-width // reduction), -(-height // reduction), "box")
+    return (width, height, data)
+
+
+def _read_wx(image_file, filename):
+    """
+    Internal Function. Reads a jpeg file with wxPython.
+
+    :Parameters:
+        image_file : file
+            The file, opened in binary mode.
+        filename : string
+            The name of the file, for error messages.
+
+    :rtype: tuple
+    :returns: A tuple (width, height, data).
+    """
+    # only needed for the files extensions.lib.jpeg can't read.
+    try:
+        from wx import Image, BITMAP_TYPE_JPEG
+    except ImportError:
+        raise UnsupportedImageTypeError(f"'{filename}' is a kind of jpeg "
+            "file (e.g. progressive) which can only be read with wxPython, "
+            "which is not installed")
+
+    image_file.seek(0)
+    image = Image(image_file, type = BITMAP_TYPE_JPEG)
+    return (image.GetWidth(), image.GetHeight(), image.GetData())
 
 
 def write(filename, width, height, data):
@@ -66,6 +180,9 @@ def write(filename, width, height, data):
     :rtype: boolean
     :returns: True on success
     """
+    # jpeg files are still written by wx.
+    from wx import Image, BITMAP_TYPE_JPEG
+
     data = to_rgb(width, height, data)[2]
     image = Image(width, height)
     image.SetData(data)
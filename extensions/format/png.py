@@ -1,6 +1,6 @@
 """
 png.py
-Copyright 2020 Thomas McGrew
+Copyright 2007 Thomas McGrew
 
 This file is part of The Python Image Manipulation Project.
 
@@ -17,12 +17,45 @@ PURPOSE. See the GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with The Python Image Manipulation Project.  If not, see
 <http://www.gnu.org/licenses/>.
+
+
+This extension reads every standard PNG pixel format (greyscale, RGB and
+palette images, with or without alpha, at any bit depth, interlaced or not)
+and writes 8-bit RGB or RGBA images. Images with an alpha channel, or with a
+transparent color or palette entries, are read as RGBA. wxPython is not
+needed.
+
+The compressed data is read and inflated a chunk at a time, and each
+complete row is unfiltered and unpacked straight into the image, so reading
+a file doesn't need much more memory than the image itself. Writing works
+the same way in reverse, a band of rows at a time. The row filters and the
+pixel formats are handled by extensions.lib.png_filter.
+
+File layout:
+The 8 byte signature is followed by chunks, each of which is
+offset  length  purpose
+0       4       The length of the chunk data (big endian, as every number)
+4       4       The chunk type, 4 letters
+8       length  The chunk data
+8+len   4       The CRC-32 of the chunk type and data
+
+Chunks used:
+IHDR    width (4), height (4), bit depth (1), color type (1), compression
+        method (1), filter method (1), interlace method (1)
+PLTE    the red, green and blue of each palette entry
+tRNS    the alpha of each palette entry, or the transparent grey or RGB color
+        (2 bytes per sample)
+IDAT    the zlib compressed rows. Each row starts with its filter type.
+IEND    the end of the file
+Other chunks are skipped.
 """
 
-# I'm taking the easy way out for now in this one.
+import zlib
+from struct import pack, unpack
 
-from wx import Image, BITMAP_TYPE_PNG
-from extensions.lib.core import to_rgb
+from error import ImageFormatError, ImageReadError
+from extensions.lib import png_filter
+from extensions.lib.core import open_file
 
 # register the extension(s) for this to read
 FILE_EXTENSION = ("png",)
@@ -31,27 +64,350 @@ FILE_MARKER = b"\x89PNG\r\n\x1a\n"
 # description of this format
 DESCRIPTION = "PNG Format"
 
+# the color types and the number of samples in each of their pixels
+GREY = 0
+RGB = 2
+PALETTE = 3
+GREY_ALPHA = 4
+RGBA = 6
+SAMPLES = {GREY: 1, RGB: 3, PALETTE: 1, GREY_ALPHA: 2, RGBA: 4}
+# the bit depths allowed for each color type
+DEPTHS = {GREY: (1, 2, 4, 8, 16), RGB: (8, 16), PALETTE: (1, 2, 4, 8),
+        GREY_ALPHA: (8, 16), RGBA: (8, 16)}
+
+# the starting column and row, and the spacing of the columns and rows, of
+# the 7 passes of an Adam7 interlaced image
+ADAM7 = ((0, 0, 8, 8), (4, 0, 8, 8), (0, 4, 4, 8), (2, 0, 4, 4),
+        (0, 2, 2, 4), (1, 0, 2, 2), (0, 1, 1, 2))
+
+# the zlib compression level used for new files
+COMPRESSION = 6
+# the number of rows filtered and compressed at a time when writing
+WRITE_ROWS = 64
+# the largest IDAT chunk written
+IDAT_SIZE = 1 << 16
+# the amount of the file read at a time
+READ_SIZE = 1 << 16
+
+
+def _chunks(image_file, filename):
+    """
+    Internal Function. Reads the chunks of a PNG file, checking their CRCs.
+
+    :Parameters:
+        image_file : file
+            The file, positioned after the signature.
+        filename : string
+            The name of the file, for error messages.
+
+    :rtype: generator
+    :returns: A (type, data) tuple for each chunk.
+    """
+    while True:
+        header = image_file.read(8)
+        if len(header) < 8:
+            raise ImageReadError(f"'{filename}' is truncated")
+        length, chunk_type = unpack(">I4s", header)
+        data = image_file.read(length)
+        crc = image_file.read(4)
+        if len(data) < length or len(crc) < 4:
+            raise ImageReadError(f"'{filename}' is truncated")
+        if zlib.crc32(data, zlib.crc32(chunk_type)) != unpack(">I", crc)[0]:
+            raise ImageReadError(f"The {chunk_type.decode('latin-1')} chunk "
+                f"of '{filename}' is corrupt")
+        yield chunk_type, data
+
+
+def _passes(width, height, interlace):
+    """
+    Internal Function. Gets the passes the rows of an image are stored in.
+
+    :Parameters:
+        width : int
+            The width of the image in pixels.
+        height : int
+            The height of the image in pixels.
+        interlace : int
+            The interlace method, 0 (none) or 1 (Adam7).
+
+    :rtype: list
+    :returns: A (x, y, x_step, y_step, pass_width, pass_height) tuple for
+        each pass which contains any pixels.
+    """
+    if not interlace:
+        return [(0, 0, 1, 1, width, height)]
+    passes = list()
+    for x, y, x_step, y_step in ADAM7:
+        pass_width = (width - x + x_step - 1) // x_step
+        pass_height = (height - y + y_step - 1) // y_step
+        if pass_width > 0 and pass_height > 0:
+            passes.append((x, y, x_step, y_step, pass_width, pass_height))
+    return passes
+
+
+class _RowReader:
+    """
+    Internal Class. Takes the inflated image data as it arrives and unfilters
+    and unpacks each complete row into the image.
+    """
+    def __init__(self, width, height, color_type, depth, interlace, channels,
+            palette, transparent):
+        """
+        Creates a _RowReader.
+
+        :Parameters:
+            width : int
+                The width of the image in pixels.
+            height : int
+                The height of the image in pixels.
+            color_type : int
+                The PNG color type.
+            depth : int
+                The number of bits per sample.
+            interlace : int
+                The interlace method.
+            channels : int
+                The number of channels to produce, 3 or 4.
+            palette : bytes
+                The red, green, blue and alpha of 256 palette colors, or None.
+            transparent : tuple
+                The samples of the transparent color, or None.
+        """
+        self.data = bytearray(width * height * channels)
+        self._view = memoryview(self.data)
+        self._width = width
+        self._format = dict(color_type=color_type, depth=depth,
+            channels=channels, palette=palette, transparent=transparent)
+        self._bits = SAMPLES[color_type] * depth
+        self._passes = _passes(width, height, interlace)
+        self._pending = bytearray()
+        self._start_pass()
+
+    def _start_pass(self):
+        """
+        Internal Function. Moves on to the next pass of the image.
+        """
+        if self._passes:
+            self._pass = self._passes.pop(0)
+            self._row = 0
+            self._prior = None
+            self._row_bytes = (self._pass[4] * self._bits + 7) // 8
+        else:
+            self._pass = None
+
+    def done(self):
+        """
+        Whether every row of the image has been read.
+        """
+        return self._pass is None
+
+    def feed(self, data):
+        """
+        Adds inflated image data, and reads the rows it completes.
+
+        :Parameters:
+            data : bytes
+                The next part of the inflated image data.
+        """
+        self._pending += data
+        start = 0
+        while self._pass:
+            x, y, x_step, y_step, pass_width, pass_height = self._pass
+            length = self._row_bytes + 1
+            rows = min((len(self._pending) - start) // length,
+                pass_height - self._row)
+            if not rows:
+                break
+            rows_data = png_filter.unfilter(
+                memoryview(self._pending)[start:start + rows * length],
+                self._row_bytes, max(self._bits // 8, 1), self._prior)
+            start += rows * length
+            self._prior = memoryview(rows_data)[-self._row_bytes:]
+
+            channels = self._format["channels"]
+            stride = self._width * channels
+            if y_step == 1:
+                begin = (y + self._row) * stride
+                png_filter.unpack(rows_data, pass_width, out=self._view[
+                    begin:begin + rows * stride], **self._format)
+            else:
+                pixels = memoryview(png_filter.unpack(rows_data, pass_width,
+                    **self._format))
+                length = pass_width * channels
+                for row in range(rows):
+                    begin = (y + (self._row + row) * y_step) * stride
+                    source = pixels[row * length:(row + 1) * length]
+                    for channel in range(channels):
+                        self._view[begin + x * channels + channel:
+                            begin + stride:x_step * channels] = \
+                            source[channel::channels]
+            self._row += rows
+            if self._row == pass_height:
+                self._start_pass()
+        del self._pending[:start]
+
+
+def _read_header(chunk_type, header, filename):
+    """
+    Internal Function. Reads and checks the IHDR chunk.
+
+    :Parameters:
+        chunk_type : bytes
+            The type of the first chunk in the file.
+        header : bytes
+            The data of the first chunk in the file.
+        filename : string
+            The name of the file, for error messages.
+
+    :rtype: tuple
+    :returns: A tuple (width, height, depth, color_type, interlace).
+    """
+    if chunk_type != b"IHDR" or len(header) != 13:
+        raise ImageReadError(f"'{filename}' has no PNG header")
+    width, height, depth, color_type, compression, filter_method, \
+        interlace = unpack(">2I5B", header)
+    if width < 1 or height < 1:
+        raise ImageReadError(f"Invalid PNG size {width}x{height}")
+    if depth not in DEPTHS.get(color_type, ()) or compression or \
+            filter_method or interlace > 1:
+        raise ImageReadError(f"Unsupported PNG type (color type "
+            f"{color_type}, compression method {compression}, filter "
+            f"method {filter_method}, interlace method {interlace})")
+    return (width, height, depth, color_type, interlace)
+
+
+def probe(filename):
+    """
+    Reads the size of a png file from its header. The chunks before the
+    image data are skipped over, except for the transparency chunk, so the
+    image data is never read.
+
+    :Parameters:
+        filename : string or file
+            the name of the file to be read, or the file itself opened in
+            binary mode.
+
+    :rtype: tuple
+    :returns: A tuple (width, height, channels), as read would return them.
+    """
+    with open_file(filename) as image_file:
+        filename = getattr(image_file, "name", filename)
+        if image_file.read(len(FILE_MARKER)) != FILE_MARKER:
+            raise ImageFormatError(f"'{filename}' is not a PNG file")
+        width, height, depth, color_type, interlace = _read_header(
+            *next(_chunks(image_file, filename)), filename)
+        alpha = color_type in (GREY_ALPHA, RGBA)
+        has_palette = False
+        while not alpha:
+            header = image_file.read(8)
+            if len(header) < 8:
+                raise ImageReadError(f"'{filename}' is truncated")
+            length, chunk_type = unpack(">I4s", header)
+            if chunk_type in (b"IDAT", b"IEND"):
+                break
+            if chunk_type == b"tRNS":
+                data = image_file.read(length)
+                if color_type == PALETTE:
+                    alpha = has_palette and data[:256].strip(b"\xff") != b""
+                else:
+                    alpha = len(data) >= SAMPLES[color_type] * 2
+                length = 0
+            has_palette = has_palette or chunk_type == b"PLTE"
+            # skip the rest of the chunk and its CRC.
+            image_file.seek(length + 4, 1)
+    return (width, height, 4 if alpha else 3)
+
+
 def read(filename):
     """
     Reads a png file.
 
     :Parameters:
-        filename : string
-            the name of the file to be read.
+        filename : string or file
+            the name of the file to be read, or the file itself opened in
+            binary mode.
 
     :rtype: tuple
     :returns: A tuple (width, height, data). Width and height are in pixels,
-        data is a string containing chr(red) + chr(green) + chr(blue) for each
-        pixel.
+        data is a bytearray containing red, green, blue (and alpha if the
+        image has any transparency) for each pixel.
     """
-    image = Image( name = filename )
-    return ( image.GetWidth( ), image.GetHeight( ), image.GetData( ) )
+    with open_file(filename) as image_file:
+        filename = getattr(image_file, "name", filename)
+        if image_file.read(len(FILE_MARKER)) != FILE_MARKER:
+            raise ImageFormatError(f"'{filename}' is not a PNG file")
+        chunks = _chunks(image_file, filename)
+        width, height, depth, color_type, interlace = _read_header(
+            *next(chunks), filename)
 
+        palette = None
+        transparent = None
+        reader = None
+        inflater = zlib.decompressobj()
+        for chunk_type, data in chunks:
+            if chunk_type == b"IDAT":
+                if not reader:
+                    channels = 4 if color_type in (GREY_ALPHA, RGBA) or \
+                            transparent or (palette and palette[3::4] !=
+                                b"\xff" * 256) else 3
+                    if color_type == PALETTE and not palette:
+                        raise ImageReadError(f"'{filename}' has no palette")
+                    reader = _RowReader(width, height, color_type, depth,
+                        interlace, channels, palette, transparent)
+                try:
+                    # limit the amount inflated at once, so a small chunk
+                    # can't expand into more memory than the image needs.
+                    while not reader.done():
+                        rows = inflater.decompress(data, READ_SIZE)
+                        data = inflater.unconsumed_tail
+                        reader.feed(rows)
+                        if not data and len(rows) < READ_SIZE:
+                            break
+                except (zlib.error, ValueError) as error:
+                    raise ImageReadError(f"The image data of '{filename}' is "
+                        f"corrupt: {error}")
+            elif chunk_type == b"PLTE":
+                entries = data[:len(data) - len(data) % 3]
+                palette = bytearray(b"\xff" * 256 * 4)
+                for channel in range(3):
+                    palette[channel:len(entries) // 3 * 4:4] = \
+                        entries[channel::3]
+            elif chunk_type == b"tRNS":
+                if color_type == PALETTE and palette:
+                    alpha = data[:256]
+                    palette[3:len(alpha) * 4:4] = alpha
+                elif color_type == GREY and len(data) >= 2:
+                    transparent = unpack(">H", data[:2]) * 3
+                elif color_type == RGB and len(data) >= 6:
+                    transparent = unpack(">3H", data[:6])
+            elif chunk_type == b"IEND":
+                break
+        if not reader or not reader.done():
+            raise ImageReadError(f"'{filename}' is truncated")
+    return (width, height, reader.data)
 
 
-def write( filename, width, height, data ):
+def _write_chunk(image_file, chunk_type, data):
     """
-    Writes data out to a png file.
+    Internal Function. Writes a chunk to a PNG file.
+
+    :Parameters:
+        image_file : file
+            The file to write to.
+        chunk_type : bytes
+            The 4 letter type of the chunk.
+        data : bytes
+            The data of the chunk.
+    """
+    image_file.write(pack(">I4s", len(data), chunk_type))
+    image_file.write(data)
+    image_file.write(pack(">I", zlib.crc32(data, zlib.crc32(chunk_type))))
+
+
+def write(filename, width, height, data):
+    """
+    Writes data out to a png file. Images with an alpha channel are written
+    as RGBA, others as RGB, with 8 bits per sample.
 
     :Parameters:
         filename : string
@@ -60,14 +416,34 @@ def write( filename, width, height, data ):
             The width of the image in pixels
         height : int
             The height of the image in pixels
-        data : string
-            The data as a string.
+        data : buffer
+            The image data.
 
     :rtype: boolean
     :returns: True on success
     """
-    data = to_rgb(width, height, data)[2]
-    image = Image(width, height)
-    image.SetData(data)
-    image.SaveFile(name = filename, type = BITMAP_TYPE_PNG)
+    source = memoryview(data).cast('B')
+    channels = source.nbytes // (width * height)
+    stride = width * channels
+    compressor = zlib.compressobj(COMPRESSION)
+    compressed = bytearray()
+    prior = None
+
+    with open(filename, 'wb') as image_file:
+        image_file.write(FILE_MARKER)
+        _write_chunk(image_file, b"IHDR", pack(">2I5B", width, height, 8,
+            RGBA if channels == 4 else RGB, 0, 0, 0))
+        for row in range(0, height, WRITE_ROWS):
+            rows = source[row * stride:(row + WRITE_ROWS) * stride]
+            compressed += compressor.compress(png_filter.filter(rows, stride,
+                channels, prior))
+            prior = rows[-stride:]
+            while len(compressed) >= IDAT_SIZE:
+                _write_chunk(image_file, b"IDAT", compressed[:IDAT_SIZE])
+                del compressed[:IDAT_SIZE]
+        compressed += compressor.flush()
+        for start in range(0, len(compressed), IDAT_SIZE):
+            _write_chunk(image_file, b"IDAT",
+                compressed[start:start + IDAT_SIZE])
+        _write_chunk(image_file, b"IEND", b"")
     return True
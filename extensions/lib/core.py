@@ -19,11 +19,146 @@ along with The Python Image Manipulation Project.  If not, see
 <http://www.gnu.org/licenses/>.
 """
 
+import os
+from contextlib import contextmanager
+
 # import the core methods from the shared object file
-from wx import Image
 from extensions.lib.ccore import *
 
 
+def set_thread_count(threads=None):
+    """
+    Sets the number of threads the C extensions split their work between. The
+    setting is shared by all of the C extensions through the PIMP_THREADS
+    environment variable, so it is also inherited by child processes.
+
+    :Parameters:
+        threads : int
+            The number of threads to use. None (the default) uses one thread
+            per processor.
+    """
+    if threads is None:
+        os.environ.pop("PIMP_THREADS", None)
+    elif threads < 1:
+        raise ValueError("The number of threads must be at least 1")
+    else:
+        os.environ["PIMP_THREADS"] = str(threads)
+
+
+def get_thread_count():
+    """
+    Get the number of threads the C extensions split their work between.
+
+    :rtype: int
+    :returns: The number of threads which will be used.
+    """
+    threads = int(os.environ.get("PIMP_THREADS", 0))
+    if threads < 1:
+        threads = os.cpu_count() or 1
+    return threads
+
+
+class Progress:
+    """
+    Follows the C kernels called by a thread, and stops them if it is
+    cancelled. The kernels are only followed while the thread is inside a
+    with block::
+
+        progress = Progress()
+        # on the worker thread
+        with progress:
+            result = module.execute(width, height, data)
+        # on any other thread
+        progress.get_fraction()
+        progress.cancel()
+
+    Once cancelled, the kernel running stops after the band of rows it is
+    working on and raises Cancelled, as does any kernel started afterwards.
+    Its output is left incomplete, the input is not changed. A thread can
+    only follow one Progress at a time.
+    """
+    def __init__(self):
+        """
+        Creates a Progress which hasn't counted anything.
+        """
+        # done, total and cancel, as the kernels expect them.
+        self._counter = bytearray(24)
+        self._values = memoryview(self._counter).cast('q')
+
+    def __enter__(self):
+        set_progress(self._counter)
+        return self
+
+    def __exit__(self, *exc_info):
+        set_progress(None)
+        return False
+
+    def get_done(self):
+        """
+        Get the number of rows processed so far.
+
+        :rtype: int
+        :returns: The rows finished by all the kernels called so far.
+        """
+        return self._values[0]
+
+    def get_total(self):
+        """
+        Get the number of rows the kernels called so far have to process. A
+        filter which calls several kernels adds to this as it goes.
+
+        :rtype: int
+        :returns: The rows of all the kernels started.
+        """
+        return self._values[1]
+
+    def get_fraction(self):
+        """
+        Get how much of the work started so far has been done.
+
+        :rtype: float
+        :returns: A number from 0 to 1.
+        """
+        total = self._values[1]
+        return min(1.0, self._values[0] / total) if total else 0.0
+
+    def cancel(self):
+        """
+        Stops the kernels. This can be called from any thread.
+        """
+        self._values[2] = 1
+
+    def is_cancelled(self):
+        """
+        :rtype: bool
+        :returns: True if cancel has been called.
+        """
+        return bool(self._values[2])
+
+
+@contextmanager
+def open_file(source):
+    """
+    Opens a file for a file format extension to read. The file can be given
+    by name or already be open, as it is when formats.read has looked at its
+    first bytes to find out which extension reads it.
+
+    :Parameters:
+        source : string or file
+            The name of the file, or the file opened in binary mode.
+
+    :rtype: file
+    :returns: A context manager for the file, positioned at its start. A file
+        which was passed in is left open.
+    """
+    if isinstance(source, (str, bytes, os.PathLike)):
+        with open(source, 'rb') as image_file:
+            yield image_file
+    else:
+        source.seek(0)
+        yield source
+
+
 def data_to_bitmap( width, height, data ):
     """
     Converts data to a wx.Bitmap.
@@ -33,13 +168,16 @@ def data_to_bitmap( width, height, data ):
             The width of the image (in pixels).
         height : int
             The height of the image (in pixels).
-        data : string
-            The image as a string of bytes.
+        data : buffer
+            The image data as bytes, a bytearray or any other buffer.
 
     :rtype: wx.Bitmap
     :returns: a wx.Bitmap containing the image data.
     """
+    # wx is only needed here, importing it above would keep the rest of this
+    # module from being used without it.
+    from wx import Image
 
     image = Image( width, height )
-    image.SetData( to_rgb( width, height, bytes(data) )[ 2 ] )
+    image.SetData( to_rgb( width, height, data )[ 2 ] )
     return image.ConvertToBitmap( )
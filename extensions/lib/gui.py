@@ -0,0 +1,142 @@
+"""
+gui.py
+Copyright 2007 Thomas McGrew
+
+This file is part of The Python Image Manipulation Project.
+
+The Python Image Manipulation Project is free software: you can
+redistribute it and/or modify it under the terms of the GNU General
+Public License as published by the Free Software Foundation, either
+version 2 of the License, or (at your option) any later version.
+
+The Python Image Manipulation Project is distributed in the hope
+that it will be useful, but WITHOUT ANY WARRANTY; without even the
+implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with The Python Image Manipulation Project.  If not, see
+<http://www.gnu.org/licenses/>.
+
+Extensions import wx through this module so they can still be loaded without
+wxPython (e.g. by the batch mode), as long as they don't need to show a
+dialog. wx is None when wxPython is not installed.
+
+The editor runs filters on a worker thread, so extensions should show their
+dialogs with show_dialog, which shows them on the main thread. Dialogs can
+show the effect of their options as they are changed with preview.
+"""
+
+import threading
+
+try:
+    import wx
+    Dialog = wx.Dialog
+except ImportError:
+    wx = None
+
+    class Dialog:
+        """
+        Stands in for wx.Dialog when wxPython is not installed.
+        """
+        def __new__(cls, *args, **kwargs):
+            """
+            Raises a RuntimeError, dialogs can't be shown without wxPython.
+            Extensions only show dialogs when their options aren't passed in.
+            """
+            raise RuntimeError(f"{cls.__name__} requires wxPython. Pass "
+                "the options for this filter instead of asking for them.")
+
+
+def call_in_main_thread(function, *args, **kwargs):
+    """
+    Calls a function on the main thread, where all of the windows have to be
+    created, and waits for it to return. The function is called directly if
+    this is the main thread or no wx application is running.
+
+    :Parameters:
+        function : function
+            The function to call.
+        args : tuple
+            The arguments to call it with.
+        kwargs : dict
+            The keyword arguments to call it with.
+
+    :returns: Whatever the function returns. Any exception it raises is
+        raised again here.
+    """
+    if (wx is None or not wx.GetApp() or
+            threading.current_thread() is threading.main_thread()):
+        return function(*args, **kwargs)
+
+    done = threading.Event()
+    result = [None, None]
+
+    def call():
+        try:
+            result[0] = function(*args, **kwargs)
+        except BaseException as error:
+            result[1] = error
+        finally:
+            done.set()
+
+    wx.CallAfter(call)
+    done.wait()
+    if result[1] is not None:
+        raise result[1]
+    return result[0]
+
+
+# the function the editor shows previews with, see set_preview_handler.
+_preview_handler = None
+
+
+def set_preview_handler(handler):
+    """
+    Sets the function which shows the previews requested with preview.
+
+    :Parameters:
+        handler : function
+            A function taking (function, args), called on the main thread, or
+            None to ignore previews.
+    """
+    global _preview_handler
+    _preview_handler = handler
+
+
+def preview(function, *args):
+    """
+    Shows what a filter would do with a set of options, applied to a low
+    resolution copy of the part of the image on screen. Dialogs call this from
+    their slider_update_func so the sliders can be tried out before OK is
+    pressed. The editor waits for the sliders to stop moving before updating
+    the preview, and drops it once the filter finishes. Outside the editor
+    this does nothing.
+
+    :Parameters:
+        function : function
+            The filter, called as function(width, height, data, *args). It
+            must not show a dialog.
+        args : tuple
+            The options to pass to the filter.
+    """
+    if _preview_handler:
+        _preview_handler(function, args)
+
+
+def show_dialog(dialog_class, *args, **kwargs):
+    """
+    Creates a dialog and shows it on the main thread.
+
+    :Parameters:
+        dialog_class : class
+            The Dialog subclass to show.
+        args : tuple
+            The arguments for the dialog's constructor.
+        kwargs : dict
+            The keyword arguments for the dialog's constructor.
+
+    :returns: The value returned by the dialog's ShowModal method.
+    """
+    return call_in_main_thread(
+            lambda: dialog_class(*args, **kwargs).ShowModal())
@@ -0,0 +1,252 @@
+"""
+pipeline.py
+Copyright 2007 Thomas McGrew
+
+This file is part of The Python Image Manipulation Project.
+
+The Python Image Manipulation Project is free software: you can
+redistribute it and/or modify it under the terms of the GNU General
+Public License as published by the Free Software Foundation, either
+version 2 of the License, or (at your option) any later version.
+
+The Python Image Manipulation Project is distributed in the hope
+that it will be useful, but WITHOUT ANY WARRANTY; without even the
+implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with The Python Image Manipulation Project.  If not, see
+<http://www.gnu.org/licenses/>.
+"""
+
+from extensions.lib.color import pipeline
+
+# the kinds of stages understood by color.pipeline
+TABLE = 0
+TRANSFORM = 1
+GREY = 2
+
+# tables (red, green and blue) which leave every value unchanged
+IDENTITY = bytes(range(256)) * 3
+IDENTITY_TRANSFORM = (1, 0, 0, 0, 1, 0, 0, 0, 1)
+
+
+def _compose(first, second):
+    """
+    Internal Function. Combines two sets of tables into one which has the same
+    effect as applying first, then second.
+
+    :Parameters:
+        first : bytes
+            The red, green and blue tables applied first (768 bytes).
+        second : bytes
+            The red, green and blue tables applied second (768 bytes).
+
+    :rtype: bytes
+    :returns: The combined tables.
+    """
+    return b''.join(first[i:i + 256].translate(second[i:i + 256])
+            for i in (0, 256, 512))
+
+
+class Pipeline:
+    """
+    A chain of point operations (operations where each pixel of the result
+    depends only on the same pixel of the original) which is applied to an
+    image in a single pass over its data.
+
+    Operations are added with the methods below. They are named after the
+    functions in extensions.lib.core and extensions.lib.color they stand in
+    for, and return the pipeline so calls can be chained::
+
+        XRAY = Pipeline().to_grey().invert()
+        width, height, data = XRAY.execute(width, height, data)
+
+    Before it is run the chain is folded into as few stages as possible.
+    Tables, brightness changes and inversions are combined into one set of
+    tables, tables following a transform or greyscale conversion are looked
+    up as part of it, and everything after a greyscale conversion (including
+    pseudocolor, which is a greyscale conversion followed by a palette) only
+    depends on the grey value, so it becomes a single table. The result is
+    identical to calling the individual functions one after another.
+
+    Transforms are not multiplied together: each one is clipped to 0-255 and
+    rounded before the next is applied, which a combined matrix can't
+    reproduce. They still run in the same pass.
+    """
+    def __init__(self):
+        """
+        Creates an empty Pipeline.
+        """
+        self._operations = list()
+        self._stages = None
+
+    def _add(self, kind, value):
+        """
+        Internal Function. Appends an operation to the chain.
+
+        :Parameters:
+            kind : int
+                TABLE, TRANSFORM or GREY.
+            value : object
+                The tables for TABLE, the 9 transform values for TRANSFORM and
+                None for GREY.
+
+        :rtype: Pipeline
+        :returns: This pipeline.
+        """
+        self._operations.append((kind, value))
+        self._stages = None
+        return self
+
+    def table(self, sub_table):
+        """
+        Adds a substitution table, as extensions.lib.core.table.
+
+        :Parameters:
+            sub_table : sequence
+                256 integer values in range(256) used for substitution.
+
+        :rtype: Pipeline
+        :returns: This pipeline.
+        """
+        sub_table = bytes(sub_table)
+        if len(sub_table) != 256:
+            raise ValueError("The substitution table must contain 256 values")
+        return self._add(TABLE, sub_table * 3)
+
+    def channel_brightness(self, brightness):
+        """
+        Adds a change in brightness of the individual channels, as
+        extensions.lib.color.channel_brightness.
+
+        :Parameters:
+            brightness : tuple
+                The values to be added to the red, green and blue channels.
+
+        :rtype: Pipeline
+        :returns: This pipeline.
+        """
+        return self._add(TABLE, b''.join(
+            bytes(min(max(value + offset, 0), 255) for value in range(256))
+                for offset in brightness))
+
+    def invert(self):
+        """
+        Adds an inversion of the colors, as the invert filter.
+
+        :rtype: Pipeline
+        :returns: This pipeline.
+        """
+        return self._add(TABLE, bytes(range(255, -1, -1)) * 3)
+
+    def transform(self, transform):
+        """
+        Adds a color transform, as extensions.lib.color.transform.
+
+        :Parameters:
+            transform : tuple
+                The 9 values of the transform, 3 for each color.
+
+        :rtype: Pipeline
+        :returns: This pipeline.
+        """
+        transform = tuple(float(value) for value in transform)
+        if len(transform) != 9:
+            raise ValueError("The transform must contain 9 values")
+        if transform == IDENTITY_TRANSFORM:
+            return self
+        return self._add(TRANSFORM, transform)
+
+    def to_grey(self):
+        """
+        Adds a conversion to greyscale, as extensions.lib.color.to_grey.
+
+        :rtype: Pipeline
+        :returns: This pipeline.
+        """
+        return self._add(GREY, None)
+
+    def pseudocolor(self, p3):
+        """
+        Adds a replacement of each pixel with one of 16 colors based on its
+        intensity, as extensions.lib.color.pseudocolor.
+
+        :Parameters:
+            p3 : bytes
+                The data for the 16 replacement pixels.
+
+        :rtype: Pipeline
+        :returns: This pipeline.
+        """
+        p3 = bytes(p3)
+        if len(p3) != 48:
+            raise ValueError("Replacement data contained an invalid number of "
+                f"colors, 16 expected, {len(p3) // 3} recieved")
+        self._add(GREY, None)
+        return self._add(TABLE, b''.join(
+            bytes(p3[(value >> 4) * 3 + channel] for value in range(256))
+                for channel in range(3)))
+
+    def get_stages(self):
+        """
+        Folds the chain of operations into the stages passed to
+        extensions.lib.color.pipeline. The result is cached until another
+        operation is added.
+
+        :rtype: list
+        :returns: A list of (kind, transform, tables) tuples.
+        """
+        if self._stages is not None:
+            return self._stages
+
+        stages = list()
+        for kind, value in self._operations:
+            if kind != TABLE:
+                stages.append((kind, value, IDENTITY))
+            elif stages:
+                # tables are looked up at the end of the previous stage.
+                last_kind, transform, tables = stages[-1]
+                stages[-1] = (last_kind, transform, _compose(tables, value))
+            else:
+                stages.append((TABLE, None, value))
+
+        # after a greyscale conversion the rest of the chain depends only on
+        # the grey value, so it is run on all 256 of them to make one table.
+        for i, (kind, transform, tables) in enumerate(stages):
+            if kind == GREY:
+                if i + 1 < len(stages):
+                    probe = bytearray(768)
+                    probe[0::3] = tables[:256]
+                    probe[1::3] = tables[256:512]
+                    probe[2::3] = tables[512:]
+                    probe = pipeline(256, 1, probe, stages[i + 1:])[2]
+                    stages[i:] = [(GREY, None,
+                        bytes(probe[0::3] + probe[1::3] + probe[2::3]))]
+                break
+
+        self._stages = [(kind, transform, None if tables == IDENTITY else
+            tables) for kind, transform, tables in stages
+                if (kind, tables) != (TABLE, IDENTITY)]
+        return self._stages
+
+    def execute(self, width, height, data, out=None):
+        """
+        Applies the pipeline to an image.
+
+        :Parameters:
+            width : int
+                The width of the image in pixels
+            height : int
+                The height of the image in pixels
+            data : buffer
+                The image data as bytes, a bytearray or any other buffer.
+            out : buffer
+                An optional writable buffer the same size as data to write the
+                result into. This may be data itself.
+
+        :rtype: tuple
+        :returns: a tuple containing a width, height, and data. data is out if
+            it was passed in, otherwise a new bytearray.
+        """
+        return pipeline(width, height, data, self.get_stages(), out=out)
@@ -20,37 +20,15 @@ along with The Python Image Manipulation Project.  If not, see
 
 """
 
-from extensions.lib.core import spatial, string_copy
+from extensions.lib import canny
 
 MENU = "Fil&ter.&Edge Detect"
 LABEL = "Canny"
 DESCRIPTION = "Canny Edge Detect"
 
-GAUSSIAN = ( 2,  4,  5,  4,  2,
-             4,  9, 12,  9,  4,
-             5, 12, 15, 12,  5,
-             4,  9, 12,  9,  4,
-             2,  4,  5,  4,  2)
-
-FILTER1 = ( 0,  0,  0,
-           -1,  0,  1,
-            0,  0,  0 )
-
-FILTER2 = ( 0,  1,  0,
-            0,  0,  0,
-            0, -1,  0 )
-
-FILTER3 = (-1,  0,  0,
-            0,  0,  0,
-            0,  0,  1 )
-
-FILTER4 = ( 0,  0,  1,
-            0,  0,  0,
-           -1,  0,  0 )
-
-def execute( width, height, data ):
+def execute(width, height, data, low=4, high=12, out=None):
     """
-    Performs a Laplacian Edge Detect.
+    Performs a Canny Edge Detect.
 
     :Parameters:
         width : int
@@ -59,15 +37,16 @@ def execute( width, height, data ):
             The height of the image being converted
         data : string
             A string containing the data for the image
+        low : float
+            The weakest gradient, in levels of brightness per pixel, which can
+            be part of an edge.
+        high : float
+            The weakest gradient which starts an edge.
+        out : buffer
+            An optional writable buffer to write the result into. This may be
+            data itself.
 
     :rtype: tuple
     :returns: a tuple containing a width, height, and data as a binary string.
     """
-    spatial( width, height, data, GAUSSIAN )
-    edge1 = spatial( width, height, string_copy(data), FILTER1 )[2]
-    edge2 = spatial( width, height, string_copy(data), FILTER2 )[2]
-    edge3 = spatial( width, height, string_copy(data), FILTER3 )[2]
-    edge4 = spatial( width, height, string_copy(data), FILTER4 )[2]
-    data = bytes([min(255, sum(x)) for x in zip(edge1, edge2, edge3, edge4)])
-    data = bytes([min(255,x * 4) if x > 64 else 0 for x in data])
-    return width, height, data
+    return canny.execute(width, height, data, low, high, out=out)
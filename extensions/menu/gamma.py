@@ -19,7 +19,7 @@ along with The Python Image Manipulation Project.  If not, see
 <http://www.gnu.org/licenses/>.
 
 """
-import wx
+from extensions.lib.gui import wx, Dialog, show_dialog, preview
 
 from extensions.lib.core import table
 
@@ -29,7 +29,8 @@ DESCRIPTION = "Adjust brightness, contrast, and gamma"
 
 
 
-def execute(width, height, data, brightness=None, contrast=None, gamma=None):
+def execute(width, height, data, brightness=None, contrast=None, gamma=None,
+        out=None):
     """
     Performs a gamma adjustment on an image. Brightness, contrast, and gamma
     are optional arguments. Either all 3 must be supplied, or none. A dialog
@@ -49,20 +50,43 @@ def execute(width, height, data, brightness=None, contrast=None, gamma=None):
             The value of the change in contrast to apply.
         gamma : float
             The value of the change in gamma to apply.
+        out : buffer
+            An optional writable buffer to write the result into. This may be
+            data itself.
 
     :rtype: tuple
     :returns: a tuple containing a width, height, and data as a binary string.
     """
     if None in (gamma, brightness, contrast):
-        dialog = GammaDialog()
-        values = dialog.ShowModal()
+        values = show_dialog(GammaDialog, slider_update_func=
+                lambda gamma, brightness, contrast:
+                    preview(execute, brightness, contrast, gamma))
 
         if not values:
             return False
 
         gamma, brightness, contrast = values
 
-    # build a substitution table
+    return table(width, height, data, gamma_table(brightness, contrast, gamma),
+            out=out)
+
+
+def gamma_table(brightness, contrast, gamma):
+    """
+    Builds the substitution table for a brightness, contrast and gamma
+    adjustment.
+
+    :Parameters:
+        brightness : int
+            The value of the change in brightness to apply.
+        contrast : float
+            The value of the change in contrast to apply.
+        gamma : float
+            The value of the change in gamma to apply.
+
+    :rtype: list
+    :returns: A list of 256 values to be passed to table().
+    """
     subst_table = list(range(256))
 
     for i in range(256):
@@ -70,12 +94,12 @@ def execute(width, height, data, brightness=None, contrast=None, gamma=None):
         subst_table[i] = min(int(subst_table[i] * contrast), 255)
         subst_table[i] = min(int(subst_table[i] ** gamma / 256 ** (gamma-1)), 255)
 
-    return table(width, height, data, subst_table)
+    return subst_table
 
 
 
 
-class GammaDialog(wx.Dialog):
+class GammaDialog(Dialog):
     """
     A class for getting input values from the user for the nintendize filter
     """
@@ -99,7 +123,7 @@ class GammaDialog(wx.Dialog):
                 The title of the dialog box to be displayed in the titlebar.
                 Defaults to "Brightness Adjust".
         """
-        wx.Dialog.__init__(self, parent, id, title, wx.DefaultPosition,
+        Dialog.__init__(self, parent, id, title, wx.DefaultPosition,
                 (320, 180))
 
         self._brightness_slider = wx.Slider(self, -1, value=0, minValue=-255,
@@ -222,7 +246,7 @@ class GammaDialog(wx.Dialog):
         :returns: The values for gamma, brightness, and contrast values in a
         tuple if OK is clicked. Returns False otherwise.
         """
-        wx.Dialog.ShowModal(self)
+        Dialog.ShowModal(self)
         if self._is_ok:
             return (self._gamma_value, self._brightness_value,
                     self._contrast_value)
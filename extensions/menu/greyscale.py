@@ -26,7 +26,7 @@ MENU = "&Image.&Color"
 LABEL = "&Greyscale"
 DESCRIPTION = "Convert this image to greyscale"
 
-def execute(width, height, data):
+def execute(width, height, data, out=None):
     """
     Converts an image to greyscale.
 
@@ -37,8 +37,11 @@ def execute(width, height, data):
             The height of the image being converted
         data : string
             A string containing the data for the image
+        out : buffer
+            An optional writable buffer to write the result into. This may be
+            data itself.
 
     :rtype: tuple
     :returns: a tuple containing a width, height, and data as a binary string.
     """
-    return to_grey(width, height, data)
+    return to_grey(width, height, data, out=out)
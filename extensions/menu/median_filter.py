@@ -19,7 +19,7 @@ along with The Python Image Manipulation Project.  If not, see
 <http://www.gnu.org/licenses/>.
 """
 
-import wx
+from extensions.lib.gui import wx, Dialog, show_dialog, preview
 
 from extensions.lib import median_filter
 
@@ -28,7 +28,7 @@ LABEL = "&Median Filter"
 DESCRIPTION = "Smooths an image by making each pixel appear more like it's " \
         "neighboring pixels"
 
-def execute(width, height, data, filter_size=None):
+def execute(width, height, data, filter_size=None, out=None):
     """
     Smooths an image by making each pixel appear more like it's neighboring
     pixels.
@@ -45,23 +45,27 @@ def execute(width, height, data, filter_size=None):
         filter_size : int
             The size of the filter to be applied to the image. A dialog box will
             request this value if it is not supplied.
+        out : buffer
+            An optional writable buffer to write the result into. This may be
+            data itself.
 
     :rtype: tuple
     :returns: a tuple containing a width, height, and data as a binary string.
     """
     if filter_size is None:
-        dialog = MedianFilterDialog()
-        values = dialog.ShowModal()
+        values = show_dialog(MedianFilterDialog, slider_update_func=
+                lambda filter_size: preview(execute, filter_size))
 
         if not values:
             return False
 
         filter_size = values
 
-    return median_filter.execute(width, height, data, filter_size)
+    return median_filter.execute(width, height, data, filter_size,
+            out=out)
 
 
-class MedianFilterDialog(wx.Dialog):
+class MedianFilterDialog(Dialog):
     """
     A class for getting input values from the user for the nintendize filter
     """
@@ -85,13 +89,13 @@ class MedianFilterDialog(wx.Dialog):
                 The title of the dialog box to be displayed in the titlebar.
                 Defaults to "Median Filter Options".
         """
-        wx.Dialog.__init__(self, parent, id, title, wx.DefaultPosition,
+        Dialog.__init__(self, parent, id, title, wx.DefaultPosition,
                 (320, 130))
 
         self._filter_size_val = 3
 
         self.filterSizeSlider   = wx.Slider(self, -1,
-                value=self._filter_size_val, minValue=3, maxValue=15,
+                value=self._filter_size_val, minValue=3, maxValue=101,
                 pos=(80, 10), size=(200, 30))
 
         self._display_panel = wx.Panel(self, -1, pos=(280, 10), size=(50, 30))
@@ -171,7 +175,7 @@ class MedianFilterDialog(wx.Dialog):
         Internal Function. Called when one of the sliders is changed to update
         the values displayed.
         """
-        self._filter_size_display.SetLabel("%2d" % self._filter_size_val)
+        self._filter_size_display.SetLabel("%3d" % self._filter_size_val)
 
     def ShowModal(self):
         """
@@ -182,7 +186,7 @@ class MedianFilterDialog(wx.Dialog):
         :returns: The values for resolution and color level in a tuple if OK is
         clicked. Returns False otherwise.
         """
-        wx.Dialog.ShowModal(self)
+        Dialog.ShowModal(self)
         if self._is_ok:
             return self._filter_size_val
         return False
@@ -19,7 +19,7 @@ along with The Python Image Manipulation Project.  If not, see
 <http://www.gnu.org/licenses/>.
 """
 
-import wx
+from extensions.lib.gui import wx, Dialog, show_dialog, preview
 
 from extensions.lib import nintendize
 
@@ -27,7 +27,8 @@ MENU = "Fil&ter.&Comic"
 LABEL = "Nintendi&ze"
 DESCRIPTION = "Nintendize it!"
 
-def execute(width, height, data, resolution=None, color_level=None):
+def execute(width, height, data, resolution=None, color_level=None,
+        out=None):
     """
     Pixellates the image and reduces bit quality in a way such that it
     looks like an image from an old video game console. Resolution and
@@ -49,24 +50,30 @@ def execute(width, height, data, resolution=None, color_level=None):
             The resolution value to apply to the image.
         colorLevel : int
             The colorLevel value to apply to the image
+        out : buffer
+            An optional writable buffer to write the result into. This may be
+            data itself.
 
     :rtype: tuple
     :returns: A tuple (width, height, data). Width and height are in pixels,
         data is a binary string.
     """
     if None in (resolution, color_level):
-        dialog = NintendizeDialog(max_resolution = min(width, height))
-        values = dialog.ShowModal()
+        values = show_dialog(NintendizeDialog,
+                max_resolution = min(width, height), slider_update_func=
+                lambda resolution, color_level:
+                    preview(execute, resolution, color_level))
 
         if not values:
             return False
 
-        resolution, colorlevel = values
+        resolution, color_level = values
 
-    return nintendize.execute(width, height, data, resolution, colorlevel)
+    return nintendize.execute(width, height, data, resolution, color_level,
+            out=out)
 
 
-class NintendizeDialog(wx.Dialog):
+class NintendizeDialog(Dialog):
     """
     A class for getting input values from the user for the nintendize filter
     """
@@ -94,7 +101,7 @@ class NintendizeDialog(wx.Dialog):
                 The maximim value to be available on the resolution slider.
                 Defaults to 500.
         """
-        wx.Dialog.__init__(self, parent, id, title,
+        Dialog.__init__(self, parent, id, title,
                 wx.DefaultPosition,(330, 140))
 
         self._resolution_value = 200
@@ -200,7 +207,7 @@ class NintendizeDialog(wx.Dialog):
         :returns: The values for resolution and color level in a tuple if OK is
             clicked. Returns False otherwise.
         """
-        wx.Dialog.ShowModal(self)
+        Dialog.ShowModal(self)
         if self._is_ok:
             return (self._resolution_value, self._color_level_value)
         return False
@@ -31,7 +31,7 @@ FILTER = (1,  1,  1,
           1,  1,  1)
 
 
-def execute(width, height, data):
+def execute(width, height, data, out=None):
     """
     Smooths an image evenly on a 3x3 area.
 
@@ -42,8 +42,11 @@ def execute(width, height, data):
             The height of the image being converted
         data : string
             A string containing the data for the image
+        out : buffer
+            An optional writable buffer to write the result into. This may be
+            data itself.
 
     :rtype: tuple
     :returns: a tuple containing a width, height, and data as a binary string.
     """
-    return spatial(width, height, data, FILTER)
+    return spatial(width, height, data, FILTER, out=out)
@@ -19,18 +19,28 @@ along with The Python Image Manipulation Project.  If not, see
 <http://www.gnu.org/licenses/>.
 """
 
-import wx
+from extensions.lib.gui import wx, Dialog, show_dialog
 
 from extensions.lib.core import quick_scale
+from extensions.lib.resample import resample, METHODS as RESAMPLE_METHODS
 
 MENU = "&Image"
 LABEL = "Image Size"
-DESCRIPTION = "Scale The image using a fast, low quality algorithm"
+DESCRIPTION = "Scale the image, with a choice of speed or quality"
 
+# the ways an image can be scaled, from fastest to best. "nearest" uses
+# quick_scale, the others are the filters of extensions.lib.resample.
+METHODS = ("nearest",) + RESAMPLE_METHODS
+# the method selected when the dialog is shown
+DEFAULT_METHOD = "bicubic"
 
-def execute(width, height, data):
+
+def execute(width, height, data, new_width=None, new_height=None,
+        method="nearest"):
     """
-    Scales an image using a fast, low quality algorithm.
+    Scales an image. If only one of new_width and new_height is supplied the
+    other is chosen to keep the proportions of the image. A dialog box will
+    request both, and the method, if neither is supplied.
 
     :Parameters:
         width : int
@@ -39,20 +49,37 @@ def execute(width, height, data):
             The height of the image being converted
         data : string
             A string containing the data for the image
+        new_width : int
+            The width of the scaled image.
+        new_height : int
+            The height of the scaled image.
+        method : string
+            One of METHODS. "nearest" is fast but gives blocky results
+            scaling up and jagged ones scaling down, "box", "bilinear",
+            "bicubic" and "lanczos3" are slower and progressively sharper.
 
     :rtype: tuple
     :returns: a tuple containing a width, height, and data as a binary string.
     """
-    dialog = ScaleDialog(default_width = width, default_height = height)
-    values = dialog.ShowModal()
+    if new_width is None and new_height is None:
+        values = show_dialog(ScaleDialog, default_width = width,
+                default_height = height)
 
-    if not values:
-        return False
+        if not values:
+            return False
 
-    return quick_scale(width, height, data, *values)
+        new_width, new_height, method = values
+    elif new_height is None:
+        new_height = max(1, round(height * new_width / width))
+    elif new_width is None:
+        new_width = max(1, round(width * new_height / height))
 
+    if method == "nearest":
+        return quick_scale(width, height, data, new_width, new_height)
+    return resample(width, height, data, new_width, new_height, method)
 
-class ScaleDialog(wx.Dialog):
+
+class ScaleDialog(Dialog):
     """
     A class for getting input values from the user for the scale filter
     """
@@ -79,8 +106,8 @@ class ScaleDialog(wx.Dialog):
                 The maximim value to be available on the resolution slider.
                 Defaults to 500.
         """
-        wx.Dialog.__init__(self, parent, id, title, wx.DefaultPosition,
-                (240, 165))
+        Dialog.__init__(self, parent, id, title, wx.DefaultPosition,
+                (240, 195))
 
         self._width_entry  = wx.TextCtrl(self, -1, value = str(default_width),
                 pos = (70, 35), size = (100, 20))
@@ -97,16 +124,23 @@ class ScaleDialog(wx.Dialog):
         self._height_display  = wx.StaticText(self._display_panel, pos=(0, 55),
                 label=str(default_height))
 
-        self._label_panel  = wx.Panel(self, -1, pos=(10, 35), size=(50, 50))
+        self._method_choice = wx.Choice(self, -1, pos = (70, 92),
+                size = (100, 25), choices = [method.capitalize()
+                    for method in METHODS])
+        self._method_choice.SetSelection(METHODS.index(DEFAULT_METHOD))
+
+        self._label_panel  = wx.Panel(self, -1, pos=(10, 35), size=(50, 80))
         self._width_label  = wx.StaticText(self._label_panel, pos=(0,  0),
                 label=" Width")
         self._height_label = wx.StaticText(self._label_panel, pos=(0, 30),
                 label="Height")
+        self._method_label = wx.StaticText(self._label_panel, pos=(0, 60),
+                label="Filter")
 
         self._is_ok = False
-        ok_button     = wx.Button(self, id = wx.ID_OK,     pos=( 30, 95),
+        ok_button     = wx.Button(self, id = wx.ID_OK,     pos=( 30, 125),
                 size=(80, 30))
-        cancel_button = wx.Button(self, id = wx.ID_CANCEL, pos=(130, 95),
+        cancel_button = wx.Button(self, id = wx.ID_CANCEL, pos=(130, 125),
                 size=(80, 30))
 
         if ok_func:
@@ -114,7 +148,7 @@ class ScaleDialog(wx.Dialog):
         elif hasattr(self, "onOk"):
             self._ok_func = self.onOk
         else:
-            self._ok_func = lambda x,y: None
+            self._ok_func = lambda x,y,z: None
 
         self._width_entry.Bind( wx.EVT_CHAR, self._validate)
         self._height_entry.Bind(wx.EVT_CHAR, self._validate)
@@ -163,7 +197,8 @@ class ScaleDialog(wx.Dialog):
                 Event generated by clicking a button. The argument is ignored.
         """
         self._ok_func(int(self._width_entry.GetValue()),
-                int(self._height_entry.GetValue()))
+                int(self._height_entry.GetValue()),
+                METHODS[self._method_choice.GetSelection()])
         self._is_ok = True
         self.Destroy()
 
@@ -173,11 +208,12 @@ class ScaleDialog(wx.Dialog):
         to return a value.
 
         :rtype: tuple or boolean
-        :returns: The values for resolution and color level in a tuple if OK is
-            clicked. Returns False otherwise.
+        :returns: The width, height and method in a tuple if OK is clicked.
+            Returns False otherwise.
         """
-        wx.Dialog.ShowModal(self)
+        Dialog.ShowModal(self)
         if self._is_ok:
             return (int(self._width_entry.GetValue()),
-                    int(self._height_entry.GetValue()))
+                    int(self._height_entry.GetValue()),
+                    METHODS[self._method_choice.GetSelection()])
         return False
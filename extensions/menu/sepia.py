@@ -20,14 +20,19 @@ along with The Python Image Manipulation Project.  If not, see
 
 """
 
-from extensions.lib.color import channel_brightness, to_grey
-from extensions.menu.gamma import execute as gamma
+from extensions.lib.pipeline import Pipeline
+from extensions.menu.gamma import gamma_table
 
 MENU = "&Image.&Color"
 LABEL = "&Sepia Tone"
 DESCRIPTION = "Convert this image to sepia tone"
 
-def execute(width, height, data):
+# greyscale, tint, then adjust the gamma. This folds into a single table
+# lookup on the grey value of each pixel.
+SEPIA = Pipeline().to_grey().channel_brightness((0, -18, -35)).table(
+        gamma_table(brightness=0, contrast=1.1, gamma=0.8))
+
+def execute(width, height, data, out=None):
     """
     Converts the colors in an image to resemble a sepia tone photograph.
 
@@ -38,11 +43,11 @@ def execute(width, height, data):
             The height of the image being converted
         data : string
             A string containing the data for the image
+        out : buffer
+            An optional writable buffer to write the result into. This may be
+            data itself.
 
     :rtype: tuple
     :returns: a tuple containing a width, height, and data as a binary string.
     """
-    pass1 = to_grey(width, height, data)[2]
-    pass2 = channel_brightness(width, height, pass1, (0, -18, -35))[2]
-    # now adjust the gamma
-    return gamma(width, height, pass2, brightness=0, contrast=1.1, gamma=0.8)
+    return SEPIA.execute(width, height, data, out=out)
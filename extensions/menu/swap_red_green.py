@@ -26,7 +26,7 @@ MENU = "&Image.S&wap Channels"
 LABEL = "Red <-> Green"
 DESCRIPTION = "Swap the red and green channels in this image"
 
-def execute(width, height, data):
+def execute(width, height, data, out=None):
     """
     Swaps the red and green channels in an Image.
 
@@ -37,11 +37,14 @@ def execute(width, height, data):
             The height of the image being converted
         data : string
             A string containing the data for the image
+        out : buffer
+            An optional writable buffer to write the result into. This may be
+            data itself.
 
     :rtype: tuple
     :returns: a tuple containing a width, height, and data as a binary string.
     """
     channels = len(data) // (width * height)
     if channels in (3, 4):
-        return swap_channels(width, height, data, 0, 1)
+        return swap_channels(width, height, data, 0, 1, out=out)
     return width, height, data
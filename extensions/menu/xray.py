@@ -20,15 +20,16 @@ along with The Python Image Manipulation Project.  If not, see
 
 """
 
-from extensions.lib.color import to_grey
-from extensions.menu.invert import execute as invert
+from extensions.lib.pipeline import Pipeline
 
 MENU = "Fil&ter.&Comic"
 LABEL = "X-Ray"
 DESCRIPTION = "I can see inside you..."
 
+XRAY = Pipeline().to_grey().invert()
 
-def execute(width, height, data):
+
+def execute(width, height, data, out=None):
     """
     Changes an image to greyscale and inverts the colors so as to make it
     appear more like an x-ray photo.
@@ -40,8 +41,11 @@ def execute(width, height, data):
             The height of the image being converted
         data : string
             A string containing the data for the image
+        out : buffer
+            An optional writable buffer to write the result into. This may be
+            data itself.
 
     :rtype: tuple
     :returns: a tuple containing a width, height, and data as a binary string.
     """
-    return invert(*to_grey(width, height, data))
+    return XRAY.execute(width, height, data, out=out)
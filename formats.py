@@ -0,0 +1,310 @@
+"""
+formats.py
+Copyright 2007 Thomas McGrew
+
+This file is part of The Python Image Manipulation Project.
+
+The Python Image Manipulation Project is free software: you can
+redistribute it and/or modify it under the terms of the GNU General
+Public License as published by the Free Software Foundation, either
+version 2 of the License, or (at your option) any later version.
+
+The Python Image Manipulation Project is distributed in the hope
+that it will be useful, but WITHOUT ANY WARRANTY; without even the
+implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with The Python Image Manipulation Project.  If not, see
+<http://www.gnu.org/licenses/>.
+
+Reading and writing image files through the file format extensions. This does
+not depend on wx, so it can be used by the batch mode as well as the editor.
+"""
+
+# library imports
+import os
+
+import registry
+from image import Image
+from error import ImageFormatError, UnsupportedImageTypeError, ExtensionError
+
+DEBUG = False
+
+# create dictionaries for storing file reader extensions.
+file_reader = {'ext' : dict(), 'marker' : dict()}
+
+# the FILE_MARKERs as a trie, one level per byte. The extension whose marker
+# ends at a node is stored under None.
+_marker_trie = dict()
+# the length of the longest FILE_MARKER
+_marker_size = 0
+
+
+def reload_extensions():
+    """
+    Reloads file reader extensions. Currently does not re-parse already loaded
+    extensions but will load new ones.
+    """
+    load_extensions()
+
+def load_extensions():
+    """
+    Scans extension directories for available extensions. The extensions are
+    only imported when a file of their type is first read or written.
+    """
+    debug("Loading file format extensions")
+    for tmp in registry.load(("extensions", "format")):
+        if hasattr(tmp, "FILE_EXTENSION"):
+            if type(tmp.FILE_EXTENSION) in (list, tuple):
+                for ext in tmp.FILE_EXTENSION:
+                    file_reader['ext'][ext.lower()] = tmp
+            else:
+                file_reader['ext'][tmp.FILE_EXTENSION.lower()] = tmp
+        if hasattr(tmp, "FILE_MARKER"):
+            file_reader['marker'][tmp.FILE_MARKER] = tmp
+    _build_trie()
+    for ext in file_reader['ext']:
+        debug(f"Loaded fileHandler for {ext} files")
+    debug()
+
+
+def _build_trie():
+    """
+    Internal Function. Builds _marker_trie from the markers in file_reader.
+    """
+    global _marker_size
+    _marker_trie.clear()
+    _marker_size = 0
+    for marker, module in file_reader['marker'].items():
+        if not marker:
+            continue
+        node = _marker_trie
+        for byte in marker:
+            node = node.setdefault(byte, dict())
+        node[None] = module
+        _marker_size = max(_marker_size, len(marker))
+
+
+def _match_marker(head):
+    """
+    Internal Function. Finds the extension for a file from its first bytes.
+
+    :Parameters:
+        head : bytes
+            The start of the file, at least _marker_size bytes if the file is
+            that long.
+
+    :rtype: LazyModule
+    :returns: The extension with the longest FILE_MARKER the file starts
+        with, or None if it doesn't start with any of them.
+    """
+    node = _marker_trie
+    module = None
+    for byte in head:
+        node = node.get(byte)
+        if node is None:
+            break
+        module = node.get(None, module)
+    return module
+
+
+def _find_extension(filename, image_file):
+    """
+    Internal Function. Finds the extension to read a file with. The file is
+    recognised by its first bytes where possible, so incorrectly named files
+    are read by the right extension the first time. Formats without a
+    FILE_MARKER can only be recognised by the file's name.
+
+    :Parameters:
+        filename : string
+            The name of the file.
+        image_file : file
+            The file, opened in binary mode and positioned at its start.
+
+    :rtype: tuple
+    :returns: A tuple (module, img_ext), the extension and the file
+        extension it handles, for error messages.
+    """
+    img_ext = os.path.splitext(filename)[1][1:].lower() # get the file ext
+    named = file_reader['ext'].get(img_ext)
+    module = _match_marker(image_file.read(_marker_size))
+    if module is None:
+        if named is None:
+            raise UnsupportedImageTypeError(f"File extension '{img_ext}' has "
+                "no extension associated with it")
+        return (named, img_ext)
+    if module is not named:
+        if hasattr(module, 'DESCRIPTION'):
+            debug(f"File '{filename}' was found to be incorrectly named as a "
+                f"'{img_ext}' file (it is a '{module.DESCRIPTION}' file)")
+        else:
+            debug(f"File '{filename}' was found to be an incorrectly named "
+                "file")
+        extensions = getattr(module, 'FILE_EXTENSION', img_ext)
+        if isinstance(extensions, (list, tuple)):
+            extensions = extensions[0]
+        img_ext = extensions.lower()
+    return (module, img_ext)
+
+
+def _get_function(module, name, img_ext):
+    """
+    Internal Function. Gets a function from a file format extension, importing
+    the extension if needed.
+
+    :Parameters:
+        module : LazyModule
+            The extension.
+        name : string
+            The name of the function, "read", "write" or "probe".
+        img_ext : string
+            The file extension the module handles, for error messages.
+
+    :rtype: function
+    :returns: The function, or None if the extension doesn't define it.
+    """
+    try:
+        return getattr(module, name, None)
+    except ImportError as error:
+        raise UnsupportedImageTypeError("The extension for handling files of "
+            f"type '{img_ext}' could not be loaded: {error}")
+
+
+def _read(module, filename, img_ext, scale):
+    """
+    Internal Function. Reads a file with a file format extension.
+
+    :Parameters:
+        module : LazyModule
+            The extension.
+        filename : string
+            The name of the file to be read, or the file itself opened in
+            binary mode.
+        img_ext : string
+            The file extension the module handles, for error messages.
+        scale : float
+            The smallest fraction of the full size needed, passed on to
+            extensions which define SCALES.
+
+    :rtype: tuple
+    :returns: The (width, height, data) tuple returned by the extension.
+    """
+    reader = _get_function(module, "read", img_ext)
+    if not reader:
+        raise UnsupportedImageTypeError("The extension for handling files "
+            f"of type '{img_ext}' contains no method for reading.")
+    if scale < 1 and getattr(module, "SCALES", None):
+        return reader(filename, scale)
+    return reader(filename)
+
+
+def write(filename, image):
+    """
+    Writes an image out to file. The image format must be supported by a file
+    format extension.
+
+    :Parameters:
+        filename : string
+            The path to the file to be written.
+        image : Image
+            The Image containing the data to be written.
+    """
+    width, height = image.get_size()
+    img_ext = os.path.splitext(filename)[1][1:].lower() # get the file ext
+
+    if img_ext not in file_reader['ext']:
+        raise UnsupportedImageTypeError(f"File extension '{img_ext}' has no "
+            "extension associated with it")
+    writer = _get_function(file_reader['ext'][img_ext], "write", img_ext)
+    if not writer:
+        raise UnsupportedImageTypeError("The extension for handling files of "
+            f"type '{img_ext}' contains no method for writing.")
+    return writer(filename, width, height, image.get_data())
+
+
+def read(filename, scale=1):
+    """
+    Calls the appropriate extension to read the image file, if one exists.
+
+    :Paramters:
+        filename : string
+            The name of the file to be read.
+        scale : float
+            The smallest fraction of the full size needed, e.g. 1/8 when
+            making a thumbnail. Extensions which can decode a reduced image
+            cheaply (those defining SCALES, such as jpeg) return one between
+            this and the full size, others always read the full image.
+            Defaults to 1.
+
+    :rtype: Image
+    :returns: The image read from the file.
+    """
+    with open(filename, 'rb') as image_file:
+        module, img_ext = _find_extension(filename, image_file)
+        try:
+            img_data = _read(module, image_file, img_ext, scale)
+        except ImageFormatError as message:
+            debug(message)
+            raise UnsupportedImageTypeError(f"'{filename}' is not a file "
+                "type any extension can read")
+    return _to_image(img_data, img_ext)
+
+
+def _to_image(img_data, img_ext):
+    """
+    Internal Function. Checks what a file format extension's read returned and
+    makes an Image of it.
+
+    :Parameters:
+        img_data : tuple
+            The value returned by the extension.
+        img_ext : string
+            The file extension the module handles, for error messages.
+
+    :rtype: Image
+    :returns: The image read from the file.
+    """
+    if len(img_data) != 3:
+        raise ExtensionError(f"File format extension for '{img_ext}' returned "
+           "an invalid number of arguments")
+    width, height, data = img_data
+    return Image(width, height, data)
+
+
+def probe(filename):
+    """
+    Gets the size of an image file and the number of channels read would
+    return for it. Extensions which define probe only read the file's
+    header, the image is read in full for the others.
+
+    :Parameters:
+        filename : string
+            The name of the file to be probed.
+
+    :rtype: tuple
+    :returns: A tuple (width, height, channels).
+    """
+    with open(filename, 'rb') as image_file:
+        module, img_ext = _find_extension(filename, image_file)
+        prober = _get_function(module, "probe", img_ext)
+        try:
+            if prober:
+                return prober(image_file)
+            image = _to_image(_read(module, image_file, img_ext, 1), img_ext)
+        except ImageFormatError as message:
+            debug(message)
+            raise UnsupportedImageTypeError(f"'{filename}' is not a file "
+                "type any extension can read")
+    return (image.get_width(), image.get_height(),
+        4 if image.has_alpha() else 3)
+
+
+def debug(string=""):
+    """
+    Internal Function that handles debug output for the program.
+    """
+    if DEBUG:
+        print(string)
+
+load_extensions() # call the function to load all available extensions.
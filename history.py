@@ -0,0 +1,387 @@
+"""
+history.py
+Copyright 2007 Thomas McGrew
+
+This file is part of The Python Image Manipulation Project.
+
+The Python Image Manipulation Project is free software: you can
+redistribute it and/or modify it under the terms of the GNU General
+Public License as published by the Free Software Foundation, either
+version 2 of the License, or (at your option) any later version.
+
+The Python Image Manipulation Project is distributed in the hope
+that it will be useful, but WITHOUT ANY WARRANTY; without even the
+implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with The Python Image Manipulation Project.  If not, see
+<http://www.gnu.org/licenses/>.
+
+Undo and redo history which stores images in compressed chunks.
+
+Each image is split into chunks of CHUNK_SIZE bytes (a band of whole rows),
+which are identified by a hash of their contents and stored once however many
+states use them. A filter which only changes part of an image therefore only
+adds the chunks it changed to the history. Chunks are compressed with zlib on
+a background thread. When the compressed chunks use more memory than the
+budget the oldest ones are moved to a temporary file, and when that grows
+past its own budget the oldest states are forgotten.
+"""
+
+# library imports
+import zlib
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import blake2b
+
+from image import Image, MappedImage
+
+# the size of the pieces images are split into
+CHUNK_SIZE = 1 << 18
+# the zlib compression level. 1 is several times faster than the default and
+# compresses nearly as well on image data.
+COMPRESSION = 1
+# the default memory and temporary file budgets in bytes
+MEMORY_BUDGET = 256 << 20
+DISK_BUDGET = 4 << 30
+# the number of images waiting to be compressed before push() waits
+MAX_PENDING = 2
+
+
+class _State:
+    """
+    Internal Class. One image in the history.
+    """
+    def __init__(self, image, serial):
+        self.width, self.height = image.get_size()
+        # the image itself until its chunks are stored
+        self.image = image
+        # restored into a new temporary file rather than memory if it was in
+        # one.
+        self.mapped = isinstance(image, MappedImage)
+        self.chunks = None
+        self.serial = serial
+        self.discarded = False
+        self.future = None
+
+
+class History:
+    """
+    Undo and redo stacks of images, stored as deduplicated, compressed chunks
+    within a memory budget.
+    """
+    def __init__(self, memory_budget=MEMORY_BUDGET, disk_budget=DISK_BUDGET):
+        """
+        Creates an empty History.
+
+        :Parameters:
+            memory_budget : int
+                The number of bytes of compressed chunks to keep in memory.
+            disk_budget : int
+                The size the temporary file holding older chunks may grow to,
+                or 0 to forget old states instead of writing them to disk.
+        """
+        self.memory_budget = memory_budget
+        self.disk_budget = disk_budget
+        self._undo = list()
+        self._redo = list()
+        # digest: [references, the stored bytes or their (offset, length) in
+        # the temporary file, the uncompressed length]. Chunks which don't
+        # compress are stored as they are.
+        self._chunks = dict()
+        self._memory_used = 0
+        self._spill = None
+        self._spill_size = 0
+        self._spilled = 0
+        self._serial = 0
+        self._lock = threading.RLock()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._pending = list()
+
+    # ============================= PUBLIC METHODS =============================
+    def push(self, image):
+        """
+        Adds an image to the undo stack, before it is replaced by a change.
+        This clears the redo stack.
+
+        :Parameters:
+            image : Image
+                The image being replaced. Its data must not be modified
+                afterwards.
+        """
+        self._throttle()
+        with self._lock:
+            for state in self._redo:
+                self._discard(state)
+            self._redo = list()
+            self._undo.append(self._add(image))
+
+    def undo(self, image):
+        """
+        Steps back through the history.
+
+        :Parameters:
+            image : Image
+                The current image, which is added to the redo stack.
+
+        :rtype: Image
+        :returns: The previous image, or None if there is nothing to undo.
+        """
+        return self._step(self._undo, self._redo, image)
+
+    def redo(self, image):
+        """
+        Steps forward through the history.
+
+        :Parameters:
+            image : Image
+                The current image, which is added to the undo stack.
+
+        :rtype: Image
+        :returns: The next image, or None if there is nothing to redo.
+        """
+        return self._step(self._redo, self._undo, image)
+
+    def can_undo(self):
+        """
+        :rtype: bool
+        :returns: True if there is an image to undo to.
+        """
+        return bool(self._undo)
+
+    def can_redo(self):
+        """
+        :rtype: bool
+        :returns: True if there is an image to redo to.
+        """
+        return bool(self._redo)
+
+    def clear(self):
+        """
+        Forgets every image in the history.
+        """
+        with self._lock:
+            for state in self._undo + self._redo:
+                self._discard(state)
+            self._undo = list()
+            self._redo = list()
+
+    def get_usage(self):
+        """
+        Get the space used by the history.
+
+        :rtype: tuple
+        :returns: A tuple (memory, disk) of the bytes used by compressed
+            chunks in memory and in the temporary file.
+        """
+        return (self._memory_used, self._spilled)
+
+    def close(self):
+        """
+        Forgets every image and stops the background thread.
+        """
+        self.clear()
+        self._executor.shutdown(wait=True)
+        if self._spill:
+            self._spill.close()
+            self._spill = None
+
+    # ============================ INTERNAL METHODS ============================
+    def _add(self, image):
+        """
+        Internal Function. Creates a state for an image and queues it to be
+        compressed.
+        """
+        self._serial += 1
+        state = _State(image, self._serial)
+        state.future = self._executor.submit(self._store, state)
+        self._pending.append(state.future)
+        return state
+
+    def _throttle(self):
+        """
+        Internal Function. Waits while too many images are queued to be
+        compressed, so they can't pile up in memory. This must not be called
+        with the lock held.
+        """
+        self._pending = [future for future in self._pending
+            if not future.done()]
+        while len(self._pending) >= MAX_PENDING:
+            self._pending.pop(0).result()
+
+    def _step(self, source, destination, image):
+        """
+        Internal Function. Moves the current image onto one stack and takes
+        the last image off the other.
+        """
+        self._throttle()
+        with self._lock:
+            if not source:
+                return None
+            state = source.pop()
+            destination.append(self._add(image))
+            return self._restore(state)
+
+    def _store(self, state):
+        """
+        Internal Function. Splits an image into chunks and stores them. This
+        runs on the background thread.
+        """
+        view = memoryview(state.image.get_data()).cast('B')
+        digests = list()
+        for offset in range(0, view.nbytes, CHUNK_SIZE):
+            chunk = view[offset:offset + CHUNK_SIZE]
+            digest = blake2b(chunk, digest_size=16).digest()
+            with self._lock:
+                if digest in self._chunks:
+                    self._chunks[digest][0] += 1
+                    digests.append(digest)
+                    continue
+            # compressed outside the lock, zlib releases the GIL.
+            compressed = zlib.compress(chunk, COMPRESSION)
+            if len(compressed) >= chunk.nbytes:
+                compressed = chunk.tobytes()
+            with self._lock:
+                if digest in self._chunks:
+                    self._chunks[digest][0] += 1
+                else:
+                    self._chunks[digest] = [1, compressed, chunk.nbytes]
+                    self._memory_used += len(compressed)
+                digests.append(digest)
+        with self._lock:
+            state.chunks = digests
+            if state.discarded:
+                self._release(state)
+            else:
+                state.image = None
+            self._enforce_budget()
+
+    def _restore(self, state):
+        """
+        Internal Function. Rebuilds the image for a state and removes the
+        state from the history.
+        """
+        with self._lock:
+            image = state.image
+            if image is None:
+                size = sum(self._chunks[digest][2] for digest in state.chunks)
+                if state.mapped:
+                    image = MappedImage(state.width, state.height,
+                        channels=size // (state.width * state.height))
+                    data = image.get_data()
+                else:
+                    data = bytearray(size)
+                offset = 0
+                for digest in state.chunks:
+                    chunk = self._read(digest)
+                    data[offset:offset + len(chunk)] = chunk
+                    offset += len(chunk)
+                if not state.mapped:
+                    image = Image(state.width, state.height, data)
+            self._discard(state)
+        return image
+
+    def _read(self, digest):
+        """
+        Internal Function. Reads and decompresses a chunk.
+        """
+        references, location, length = self._chunks[digest]
+        if isinstance(location, tuple):
+            self._spill.seek(location[0])
+            location = self._spill.read(location[1])
+        if len(location) < length:
+            return zlib.decompress(location)
+        return location
+
+    def _discard(self, state):
+        """
+        Internal Function. Removes a state, releasing its chunks once they
+        are stored.
+        """
+        state.discarded = True
+        state.image = None
+        if state.chunks is not None:
+            self._release(state)
+
+    def _release(self, state):
+        """
+        Internal Function. Drops a state's references to its chunks.
+        """
+        for digest in state.chunks:
+            entry = self._chunks[digest]
+            entry[0] -= 1
+            if not entry[0]:
+                del self._chunks[digest]
+                if isinstance(entry[1], tuple):
+                    self._spilled -= entry[1][1]
+                else:
+                    self._memory_used -= len(entry[1])
+        state.chunks = list()
+        if self._spill and not self._spilled:
+            # nothing in the file is used any more, so it can start over.
+            self._spill.truncate(0)
+            self._spill_size = 0
+
+    def _enforce_budget(self):
+        """
+        Internal Function. Moves the chunks of the oldest states to the
+        temporary file, and forgets the oldest states, until the history is
+        within its budgets. The last undo state is always kept.
+        """
+        states = sorted((state for state in self._undo + self._redo
+            if state.chunks), key=lambda state: state.serial)
+        for state in states:
+            if self._memory_used <= self.memory_budget:
+                break
+            if self.disk_budget:
+                self._spill_state(state)
+        # forget states, oldest undo first, until everything fits.
+        while (self._memory_used > self.memory_budget or
+                self._spilled > self.disk_budget) and \
+                (len(self._undo) > 1 or self._redo):
+            if len(self._undo) > 1:
+                self._discard(self._undo.pop(0))
+            else:
+                self._discard(self._redo.pop(0))
+        # chunks which are no longer used leave holes in the file.
+        if self._spill_size > max(2 * self._spilled, 64 * CHUNK_SIZE):
+            self._compact()
+
+    def _spill_state(self, state):
+        """
+        Internal Function. Writes the chunks of a state which are still in
+        memory to the temporary file.
+        """
+        if self._spill is None:
+            self._spill = tempfile.TemporaryFile(prefix="pimp-history-")
+        for digest in state.chunks:
+            entry = self._chunks[digest]
+            if isinstance(entry[1], tuple):
+                continue
+            if self._spilled + len(entry[1]) > self.disk_budget:
+                return
+            self._spill.seek(self._spill_size)
+            self._spill.write(entry[1])
+            self._memory_used -= len(entry[1])
+            self._spilled += len(entry[1])
+            entry[1] = (self._spill_size, len(entry[1]))
+            self._spill_size += entry[1][1]
+
+    def _compact(self):
+        """
+        Internal Function. Copies the chunks still in use to a new temporary
+        file, dropping the space left by chunks which were released.
+        """
+        spill = tempfile.TemporaryFile(prefix="pimp-history-")
+        size = 0
+        for entry in self._chunks.values():
+            if isinstance(entry[1], tuple):
+                self._spill.seek(entry[1][0])
+                spill.write(self._spill.read(entry[1][1]))
+                entry[1] = (size, entry[1][1])
+                size += entry[1][1]
+        self._spill.close()
+        self._spill = spill
+        self._spill_size = size
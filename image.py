@@ -19,16 +19,50 @@ along with The Python Image Manipulation Project.  If not, see
 <http://www.gnu.org/licenses/>.
 """
 
-
-from extensions.lib.core import string_copy
+import os
+import tempfile
+from itertools import count
+from mmap import mmap, ACCESS_COPY, ACCESS_WRITE
 
 VERSION = "0.1"
 
+# the number of bytes copied at once into a MappedImage, so copying doesn't
+# need a second copy of a large image in memory.
+COPY_SIZE = 64 << 20
+
+# generation numbers are shared by all images, so no two versions of any
+# images have the same one.
+_generations = count(1)
+
+
+def _writable(data):
+    """
+    Internal Function. Gets a mutable buffer for image data. Data which is
+    already writable (a bytearray, a writable memoryview, mmap...) is used as
+    it is, read-only data such as bytes is copied into a bytearray. Buffers
+    with more than one dimension (e.g. a NumPy array) are used through a flat
+    memoryview of their bytes.
+
+    :Parameters:
+        data : buffer
+            The image data.
+
+    :rtype: buffer
+    :returns: The data as a writable, one dimensional buffer of bytes.
+    """
+    view = memoryview(data)
+    if view.readonly or not view.c_contiguous:
+        return bytearray(view.tobytes())
+    if view.ndim != 1:
+        return view.cast('B')
+    return data
+
+
 class Image:
     """
     A class for storing image data.
     """
-    def __init__(self, width, height, data=''):
+    def __init__(self, width, height, data=None):
         """
         Creates an Image object.
 
@@ -37,22 +71,68 @@ class Image:
                 The width of the image
             height : int
                 The height of the image in pixels
-            data : string
-                The optional data for this image formatted as a string
-                containing binary data
+            data : buffer
+                The optional data for this image as bytes, a bytearray or any
+                other object supporting the buffer protocol. Read-only data is
+                copied into a bytearray, writable buffers are used directly.
         """
         self._width = width
         self._height = height
-        self._data = data
-        if data:
-            self._channels = len(data) // (width * height)
+        self._generation = next(_generations)
+        # arrays have no truth value, so only the size of data is tested.
+        if data is not None and memoryview(data).nbytes:
+            self._data = _writable(data)
+            nbytes = memoryview(self._data).nbytes
+            self._channels = nbytes // (width * height)
             if self._channels not in (3, 4):
                 raise ValueError("Data contained an invalid number of "
                     f"channels, 3 or 4 expected, {self._channels} recieved "
-                    f"(width: {width}, height: {height}, bytes: {len(data)})")
+                    f"(width: {width}, height: {height}, bytes: {nbytes})")
         else:
             self._channels = 3
-            data = '\x00' * (width * height * 3) # create a pure black image.
+            # create a pure black image.
+            self._data = bytearray(width * height * 3)
+
+    @classmethod
+    def from_array(cls, array):
+        """
+        Creates an Image from an array of pixels, such as a NumPy array. The
+        image uses the array's memory if it is writable and C contiguous,
+        otherwise the pixels are copied.
+
+        :Parameters:
+            array : buffer
+                A (height, width, channels) array of unsigned bytes, with 3
+                (RGB) or 4 (RGBA) channels.
+
+        :rtype: Image
+        :returns: A new Image.
+        """
+        view = memoryview(array)
+        if view.ndim != 3 or view.format.lstrip("@=<>!") not in ("B", "c"):
+            raise ValueError("A (height, width, channels) array of unsigned "
+                f"bytes is needed, not {view.ndim} dimensions of "
+                f"'{view.format}'")
+        height, width, channels = view.shape
+        if channels not in (3, 4):
+            raise ValueError("Arrays need 3 (RGB) or 4 (RGBA) channels, not "
+                f"{channels}")
+        return cls(width, height, array)
+
+    def as_array(self):
+        """
+        Get the pixels as a NumPy array, without copying them. NumPy is only
+        needed by this method.
+
+        :rtype: numpy.ndarray
+        :returns: A (height, width, channels) array of uint8 sharing its
+            memory with this image. Call touch after changing it.
+        """
+        # imported here so the rest of this module works without numpy.
+        import numpy
+
+        return numpy.frombuffer(self._data, dtype=numpy.uint8).reshape(
+                self._height, self._width, self._channels)
 
     def copy(self):
         """
@@ -62,7 +142,7 @@ class Image:
         :returns: a copy of this image.
         """
         return Image(self.get_width(), self.get_height(),
-                string_copy(self.get_data()))
+                bytearray(self.get_data()))
 
     def has_alpha(self):
         """
@@ -89,8 +169,9 @@ class Image:
         """
         Get the binary data for this image.
 
-        :rtype: str
-        :returns: All channel data for this image as a string.
+        :rtype: bytearray
+        :returns: All channel data for this image. This is the image's own
+            buffer, not a copy.
         """
         return self._data
 
@@ -121,6 +202,25 @@ class Image:
         """
         return self._data[ ::self._channels]
 
+    def get_generation(self):
+        """
+        Get the generation of this image's pixels. It changes whenever the
+        data is replaced with set_data or marked as changed with touch, so
+        anything derived from the pixels (such as the bitmaps on screen) can
+        be kept until it does.
+
+        :rtype: int
+        :returns: A number which no other version of any image has.
+        """
+        return self._generation
+
+    def touch(self):
+        """
+        Marks the data as changed. This must be called after modifying the
+        buffer returned by get_data in place.
+        """
+        self._generation = next(_generations)
+
     def get_height(self):
         """
         Get the height of the image.
@@ -155,10 +255,177 @@ class Image:
         :rtype: bool
         :returns: True if the operation succeeded.
         """
-        if not len(data) // (width * height) in (3, 4):
+        channels = memoryview(data).nbytes // (width * height)
+        if not channels in (3, 4):
             raise ValueError("The data buffer for this image is the incorrect "
-                "length. Must be either width * height or width * height * 3")
+                "length. Must be either width * height * 3 or "
+                "width * height * 4")
         self._width = width
         self._height = height
-        self._data = data
+        self._channels = channels
+        self._data = _writable(data)
+        self._generation = next(_generations)
         return True
+
+
+def _copy_into(mapping, data):
+    """
+    Internal Function. Copies image data into a memory map, a band at a time.
+
+    :Parameters:
+        mapping : mmap
+            The memory map, which must be the size of the data.
+        data : buffer
+            The image data.
+    """
+    view = memoryview(data)
+    if not view.c_contiguous:
+        view = memoryview(view.tobytes())
+    view = view.cast('B')
+    for offset in range(0, view.nbytes, COPY_SIZE):
+        mapping[offset:offset + COPY_SIZE] = view[offset:offset + COPY_SIZE]
+
+
+class MappedImage(Image):
+    """
+    An Image whose pixels are kept in a memory mapped file instead of memory,
+    so images larger than the memory available can be opened and filtered.
+    The operating system keeps the parts of the file in use in its page
+    cache and writes the rest out. get_data returns the mmap itself, which
+    the C kernels use through the buffer protocol like any other buffer.
+
+    The file is a temporary file which is removed when the image is closed or
+    garbage collected, or a raw file of pixels opened with open_raw.
+    """
+    def __init__(self, width, height, data=None, channels=3,
+            directory=None):
+        """
+        Creates a MappedImage in a new temporary file.
+
+        :Parameters:
+            width : int
+                The width of the image
+            height : int
+                The height of the image in pixels
+            data : buffer
+                The optional data for this image, which is copied into the
+                file. Without it the image is black.
+            channels : int
+                The number of channels of a black image, 3 (RGB) or 4
+                (RGBA). Ignored if data is given. Defaults to 3.
+            directory : string
+                The directory to create the file in. Defaults to the system's
+                temporary directory.
+        """
+        self._directory = directory
+        size = memoryview(data).nbytes if data is not None else 0
+        if size:
+            mapping = self._create(size)
+            _copy_into(mapping, data)
+        else:
+            mapping = self._create(width * height * channels)
+        try:
+            Image.__init__(self, width, height, mapping)
+        except ValueError:
+            mapping.close()
+            raise
+
+    @classmethod
+    def open_raw(cls, filename, width, height, writable=False):
+        """
+        Maps a file holding nothing but the pixels of an image, in the layout
+        get_data uses: red, green, blue (and alpha) for each pixel, row by
+        row. Nothing is read until it is used.
+
+        :Parameters:
+            filename : string
+                The name of the file.
+            width : int
+                The width of the image in pixels.
+            height : int
+                The height of the image in pixels.
+            writable : bool
+                Whether changes to the image are written to the file. If
+                not, the pages changed are copied into memory instead.
+                Defaults to False.
+
+        :rtype: MappedImage
+        :returns: A new MappedImage.
+        """
+        image = cls.__new__(cls)
+        image._directory = None
+        with open(filename, 'r+b' if writable else 'rb') as raw_file:
+            size = os.fstat(raw_file.fileno()).st_size
+            if size not in (width * height * 3, width * height * 4):
+                raise ValueError(f"'{filename}' holds {size} bytes, not the "
+                    f"{width * height * 3} or {width * height * 4} of a "
+                    f"{width}x{height} image")
+            mapping = mmap(raw_file.fileno(), size,
+                access=ACCESS_WRITE if writable else ACCESS_COPY)
+        Image.__init__(image, width, height, mapping)
+        return image
+
+    def _create(self, size):
+        """
+        Internal Function. Maps a new temporary file.
+
+        :Parameters:
+            size : int
+                The size of the file in bytes.
+
+        :rtype: mmap
+        :returns: The memory map of the file, filled with zeros.
+        """
+        # the file is removed as soon as it's closed, the map keeps it alive.
+        with tempfile.TemporaryFile(dir=self._directory) as temp_file:
+            temp_file.truncate(size)
+            return mmap(temp_file.fileno(), size)
+
+    def copy(self):
+        """
+        Returns a copy of this image, in a new temporary file.
+
+        :rtype: MappedImage
+        :returns: a copy of this image.
+        """
+        return MappedImage(self.get_width(), self.get_height(),
+                self.get_data(), directory=self._directory)
+
+    def set_data(self, width, height, data):
+        """
+        Set the data for this image. Data other than the image's own mmap is
+        copied into a new temporary file.
+
+        :rtype: bool
+        :returns: True if the operation succeeded.
+        """
+        if data is self._data:
+            return Image.set_data(self, width, height, data)
+        if memoryview(data).nbytes not in (width * height * 3,
+                width * height * 4):
+            raise ValueError("The data buffer for this image is the incorrect "
+                "length. Must be either width * height * 3 or "
+                "width * height * 4")
+        mapping = self._create(memoryview(data).nbytes)
+        _copy_into(mapping, data)
+        self.close()
+        return Image.set_data(self, width, height, mapping)
+
+    def close(self):
+        """
+        Unmaps the file, removing it if it is a temporary file. The image
+        can't be used afterwards. If views of the data (such as arrays
+        returned by as_array) still exist, the file is unmapped once they are
+        gone instead.
+        """
+        try:
+            self._data.close()
+        except BufferError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
@@ -23,6 +23,13 @@ along with The Python Image Manipulation Project.  If not, see
 #library imports
 import sys
 import os
+
+# "pimp.py batch ..." runs without the GUI, so it has to be handled before wx
+# is imported.
+if __name__ == "__main__" and sys.argv[1:2] == ["batch"]:
+    import batch
+    sys.exit(batch.main(sys.argv[2:]))
+
 import wx
 import wx.adv
 
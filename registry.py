@@ -0,0 +1,271 @@
+"""
+registry.py
+Copyright 2007 Thomas McGrew
+
+This file is part of The Python Image Manipulation Project.
+
+The Python Image Manipulation Project is free software: you can
+redistribute it and/or modify it under the terms of the GNU General
+Public License as published by the Free Software Foundation, either
+version 2 of the License, or (at your option) any later version.
+
+The Python Image Manipulation Project is distributed in the hope
+that it will be useful, but WITHOUT ANY WARRANTY; without even the
+implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with The Python Image Manipulation Project.  If not, see
+<http://www.gnu.org/licenses/>.
+
+Finds extensions without importing them. The MENU, LABEL, DESCRIPTION,
+FILE_EXTENSION and FILE_MARKER constants of each extension are read from its
+source with the ast module (C extensions have to be imported once), and kept
+in a cache file keyed by the modification time of the extension, so on most
+starts no extension is imported or even parsed. Each extension is represented
+by a LazyModule, which imports the real module the first time anything other
+than those constants is used.
+"""
+
+# library imports
+import os
+import json
+from glob import glob
+from importlib import import_module, reload as reload_module
+import sys
+
+# the constants describing an extension
+METADATA = ("MENU", "LABEL", "DESCRIPTION", "FILE_EXTENSION", "FILE_MARKER")
+
+# the directory holding the extensions package
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# C extensions
+if sys.platform == "win32":
+    C_EXTENSIONS = ".pyd"
+else:
+    C_EXTENSIONS = ".so"
+
+# the file the constants are cached in
+CACHE_FILE = os.path.join(os.environ.get("XDG_CACHE_HOME") or
+        os.path.join(os.path.expanduser("~"), ".cache"), "pimp",
+        "extensions.json")
+
+
+class LazyModule:
+    """
+    Stands in for an extension module until it is needed. The constants in
+    METADATA are available without importing the module. Any other attribute
+    (such as execute, read or write) imports it.
+    """
+    def __init__(self, name, metadata):
+        """
+        Creates a LazyModule.
+
+        :Parameters:
+            name : string
+                The full name of the module, e.g. "extensions.menu.invert".
+            metadata : dict
+                The values of the constants in METADATA the module defines.
+        """
+        self.__name__ = name
+        self._module = None
+        for key, value in metadata.items():
+            setattr(self, key, value)
+
+    def _load(self):
+        """
+        Internal Function. Imports the module if it hasn't been already.
+
+        :rtype: module
+        :returns: The module.
+        """
+        if self._module is None:
+            self._module = import_module(self.__name__)
+        return self._module
+
+    def __getattr__(self, name):
+        """
+        Gets an attribute of the module, importing it if needed.
+        """
+        if name in METADATA or name.startswith('__'):
+            # the metadata is complete, a missing constant isn't defined.
+            raise AttributeError(f"module '{self.__name__}' has no attribute "
+                f"'{name}'")
+        return getattr(self._load(), name)
+
+    def __repr__(self):
+        return f"<lazy module '{self.__name__}'>"
+
+
+def reload(module):
+    """
+    Reloads a module represented by a LazyModule, if it has been imported
+    (possibly through another LazyModule).
+
+    :Parameters:
+        module : LazyModule
+            The module to reload.
+    """
+    if module.__name__ in sys.modules:
+        module._module = reload_module(sys.modules[module.__name__])
+
+
+def _encode(value):
+    """
+    Internal Function. Converts a value so it can be stored as JSON.
+    """
+    if isinstance(value, bytes):
+        return {"bytes": value.hex()}
+    if isinstance(value, tuple):
+        return list(value)
+    return value
+
+
+def _decode(value):
+    """
+    Internal Function. Reverses _encode.
+    """
+    if isinstance(value, dict):
+        return bytes.fromhex(value["bytes"])
+    if isinstance(value, list):
+        return tuple(value)
+    return value
+
+
+def _parse(filename):
+    """
+    Internal Function. Reads the constants in METADATA from the source of an
+    extension.
+
+    :Parameters:
+        filename : string
+            The path of the python source file.
+
+    :rtype: dict
+    :returns: The constants the file assigns, or None if one of them isn't a
+        literal value and the module has to be imported to find it.
+    """
+    # only needed when the cache is out of date, so not imported up front.
+    import ast
+
+    with open(filename, 'rb') as source:
+        tree = ast.parse(source.read(), filename)
+    metadata = dict()
+    for node in tree.body:
+        if isinstance(node, ast.Assign):
+            targets = node.targets
+        elif isinstance(node, ast.AnnAssign) and node.value:
+            targets = [node.target]
+        else:
+            continue
+        for target in targets:
+            if isinstance(target, ast.Name) and target.id in METADATA:
+                try:
+                    metadata[target.id] = ast.literal_eval(node.value)
+                except ValueError:
+                    return None
+    return metadata
+
+
+def _inspect(name):
+    """
+    Internal Function. Imports an extension to read its constants.
+
+    :Parameters:
+        name : string
+            The full name of the module.
+
+    :rtype: dict
+    :returns: The constants in METADATA the module defines.
+    """
+    module = import_module(name)
+    return {key: getattr(module, key) for key in METADATA
+        if hasattr(module, key)}
+
+
+def _read_cache():
+    """
+    Internal Function. Reads the cache file.
+
+    :rtype: dict
+    :returns: The cached entries, keyed by directory then file name.
+    """
+    try:
+        with open(CACHE_FILE) as cache:
+            entries = json.load(cache)
+        if isinstance(entries, dict):
+            return entries
+    except (OSError, ValueError):
+        pass
+    return dict()
+
+
+def _write_cache(entries):
+    """
+    Internal Function. Writes the cache file. Failures are ignored, the cache
+    only saves time.
+
+    :Parameters:
+        entries : dict
+            The entries to store, keyed by directory then file name.
+    """
+    try:
+        os.makedirs(os.path.dirname(CACHE_FILE), exist_ok=True)
+        temporary = f"{CACHE_FILE}.{os.getpid()}"
+        with open(temporary, 'w') as cache:
+            json.dump(entries, cache)
+        os.replace(temporary, CACHE_FILE)
+    except OSError:
+        pass
+
+
+def load(package):
+    """
+    Finds the extensions in a package.
+
+    :Parameters:
+        package : tuple
+            The package path, e.g. ("extensions", "menu").
+
+    :rtype: list
+    :returns: A LazyModule for each extension which defines at least one of
+        the constants in METADATA, in order of module name.
+    """
+    directory = os.path.join(BASE_DIR, *package)
+    files = sorted(glob(f'{directory}{os.sep}*.py') +
+            glob(f'{directory}{os.sep}*{C_EXTENSIONS}'))
+
+    cache = _read_cache()
+    cached = cache.get(directory, dict())
+    entries = dict()
+    modules = dict()
+    for f in files:
+        module_file = os.path.basename(f)
+        name = '.'.join((*package, module_file[:module_file.index(".")]))
+        if name in modules or module_file == "__init__.py":
+            continue
+        status = os.stat(f)
+        key = [status.st_mtime_ns, status.st_size]
+        entry = cached.get(module_file)
+        if entry and entry["key"] == key:
+            metadata = {k: _decode(v) for k, v in entry["metadata"].items()}
+        else:
+            try:
+                metadata = None
+                if f.endswith(".py"):
+                    metadata = _parse(f)
+                if metadata is None:
+                    metadata = _inspect(name)
+            except (ImportError, SyntaxError, OSError):
+                # not cached, it may load once whatever it needs is installed.
+                continue
+        entries[module_file] = {"key": key, "metadata":
+            {k: _encode(v) for k, v in metadata.items()}}
+        if metadata:
+            modules[name] = LazyModule(name, metadata)
+
+    if entries != cached:
+        cache[directory] = entries
+        _write_cache(cache)
+    return list(modules.values())
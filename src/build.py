@@ -21,7 +21,7 @@ along with The Python Image Manipulation Project.  If not, see
 
 from distutils.core import setup, Extension
 import os
-from sys import argv
+from sys import argv, platform
 from glob import glob
 
 # change to the directory this setup file is in
@@ -32,6 +32,8 @@ if not ( 'build' in argv ):
 
 
 INCLUDE = [ ]
+# the kernels split their work between posix threads everywhere but windows
+LIBRARIES = [ ] if platform == 'win32' else [ 'pthread', 'm' ]
 
 compiled_plugins =  [
                         'histogram_eq',
@@ -44,6 +46,10 @@ compiled_libs    =  [
                         'color',
                         'nintendize',
                         'median_filter',
+                        'resample',
+                        'canny',
+                        'png_filter',
+                        'jpeg',
                     ]
 
 all_modules = compiled_plugins + compiled_libs
@@ -51,7 +57,8 @@ all_modules = compiled_plugins + compiled_libs
 
 modules = [ ]
 for m in all_modules:
-    modules.append( Extension( m, include_dirs = INCLUDE, sources = [ m+'.c' ] ) )
+    modules.append( Extension( m, include_dirs = INCLUDE, libraries = LIBRARIES,
+        sources = [ m+'.c' ], depends = [ 'core.h' ] ) )
 setup( name = m, version = '0.2', ext_modules = modules )
 
 print()
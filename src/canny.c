@@ -0,0 +1,429 @@
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <stdlib.h>
+#include <math.h>
+#include "core.h"
+
+const static char __doc__[] =
+"canny.c\n"
+"Copyright 2007 Thomas McGrew\n"
+"\n"
+"This file is part of The Python Image Manipulation Project.\n"
+"\n"
+"The Python Image Manipulation Project is free software: you can\n"
+"redistribute it and/or modify it under the terms of the GNU General\n"
+"Public License as published by the Free Software Foundation, either\n"
+"version 2 of the License, or (at your option) any later version.\n"
+"\n"
+"The Python Image Manipulation Project is distributed in the hope\n"
+"that it will be useful, but WITHOUT ANY WARRANTY; without even the\n"
+"implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR\n"
+"PURPOSE. See the GNU General Public License for more details.\n"
+"\n"
+"You should have received a copy of the GNU General Public License\n"
+"along with The Python Image Manipulation Project.  If not, see\n"
+"<http://www.gnu.org/licenses/>.\n";
+
+// the classes of pixel found by non-maximum suppression
+#define NOT_EDGE 0
+#define WEAK_EDGE 1
+#define STRONG_EDGE 2
+
+// the directions of the gradient, rounded to the nearest 45 degrees
+#define ACROSS 0
+#define DOWN 1
+#define DOWN_RIGHT 2
+#define DOWN_LEFT 3
+
+// tan(22.5 degrees) * 1024, the boundary between the directions
+#define TAN_22_5 424
+
+// the Sobel operator finds 8 times the change in brightness per pixel
+#define SOBEL_GAIN 8
+
+const static char canny__doc__[] =
+"Finds the edges in an image with the Canny edge detector. The brightness of "
+    "the image is smoothed with a 5x5 gaussian filter, the gradient is found "
+    "with the Sobel operator and thinned to the ridges along the edges, and "
+    "the ridges which are strong, or connected to strong ones, are kept.\n"
+"\n"
+":Parameters:\n"
+"    width : int\n"
+"        The width of the image in pixels\n"
+"    height : int\n"
+"        The height of the image in pixels\n"
+"    data : buffer\n"
+"        The image data as bytes, a bytearray or any other buffer.\n"
+"    low : float\n"
+"        The weakest gradient which can be part of an edge, in levels of "
+        "brightness per pixel. Defaults to 4.\n"
+"    high : float\n"
+"        The weakest gradient which starts an edge. Defaults to 12.\n"
+"    out : buffer\n"
+"        An optional writable buffer the same size as data to write the result "
+        "into. This may be data itself.\n"
+"\n"
+":rtype: tuple\n"
+":returns: A tuple (width, height, data). Edges are white and everything else "
+    "is black, the alpha channel is kept. data is out if it was passed in, "
+    "otherwise a new bytearray.\n";
+
+typedef struct {
+    unsigned char *data, *newData;
+    int width, height, channels;
+    unsigned char *grey;     // the brightness, then the edge classes
+    unsigned short *sums;    // the horizontal blur, then the gradient
+    unsigned char *direction;
+    int low, high;           // the thresholds, in Sobel units
+} canny_args;
+
+/**
+ * Finds the brightness of a band of rows.
+ */
+int grey_band(void *pArgs, int start, int end)
+{
+    canny_args *args = pArgs;
+    int channels = args->channels;
+    unsigned char *pixel, *grey, *last;
+
+    grey = args->grey + (Py_ssize_t)start * args->width;
+    last = args->grey + (Py_ssize_t)end * args->width;
+    pixel = args->data + (Py_ssize_t)start * args->width * channels;
+    for (; grey < last; grey++, pixel += channels)
+        *grey = (77 * pixel[0] + 150 * pixel[1] + 29 * pixel[2]) >> 8;
+    return 0;
+}
+
+/**
+ * Blurs a band of rows across with the weights 1 4 6 4 1.
+ */
+int blur_across_band(void *pArgs, int start, int end)
+{
+    canny_args *args = pArgs;
+    int width = args->width;
+    int i, j, i1, i2, i3, i4;
+    unsigned char *row;
+    unsigned short *sums;
+
+    for (j=start; j < end; j++)
+    {
+        row = args->grey + (Py_ssize_t)j * width;
+        sums = args->sums + (Py_ssize_t)j * width;
+        for (i=0; i < width; i++)
+        {
+            // the edge pixels are repeated past the edge
+            i1 = max(i - 2, 0);
+            i2 = max(i - 1, 0);
+            i3 = min(i + 1, width - 1);
+            i4 = min(i + 2, width - 1);
+            sums[i] = row[i1] + 4 * row[i2] + 6 * row[i] + 4 * row[i3] +
+                row[i4];
+        }
+    }
+    return 0;
+}
+
+/**
+ * Blurs a band of rows down with the weights 1 4 6 4 1, replacing the
+ * brightness with the blurred brightness.
+ */
+int blur_down_band(void *pArgs, int start, int end)
+{
+    canny_args *args = pArgs;
+    int width = args->width, height = args->height;
+    int i, j;
+    unsigned short *r0, *r1, *r2, *r3, *r4;
+    unsigned char *grey;
+
+    for (j=start; j < end; j++)
+    {
+        r0 = args->sums + (Py_ssize_t)max(j - 2, 0) * width;
+        r1 = args->sums + (Py_ssize_t)max(j - 1, 0) * width;
+        r2 = args->sums + (Py_ssize_t)j * width;
+        r3 = args->sums + (Py_ssize_t)min(j + 1, height - 1) * width;
+        r4 = args->sums + (Py_ssize_t)min(j + 2, height - 1) * width;
+        grey = args->grey + (Py_ssize_t)j * width;
+        // the weights add up to 16 * 16
+        for (i=0; i < width; i++)
+            grey[i] = (r0[i] + 4 * r1[i] + 6 * r2[i] + 4 * r3[i] + r4[i] +
+                    128) >> 8;
+    }
+    return 0;
+}
+
+/**
+ * Finds the size and direction of the gradient of the blurred brightness for
+ * a band of rows, replacing the horizontal blur.
+ */
+int gradient_band(void *pArgs, int start, int end)
+{
+    canny_args *args = pArgs;
+    int width = args->width, height = args->height;
+    int i, j, l, r, gx, gy, ax, ay;
+    unsigned char *above, *row, *below, *direction;
+    unsigned short *magnitude;
+
+    for (j=start; j < end; j++)
+    {
+        above = args->grey + (Py_ssize_t)max(j - 1, 0) * width;
+        row = args->grey + (Py_ssize_t)j * width;
+        below = args->grey + (Py_ssize_t)min(j + 1, height - 1) * width;
+        magnitude = args->sums + (Py_ssize_t)j * width;
+        direction = args->direction + (Py_ssize_t)j * width;
+        for (i=0; i < width; i++)
+        {
+            l = max(i - 1, 0);
+            r = min(i + 1, width - 1);
+            gx = (above[r] + 2 * row[r] + below[r]) -
+                (above[l] + 2 * row[l] + below[l]);
+            gy = (below[l] + 2 * below[i] + below[r]) -
+                (above[l] + 2 * above[i] + above[r]);
+            magnitude[i] = (unsigned short)(sqrt(gx * gx + gy * gy) + 0.5);
+            ax = abs(gx);
+            ay = abs(gy);
+            if (ay * 1024 <= ax * TAN_22_5)
+                direction[i] = ACROSS;
+            else if (ax * 1024 <= ay * TAN_22_5)
+                direction[i] = DOWN;
+            else
+                direction[i] = (gx > 0) == (gy > 0) ? DOWN_RIGHT : DOWN_LEFT;
+        }
+    }
+    return 0;
+}
+
+/**
+ * Keeps the pixels of a band of rows whose gradient is larger than that of
+ * their neighbors in the direction of the gradient, and sorts them into weak
+ * and strong edges, replacing the blurred brightness. The pixels on the edge
+ * of the image are never edges.
+ */
+int suppress_band(void *pArgs, int start, int end)
+{
+    canny_args *args = pArgs;
+    int width = args->width, height = args->height;
+    int i, j, m, before, after;
+    Py_ssize_t offset = 0;
+    unsigned short *magnitude;
+    unsigned char *classes, *direction;
+
+    for (j=start; j < end; j++)
+    {
+        magnitude = args->sums + (Py_ssize_t)j * width;
+        direction = args->direction + (Py_ssize_t)j * width;
+        classes = args->grey + (Py_ssize_t)j * width;
+        for (i=0; i < width; i++)
+        {
+            classes[i] = NOT_EDGE;
+            m = magnitude[i];
+            if (m < args->low || i == 0 || j == 0 || i == width - 1 ||
+                    j == height - 1)
+                continue;
+            switch (direction[i])
+            {
+                case ACROSS:     offset = 1;         break;
+                case DOWN:       offset = width;     break;
+                case DOWN_RIGHT: offset = width + 1; break;
+                case DOWN_LEFT:  offset = width - 1; break;
+            }
+            before = magnitude[i - offset];
+            after = magnitude[i + offset];
+            // a ridge two pixels wide keeps its first pixel
+            if (m > before && m >= after)
+                classes[i] = m >= args->high ? STRONG_EDGE : WEAK_EDGE;
+        }
+    }
+    return 0;
+}
+
+/**
+ * Turns the weak edges connected to strong edges into strong edges. This
+ * follows the edges across the whole image, so it isn't split into bands.
+ *
+ * returntype: int
+ * returns: 0 on success, non-zero if memory could not be allocated.
+ */
+static int follow_edges(canny_args *args)
+{
+    unsigned char *classes = args->grey;
+    int width = args->width;
+    Py_ssize_t pixels = (Py_ssize_t)width * args->height;
+    Py_ssize_t i, p, n, size = 4096, count = 0;
+    Py_ssize_t *stack, *bigger;
+    int k;
+    const Py_ssize_t neighbors[8] = {-width - 1, -width, -width + 1, -1, 1,
+        width - 1, width, width + 1};
+
+    if (!(stack = malloc(sizeof(Py_ssize_t) * size)))
+        return 1;
+    for (i=0; i < pixels; i++)
+    {
+        if (classes[i] != STRONG_EDGE)
+            continue;
+        stack[count++] = i;
+        while (count)
+        {
+            p = stack[--count];
+            // edges are never on the border, so the neighbors all exist.
+            for (k=0; k < 8; k++)
+            {
+                n = p + neighbors[k];
+                if (classes[n] != WEAK_EDGE)
+                    continue;
+                classes[n] = STRONG_EDGE;
+                if (count == size)
+                {
+                    if (!(bigger = realloc(stack, sizeof(Py_ssize_t) *
+                                    size * 2)))
+                    {
+                        free(stack);
+                        return 1;
+                    }
+                    stack = bigger;
+                    size *= 2;
+                }
+                stack[count++] = n;
+            }
+        }
+    }
+    free(stack);
+    return 0;
+}
+
+/**
+ * Writes the edges of a band of rows to the output, keeping the alpha
+ * channel.
+ */
+int output_band(void *pArgs, int start, int end)
+{
+    canny_args *args = pArgs;
+    int channels = args->channels;
+    unsigned char *classes, *last, *pixel, *newPixel, value;
+
+    classes = args->grey + (Py_ssize_t)start * args->width;
+    last = args->grey + (Py_ssize_t)end * args->width;
+    pixel = args->data + (Py_ssize_t)start * args->width * channels;
+    newPixel = args->newData + (Py_ssize_t)start * args->width * channels;
+    for (; classes < last; classes++, pixel += channels, newPixel += channels)
+    {
+        value = *classes == STRONG_EDGE ? 255 : 0;
+        newPixel[0] = newPixel[1] = newPixel[2] = value;
+        if (channels == 4)
+            newPixel[3] = pixel[3];
+    }
+    return 0;
+}
+
+PyObject *canny(PyObject *pself, PyObject *pArgs, PyObject *kwArgs)
+{
+    static char *keywords[] = {"width", "height", "data", "low", "high", "out",
+        NULL};
+    Py_buffer buffer, outBuffer;
+    PyObject *out = NULL, *result;
+    unsigned int width, height;
+    Py_ssize_t dataLen, pixels;
+    unsigned char channels;
+    double low = 4.0, high = 12.0;
+    canny_args args;
+    int status = 0, rowSize;
+
+    // convert the passed in python arguments to C types.
+    if (!PyArg_ParseTupleAndKeywords(pArgs, kwArgs, "iiO&|ddO", keywords,
+                &width, &height, image_data, &buffer, &low, &high, &out))
+        return NULL;
+
+    dataLen = buffer.len;
+    channels = dataLen / (width * height);
+    if ((channels < 3) || (channels > 4))
+    {
+         PyErr_Format(PyExc_ValueError, "Data contained an invalid number of "
+                 "channels, 3 or 4 expected, %d recieved (width: %d, "
+                 "height: %d, bytes: %d)", channels, width, height, dataLen);
+         PyBuffer_Release(&buffer);
+         return NULL;
+    }
+
+    if (!(result = get_output(out, dataLen, &outBuffer)))
+    {
+        PyBuffer_Release(&buffer);
+        return NULL;
+    }
+
+    pixels = (Py_ssize_t)width * height;
+    args.data = buffer.buf;
+    args.newData = outBuffer.buf;
+    args.width = width;
+    args.height = height;
+    args.channels = channels;
+    // a weak edge must be at least 1 (no gradient at all is never an edge).
+    args.low = max((int)ceil(low * SOBEL_GAIN), 1);
+    args.high = max((int)ceil(high * SOBEL_GAIN), args.low);
+    args.grey = malloc(pixels);
+    args.sums = malloc(pixels * sizeof(unsigned short));
+    args.direction = malloc(pixels);
+    rowSize = width * channels;
+
+    Py_BEGIN_ALLOW_THREADS
+    if (!args.grey || !args.sums || !args.direction)
+        status = 1;
+    // the whole of each step is finished before the next one starts, as each
+    // row needs the rows around it from the step before.
+    if (!status)
+        status = run_bands(grey_band, &args, height, rowSize);
+    if (!status)
+        status = run_bands(blur_across_band, &args, height, rowSize);
+    if (!status)
+        status = run_bands(blur_down_band, &args, height, rowSize);
+    if (!status)
+        status = run_bands(gradient_band, &args, height, rowSize);
+    if (!status)
+        status = run_bands(suppress_band, &args, height, rowSize);
+    if (!status)
+        status = follow_edges(&args);
+    // data isn't read again after this, so out may be data.
+    if (!status)
+        status = run_bands(output_band, &args, height, rowSize);
+    Py_END_ALLOW_THREADS
+
+    free(args.grey);
+    free(args.sums);
+    free(args.direction);
+    PyBuffer_Release(&buffer);
+    PyBuffer_Release(&outBuffer);
+
+    if (status)
+    {
+        Py_DECREF(result);
+        return band_error(status,
+                "Memory could not be allocated to find the edges");
+    }
+
+    // Build a python tuple and return it.
+    return Py_BuildValue("(iiN)", width, height, result);
+}
+
+static PyMethodDef canny_methods[] =
+{
+    {"execute", (PyCFunction)canny, METH_VARARGS | METH_KEYWORDS,
+        canny__doc__},
+    {NULL, NULL} // End of functions
+};
+
+static struct PyModuleDef canny_module = {
+    PyModuleDef_HEAD_INIT,
+    "canny",
+    __doc__,
+    -1,
+    canny_methods
+};
+
+PyMODINIT_FUNC PyInit_canny(void)
+{
+    PyObject *m = PyModule_Create(&canny_module);
+    if (!m || import_progress())
+    {
+        Py_XDECREF(m);
+        return NULL;
+    }
+    return m;
+}
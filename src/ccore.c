@@ -29,39 +29,29 @@ const static char __doc__[] =
 #include "core.h"
 
 const static char string_copy__doc__[] =
-"Makes a real copy of a string. This can only be accomplished through tricks "
-    "in pure python.\n"
+"Makes a real copy of a buffer as bytes. The kernels never change their input "
+    "unless it is also passed as their out buffer, so this is no longer needed "
+    "to protect data from them.\n"
 "\n"
 ":Parameters:\n"
-"    indata : string\n"
-"        The string to be copied.\n"
+"    indata : buffer\n"
+"        The data to be copied.\n"
 "\n"
-":rtype: string\n"
-":returns: A real copy of the string so the original data cannot be changed by "
-    "C extensions.\n";
+":rtype: bytes\n"
+":returns: A copy of the data.\n";
 
 PyObject *string_copy(PyObject *pself, PyObject *pArgs)
 {
-    char *data, *outData;
-    Py_ssize_t dataLen;
+    Py_buffer buffer;
+    PyObject *result;
     
     // convert the passed in python arguments to C types.
-    if (!PyArg_ParseTuple(pArgs, "y#", &data, &dataLen))
+    if (!PyArg_ParseTuple(pArgs, "y*", &buffer))
         return NULL;
 
-    if(!(outData = malloc(dataLen)))
-    {
-         PyErr_SetString(PyExc_MemoryError,
-                 "Memory could not be allocated to copy the string");
-         return NULL;
-    }
-
-    memcpy(outData, data, dataLen);
-
-    // Build a python string and return it.
-    return Py_BuildValue("y#",outData, dataLen);
-
-
+    result = PyBytes_FromStringAndSize(buffer.buf, buffer.len);
+    PyBuffer_Release(&buffer);
+    return result;
 }
 
 //doc string
@@ -77,27 +67,65 @@ const static char swap_channels__doc__[] =
 "        The width of the image in pixels\n"
 "    height : int\n"
 "        The height of the image in pixels\n"
-"    data : string\n"
-"        The data as a binary string.\n"
+"    data : buffer\n"
+"        The image data as bytes, a bytearray or any other buffer.\n"
 "    channel1 : int\n"
 "        The first of the 2 channels to swap\n"
 "    channel2 : int\n"
 "        The second of the 2 channels to swap\n"
+"    out : buffer\n"
+"        An optional writable buffer the same size as data to write the result "
+        "into. This may be data itself.\n"
 "\n"
-":rtype: string\n"
-":returns: The new data as a string.\n";
+":rtype: tuple\n"
+":returns: A tuple (width, height, data). data is out if it was passed in, "
+    "otherwise a new bytearray.\n";
+
+typedef struct {
+    unsigned char *data, *newData;
+    int width, channels, channel1, channel2;
+} swap_channels_args;
 
-PyObject *swap_channels(PyObject *pself, PyObject *pArgs)
+int swap_channels_band(void *pArgs, int start, int end)
 {
-    int width, height, channel1, channel2, channels, i;
-    char *data, tmp;
+    swap_channels_args *args = pArgs;
+    unsigned char *data, *newData, value1, value2;
+    Py_ssize_t i, last;
+
+    data = args->data;
+    newData = args->newData;
+    last = (Py_ssize_t)end * args->width * args->channels;
+    for (i = (Py_ssize_t)start * args->width * args->channels; i < last;
+            i += args->channels)
+    {
+        value1 = data[i+args->channel1];
+        value2 = data[i+args->channel2];
+        if (newData != data)
+            memcpy(newData + i, data + i, args->channels);
+        newData[i+args->channel1] = value2;
+        newData[i+args->channel2] = value1;
+    }
+    return 0;
+}
+
+PyObject *swap_channels(PyObject *pself, PyObject *pArgs, PyObject *kwArgs)
+{
+    static char *keywords[] = {"width", "height", "data", "channel1",
+        "channel2", "out", NULL};
+    int width, height, channel1, channel2, channels;
+    Py_buffer buffer, outBuffer;
     Py_ssize_t dataLen;
+    PyObject *out = NULL, *result;
+    swap_channels_args args;
+    int status;
 
     // convert the passed in python arguments to C types.
-    if (!PyArg_ParseTuple(pArgs, "iiy#ii", &width, &height, &data, &dataLen,
-                &channel1, &channel2))
+    if (!PyArg_ParseTupleAndKeywords(pArgs, kwArgs, "iiO&ii|O", keywords,
+                &width, &height, image_data, &buffer,
+                &channel1, &channel2, &out))
         return NULL;
 
+    dataLen = buffer.len;
     channels = dataLen / (width * height);
     
     if ((channels < 3) || (channels > 4))
@@ -105,6 +133,7 @@ PyObject *swap_channels(PyObject *pself, PyObject *pArgs)
          PyErr_Format(PyExc_ValueError, "Data contained an invalid number of "
                  "channels, 3 or 4 expected, %d recieved (width: %d, "
                  "height: %d, bytes: %d)", channels, width, height, dataLen);
+         PyBuffer_Release(&buffer);
          return NULL;
     }
     
@@ -112,25 +141,45 @@ PyObject *swap_channels(PyObject *pself, PyObject *pArgs)
     {
          PyErr_SetString(PyExc_IndexError,
                  "Negative values for channel number are not valid");
+         PyBuffer_Release(&buffer);
          return NULL;
     }
 
-    if((channel1 > channels) || (channel2 > channels))
+    if((channel1 >= channels) || (channel2 >= channels))
     {
          PyErr_Format(PyExc_IndexError,
                  "This channel contains only %d channels", channels);
+         PyBuffer_Release(&buffer);
          return NULL;
     }
 
-    for (i=0; i < dataLen; i+=channels)
+    if (!(result = get_output(out, dataLen, &outBuffer)))
+    {
+        PyBuffer_Release(&buffer);
+        return NULL;
+    }
+
+    args.data = buffer.buf;
+    args.newData = outBuffer.buf;
+    args.width = width;
+    args.channels = channels;
+    args.channel1 = channel1;
+    args.channel2 = channel2;
+    Py_BEGIN_ALLOW_THREADS
+    status = run_bands(swap_channels_band, &args, height, width * channels);
+    Py_END_ALLOW_THREADS
+
+    PyBuffer_Release(&buffer);
+    PyBuffer_Release(&outBuffer);
+
+    if (status)
     {
-        tmp = data[i+channel1];
-        data[i+channel1] = data[i+channel2];
-        data[i+channel2] = tmp;
+        Py_DECREF(result);
+        return band_error(status, "Memory could not be allocated");
     }
 
     // Build a python tuple and return it.
-    return Py_BuildValue("(iiy#)", width, height, data, dataLen);
+    return Py_BuildValue("(iiN)", width, height, result);
 }
 
 
@@ -146,26 +195,63 @@ const static char table__doc__[] =
 "        The width of the image in pixels\n"
 "    height : int\n"
 "        The height of the image in pixels\n"
-"    data : string\n"
-"        The data as a binary string.\n"
+"    data : buffer\n"
+"        The image data as bytes, a bytearray or any other buffer.\n"
 "    sub_table : tuple\n"
 "        A tuple containg 256 integer values used for substitution.\n"
+"    out : buffer\n"
+"        An optional writable buffer the same size as data to write the result "
+        "into. This may be data itself.\n"
 "\n"
 ":rtype: tuple\n"
 ":returns: A tuple (width, height, data). Width and height are in pixels, "
-    "data is a string containing the binary data.\n";
+    "data is out if it was passed in, otherwise a new bytearray.\n";
+
+typedef struct {
+    unsigned char *data, *newData;
+    int width, channels;
+    unsigned int *sub_table;
+} table_args;
+
+int table_band(void *pArgs, int start, int end)
+{
+    table_args *args = pArgs;
+    unsigned char *data, *newData;
+    unsigned int *sub_table;
+    Py_ssize_t i, last;
+
+    data = args->data;
+    newData = args->newData;
+    sub_table = args->sub_table;
+    last = (Py_ssize_t)end * args->width * args->channels;
+    for (i = (Py_ssize_t)start * args->width * args->channels; i < last;
+            i += args->channels)
+    {
+            newData[i  ] = sub_table[data[i  ]];
+            newData[i+1] = sub_table[data[i+1]];
+            newData[i+2] = sub_table[data[i+2]];
+            if (args->channels == 4)
+                newData[i+3] = data[i+3];
+    }
+    return 0;
+}
 
-PyObject *table(PyObject *pself, PyObject *pArgs)
+PyObject *table(PyObject *pself, PyObject *pArgs, PyObject *kwArgs)
 {
-    unsigned char *data;
+    static char *keywords[] = {"width", "height", "data", "sub_table", "out",
+        NULL};
+    Py_buffer buffer, outBuffer;
     unsigned int width, height;
     Py_ssize_t dataLen;
     int channels;
+    PyObject *out = NULL, *result;
+    table_args args;
+    int status;
 
     unsigned int i, sub_table[256];
 
     // convert the passed in python arguments to C types.
-    if (!PyArg_ParseTuple(pArgs, "iiy#("
+    if (!PyArg_ParseTupleAndKeywords(pArgs, kwArgs, "iiO&("
             "iiiiiiiiiiiiiiiiiiiiiiiiiiiiiiii"
             "iiiiiiiiiiiiiiiiiiiiiiiiiiiiiiii"
             "iiiiiiiiiiiiiiiiiiiiiiiiiiiiiiii"
@@ -173,8 +259,8 @@ PyObject *table(PyObject *pself, PyObject *pArgs)
             "iiiiiiiiiiiiiiiiiiiiiiiiiiiiiiii"
             "iiiiiiiiiiiiiiiiiiiiiiiiiiiiiiii"
             "iiiiiiiiiiiiiiiiiiiiiiiiiiiiiiii"
-            "iiiiiiiiiiiiiiiiiiiiiiiiiiiiiiii)",
-            &width, &height, &data, &dataLen,
+            "iiiiiiiiiiiiiiiiiiiiiiiiiiiiiiii)|O", keywords,
+            &width, &height, image_data, &buffer,
             &sub_table[ 0], &sub_table[ 1], &sub_table[ 2], &sub_table[ 3],
             &sub_table[ 4], &sub_table[ 5], &sub_table[ 6], &sub_table[ 7],
             &sub_table[ 8], &sub_table[ 9], &sub_table[10], &sub_table[11],
@@ -238,15 +324,18 @@ PyObject *table(PyObject *pself, PyObject *pArgs)
             &sub_table[240], &sub_table[241], &sub_table[242], &sub_table[243],
             &sub_table[244], &sub_table[245], &sub_table[246], &sub_table[247],
             &sub_table[248], &sub_table[249], &sub_table[250], &sub_table[251],
-            &sub_table[252], &sub_table[253], &sub_table[254], &sub_table[255]))
+            &sub_table[252], &sub_table[253], &sub_table[254], &sub_table[255],
+            &out))
         return NULL;
 
+    dataLen = buffer.len;
     channels = dataLen / (width * height);
     if ((channels < 3) || (channels > 4))
     {
          PyErr_Format(PyExc_ValueError, "Data contained an invalid number of "
                  "channels, 3 or 4 expected, %d recieved (width: %d, "
                  "height: %d, bytes: %d)", channels, width, height, dataLen);
+         PyBuffer_Release(&buffer);
          return NULL;
     }
 
@@ -256,96 +345,388 @@ PyObject *table(PyObject *pself, PyObject *pArgs)
         {
             PyErr_SetString(PyExc_ValueError, "Invalid value in substitution "
                     "table, must be in range(256)");
+            PyBuffer_Release(&buffer);
             return NULL;
         }
     }
 
-    // convert the image using the table
-    for (i=0; i < dataLen; i+=channels)
+    if (!(result = get_output(out, dataLen, &outBuffer)))
     {
-            data[i  ] = sub_table[data[i  ]];
-            data[i+1] = sub_table[data[i+1]];
-            data[i+2] = sub_table[data[i+2]];
+        PyBuffer_Release(&buffer);
+        return NULL;
     }
 
+    // convert the image using the table
+    args.data = buffer.buf;
+    args.newData = outBuffer.buf;
+    args.width = width;
+    args.channels = channels;
+    args.sub_table = sub_table;
+    Py_BEGIN_ALLOW_THREADS
+    status = run_bands(table_band, &args, height, width * channels);
+    Py_END_ALLOW_THREADS
+
+    PyBuffer_Release(&buffer);
+    PyBuffer_Release(&outBuffer);
+
+    if (status)
+    {
+        Py_DECREF(result);
+        return band_error(status, "Memory could not be allocated");
+    }
     
     // Build and return a python tuple.
-    return Py_BuildValue("(iiy#)", width, height, data, dataLen);
+    return Py_BuildValue("(iiN)", width, height, result);
 
 }
 
 /**
- * Parses a tuple passed in as a filter for the spatial operations
+ * Parses a sequence passed in as a filter for the spatial operations
  *
  * Parameters:
  *     PyFilter : PyObject*
- *         The python tuple to be parsed
+ *         The python sequence to be parsed
  *     CFilter : int**
  *        The address of a pointer into which the values will be placed.
  *
  * returntype: int
  * returns: The size of the resulting square filter on one side
- * (the square root of the number of values)
+ * (the square root of the number of values), or -1 with a python exception
+ * set if the filter could not be parsed.
  */
 int parseFilter(PyObject *PyFilter, int **CFilter)
 {
+    PyObject *values;
     Py_ssize_t position;
     int size;
     long numberOfFilterValues;
 
-    numberOfFilterValues = PyTuple_Size(PyFilter);
+    if (!(values = PySequence_Fast(PyFilter, "The filter must be a sequence")))
+        return -1;
+
+    numberOfFilterValues = PySequence_Fast_GET_SIZE(values);
 
     size = sqrt(numberOfFilterValues);
-    
+
     //filter size should be an odd number. if not, decrement it
     if (! (size & 1))
         size--;
 
-   numberOfFilterValues = size * size;
+    if (size < 1)
+    {
+        Py_DECREF(values);
+        PyErr_SetString(PyExc_ValueError, "The filter must contain at least "
+                "one value");
+        return -1;
+    }
+
+    numberOfFilterValues = size * size;
+
+    if (!(*CFilter = calloc(sizeof(int), numberOfFilterValues)))
+    {
+        Py_DECREF(values);
+        PyErr_SetString(PyExc_MemoryError,
+                "Memory could not be allocated for the filter");
+        return -1;
+    }
+
+    for (position = 0; position < numberOfFilterValues; position++)
+    {
+        (*CFilter)[position] = (int)PyLong_AsLong(
+                PySequence_Fast_GET_ITEM(values, position));
+    }
+    Py_DECREF(values);
+
+    if (PyErr_Occurred())
+    {
+        free(*CFilter);
+        return -1;
+    }
+
+    return size;
+}
+
+/**
+ * Checks whether a square filter is the outer product of a column and a row
+ * vector (a rank 1 or "separable" filter). Such a filter can be applied as a
+ * horizontal pass followed by a vertical one, which costs 2 * size
+ * multiplications per channel instead of size * size.
+ *
+ * Every value of a separable filter satisfies
+ *     filter[i][j] * filter[r][c] == filter[i][c] * filter[r][j]
+ * for a pivot (r, c) holding a non-zero value. The row vector is then row r
+ * and the column vector is column c, and the product of the two passes is
+ * exactly pivot times the 2 dimensional sum, so integer results do not change.
+ *
+ * Parameters:
+ *     filter : int*
+ *         The filter values, size * size of them.
+ *     size : int
+ *         The width (and height) of the filter.
+ *     rowVector : int*
+ *         Receives the size values of the horizontal pass.
+ *     columnVector : int*
+ *         Receives the size values of the vertical pass.
+ *     pivot : int*
+ *         Receives the value the result of both passes must be divided by.
+ *
+ * returntype: int
+ * returns: 1 if the filter is separable, 0 otherwise.
+ */
+int separateFilter(int *filter, int size, int *rowVector, int *columnVector,
+        int *pivot)
+{
+    int i, j, position;
+
+    // find the first non-zero value to use as the pivot
+    for (position = 0; position < size * size; position++)
+    {
+        if (filter[position])
+            break;
+    }
+    // an empty filter is handled fine by the general case.
+    if (position == size * size)
+        return 0;
+
+    *pivot = filter[position];
+    for (i = 0; i < size; i++)
+    {
+        rowVector[i] = filter[(position / size) * size + i];
+        columnVector[i] = filter[i * size + position % size];
+    }
+
+    for (i = 0; i < size; i++)
+    {
+        for (j = 0; j < size; j++)
+        {
+            if ((long long)filter[i * size + j] * *pivot !=
+                    (long long)columnVector[i] * rowVector[j])
+                return 0;
+        }
+    }
+    return 1;
+}
+
+// The width in pixels of the column strips the spatial filters work on. The
+// rows of a strip the filter is currently reading stay small enough to remain
+// in the L2 cache, even for very wide images.
+#define SPATIAL_TILE_WIDTH 256
+
+typedef struct {
+    unsigned char *data, *outdata;
+    int width, height, channels;
+    int *filter;        // the full filter
+    int *rowVector, *columnVector, pivot; // the passes of a separable filter
+    int separable;      // whether to use the passes instead of the full filter
+    int filterSize, filterTotal;
+} spatial_args;
+
+/**
+ * Applies a separable filter to one tile (a range of rows in a column strip)
+ * of an image. Each source row is filtered horizontally once into a ring
+ * buffer holding the last size rows, then every output row is the weighted sum
+ * of the rows in the ring buffer. All loops run along a row so memory is read
+ * sequentially.
+ *
+ * returntype: int
+ * returns: 0 on success, -1 if memory could not be allocated.
+ */
+int spatialSeparable(spatial_args *args, int rowStart, int rowEnd,
+        int start, int end)
+{
+    int *ring, *ringRow;
+    long long *sum, tmp;
+    int i, j, k, row, source, stripLength, edgeSize, filterSize, weight;
+    unsigned char *sourceData, *dest;
+    Py_ssize_t rowLength;
+
+    filterSize = args->filterSize;
+    edgeSize = filterSize / 2;
+    stripLength = (end - start) * args->channels;
+    rowLength = (Py_ssize_t)args->width * args->channels;
+
+    ring = malloc(sizeof(int) * stripLength * filterSize);
+    sum = malloc(sizeof(long long) * stripLength);
+    if (!ring || !sum)
+    {
+        free(ring);
+        free(sum);
+        return -1;
+    }
+
+    // source counts the rows read so far, row is the source row in the image
+    for (source = 0; source < rowEnd - rowStart + filterSize - 1; source++)
+    {
+        row = rowStart - edgeSize + source;
+        // horizontal pass for the row entering the ring buffer
+        ringRow = ring + (source % filterSize) * stripLength;
+        memset(ringRow, 0, sizeof(int) * stripLength);
+        for (j = 0; j < filterSize; j++)
+        {
+            if (!(weight = args->rowVector[j]))
+                continue;
+            sourceData = args->data + row * rowLength +
+                (start + j - edgeSize) * args->channels;
+            for (k = 0; k < stripLength; k++)
+                ringRow[k] += sourceData[k] * weight;
+        }
+
+        // wait until the ring buffer holds all the rows this output row needs
+        if (source < filterSize - 1)
+            continue;
+
+        // vertical pass for the row in the center of the ring buffer
+        memset(sum, 0, sizeof(long long) * stripLength);
+        for (i = 0; i < filterSize; i++)
+        {
+            if (!(weight = args->columnVector[i]))
+                continue;
+            ringRow = ring + ((source - filterSize + 1 + i) % filterSize) *
+                stripLength;
+            for (k = 0; k < stripLength; k++)
+                sum[k] += (long long)ringRow[k] * weight;
+        }
+
+        dest = args->outdata + (row - edgeSize) * rowLength +
+            start * args->channels;
+        for (i = 0; i < stripLength; i += args->channels)
+        {
+            for (k = i; k < i + 3; k++)
+            {
+                tmp = sum[k] / args->pivot;
+                dest[k] = clip(abs((int)tmp / args->filterTotal));
+            }
+        }
+    }
+
+    free(ring);
+    free(sum);
+    return 0;
+}
+
+/**
+ * Applies an arbitrary (non separable) filter to one tile (a range of rows in
+ * a column strip) of an image. The weighted source rows are accumulated a
+ * whole strip at a time, so the image is read row by row instead of jumping
+ * between rows for every pixel.
+ *
+ * returntype: int
+ * returns: 0 on success, -1 if memory could not be allocated.
+ */
+int spatialGeneral(spatial_args *args, int rowStart, int rowEnd,
+        int start, int end)
+{
+    int *sum;
+    int i, j, k, row, stripLength, edgeSize, filterSize, weight;
+    unsigned char *source, *dest;
+    Py_ssize_t rowLength;
+
+    filterSize = args->filterSize;
+    edgeSize = filterSize / 2;
+    stripLength = (end - start) * args->channels;
+    rowLength = (Py_ssize_t)args->width * args->channels;
 
-    *CFilter = calloc(sizeof(int), numberOfFilterValues);
+    if (!(sum = malloc(sizeof(int) * stripLength)))
+        return -1;
+
+    for (row = rowStart; row < rowEnd; row++)
+    {
+        memset(sum, 0, sizeof(int) * stripLength);
+        for (i = 0; i < filterSize; i++)
+        {
+            for (j = 0; j < filterSize; j++)
+            {
+                if (!(weight = args->filter[i * filterSize + j]))
+                    continue;
+                source = args->data + (row + i - edgeSize) * rowLength +
+                        (start + j - edgeSize) * args->channels;
+                for (k = 0; k < stripLength; k++)
+                    sum[k] += source[k] * weight;
+            }
+        }
 
-   for (position = 0; position < numberOfFilterValues; position++)
-   {
-        (*CFilter)[position] =
-            (int)PyLong_AS_LONG(PyTuple_GetItem(PyFilter, position));
-   }
+        dest = args->outdata + row * rowLength + start * args->channels;
+        for (i = 0; i < stripLength; i += args->channels)
+        {
+            for (k = i; k < i + 3; k++)
+                dest[k] = clip(abs(sum[k] / args->filterTotal));
+        }
+    }
 
-   return size;
+    free(sum);
+    return 0;
+}
+
+/**
+ * Applies the filter to a band of rows, one column strip at a time. Rows are
+ * counted from the first row that is not part of the (black) edge.
+ */
+int spatial_band(void *pArgs, int start, int end)
+{
+    spatial_args *args = pArgs;
+    int strip, stripEnd, edgeSize;
+
+    edgeSize = args->filterSize / 2;
+    for (strip = edgeSize; strip < args->width - edgeSize;
+            strip += SPATIAL_TILE_WIDTH)
+    {
+        stripEnd = min(strip + SPATIAL_TILE_WIDTH, args->width - edgeSize);
+        if (args->separable)
+        {
+            if (spatialSeparable(args, start + edgeSize, end + edgeSize,
+                        strip, stripEnd))
+                return -1;
+        }
+        else if (spatialGeneral(args, start + edgeSize, end + edgeSize,
+                    strip, stripEnd))
+            return -1;
+    }
+    return 0;
 }
 
 const static char spatial__doc__[] =
 "Implements an arbitrary spatial filter on the image.\n"
-"The filter should be a tuple containing integers.\n"
+"The filter should be a sequence containing integers.\n"
 "The number of elements should be the square of an odd number.\n"
 "The filter will be truncated to the nearest square of an odd number if this "
     "is not the case.\n"
+"Separable filters (those that are the outer product of a row and a column) "
+    "are detected and applied as two one dimensional passes.\n"
 "\n"
 ":Parameters:\n"
 "    width : int\n"
 "        The width of the image in pixels\n"
 "    height : int\n"
 "        The height of the image in pixels\n"
-"    data : string\n"
-"        The data as a string - chr(red) + chr(green) + chr(blue) for each "
-        "pixel.\n"
+"    data : buffer\n"
+"        The image data as bytes, a bytearray or any other buffer - red, "
+        "green, blue (and alpha) bytes for each pixel.\n"
 "    filter : tuple\n"
 "        A 9 element tuple containing the filter values.\n"
 "    filterTotal : int\n"
 "        The total weight of the filter the final result is to be divided by. "
         "This is optional and automatically determined if left out.\n"
+"    out : buffer\n"
+"        An optional writable buffer the same size as data to write the result "
+        "into. It may not share memory with data.\n"
 "\n"
 ":rtype: tuple\n"
 ":returns: A tuple (width, height, data). Width and height are in pixels, "
-    "data is a string containing chr(red) + chr(green) + chr(blue) for each "
-    "pixel.\n";
+    "data is out if it was passed in, otherwise a new bytearray.\n";
 
-PyObject *spatial(PyObject *pself, PyObject *pArgs)
+PyObject *spatial(PyObject *pself, PyObject *pArgs, PyObject *kwArgs)
 {
+    static char *keywords[] = {"width", "height", "data", "filter",
+        "filterTotal", "out", NULL};
     unsigned char *data, *outdata;
-    PyObject *PyFilter; // The Python version of the filter (tuple)
+    Py_buffer buffer, outBuffer;
+    PyObject *PyFilter; // The Python version of the filter (sequence)
+    PyObject *out = NULL;
+    PyObject *result;   // The Python object holding the new image
     int *filter;        // The C version of the filter
-    int width, height, i, j, k, m, position, tmp;
+    int *rowVector, *columnVector; // The passes of a separable filter
+    int width, height, i, status;
+    spatial_args args;
     Py_ssize_t dataLen; // the length of the data passed in
     int filterTotal=0;  // total weight of the filter (the number to divide by)
     int filterSize;     // the width (and height) of the filter;
@@ -353,15 +734,13 @@ PyObject *spatial(PyObject *pself, PyObject *pArgs)
     int edgeSize, numberOfElements;
 
     // convert the passed in python arguments to C types.
-    if (!PyArg_ParseTuple(pArgs, "iiy#O!|i", &width, &height, &data, &dataLen, &PyTuple_Type, &PyFilter, &filterTotal))
+    if (!PyArg_ParseTupleAndKeywords(pArgs, kwArgs, "iiO&O|iO", keywords,
+                &width, &height, image_data, &buffer,
+                &PyFilter, &filterTotal, &out))
         return NULL;
 
-    filterSize = (int)PyTuple_Size(PyFilter);
-
-    filterSize = parseFilter(PyFilter, &filter);
-    numberOfElements = filterSize * filterSize;
-    edgeSize = (filterSize / 2);
-
+    data = buffer.buf;
+    dataLen = buffer.len;
     // How many color channels are in this image?
     channels = dataLen / (width * height);
     if ((channels < 3) || (channels > 4))
@@ -369,15 +748,38 @@ PyObject *spatial(PyObject *pself, PyObject *pArgs)
          PyErr_Format(PyExc_ValueError, "Data contained an invalid number of "
                  "channels, 3 or 4 expected, %d recieved (width: %d, "
                  "height: %d, bytes: %d)", channels, width, height, dataLen);
+         PyBuffer_Release(&buffer);
          return NULL;
     }
 
-    if (!(outdata = calloc(dataLen, sizeof(char))))
+    if ((filterSize = parseFilter(PyFilter, &filter)) < 0)
     {
-         PyErr_SetString(PyExc_MemoryError,
-                 "Memory could not be allocated to create the new image");
-         return NULL;
+        PyBuffer_Release(&buffer);
+        return NULL;
     }
+    numberOfElements = filterSize * filterSize;
+    edgeSize = (filterSize / 2);
+
+    if (!(result = get_output(out, dataLen, &outBuffer)))
+    {
+        free(filter);
+        PyBuffer_Release(&buffer);
+        return NULL;
+    }
+    if (buffers_overlap(&buffer, &outBuffer))
+    {
+        PyErr_SetString(PyExc_ValueError, "The output of a spatial filter "
+                "can not be written over its input");
+        free(filter);
+        PyBuffer_Release(&buffer);
+        PyBuffer_Release(&outBuffer);
+        Py_DECREF(result);
+        return NULL;
+    }
+    outdata = outBuffer.buf;
+    // we need something here to deal with the edges.
+    // for now they are left black.
+    memset(outdata, 0, dataLen);
 
     // find the total weight for the filter (if it's not already set)
     if (!filterTotal)
@@ -392,27 +794,52 @@ PyObject *spatial(PyObject *pself, PyObject *pArgs)
     if (!filterTotal)
         filterTotal = 1;
 
-    // apply the filter
-    // we need something here to deal with the edges.
-    // for now they are left black.
-    for (i= edgeSize * channels; i < (width - edgeSize)*channels; i+=channels)
+    rowVector = malloc(sizeof(int) * filterSize);
+    columnVector = malloc(sizeof(int) * filterSize);
+    if (!rowVector || !columnVector)
     {
-        for (j= edgeSize; j < height - edgeSize ; j++)
-        {
-            k = i + j * width * channels;
-            for (position = k; position < k + 3; position++)
-            {
-                tmp = 0;
-                // calculate the sum of multiplying the pixels by the appropriate filter elements, then divide by the total weight.
-                for(m = 0; m < numberOfElements; m++)
-                {
-                    tmp += data[position +
-                        ((m / filterSize - edgeSize) * width * channels) +
-                        ((m % filterSize - edgeSize) * channels)] * filter[m];
-                }
-                outdata[position] = clip(abs(tmp / filterTotal));
-            }
-        }
+        free(filter);
+        free(rowVector);
+        free(columnVector);
+        PyBuffer_Release(&buffer);
+        PyBuffer_Release(&outBuffer);
+        Py_DECREF(result);
+        PyErr_SetString(PyExc_MemoryError,
+                "Memory could not be allocated for the filter");
+        return NULL;
+    }
+
+    args.data = data;
+    args.outdata = outdata;
+    args.width = width;
+    args.height = height;
+    args.channels = channels;
+    args.filter = filter;
+    args.rowVector = rowVector;
+    args.columnVector = columnVector;
+    args.separable = separateFilter(filter, filterSize, rowVector,
+            columnVector, &args.pivot);
+    args.filterSize = filterSize;
+    args.filterTotal = filterTotal;
+
+    // apply the filter to the rows that are not on the edge
+    Py_BEGIN_ALLOW_THREADS
+    status = run_bands(spatial_band, &args, height - 2 * edgeSize,
+            width * channels);
+    Py_END_ALLOW_THREADS
+
+    // free up unused memory
+    free(filter);
+    free(rowVector);
+    free(columnVector);
+
+    if (status)
+    {
+        PyBuffer_Release(&buffer);
+        PyBuffer_Release(&outBuffer);
+        Py_DECREF(result);
+        return band_error(status,
+                "Memory could not be allocated to apply the filter");
     }
 
     // copy the alpha data (without modification)
@@ -424,11 +851,11 @@ PyObject *spatial(PyObject *pself, PyObject *pArgs)
         }
     }
 
-    // free up unused memory
-    free(filter);
+    PyBuffer_Release(&buffer);
+    PyBuffer_Release(&outBuffer);
 
     // Build a python tuple and return it.
-    return Py_BuildValue("(iiy#)", width, height, outdata, dataLen);
+    return Py_BuildValue("(iiN)", width, height, result);
 
 }
 
@@ -482,131 +909,405 @@ const static char quick_scale__doc__[] =
 "        The width of the image being converted\n"
 "    height : int\n"
 "        The height of the image being converted\n"
-"    data : string\n"
-"        A string containing the data for the image\n"
+"    data : buffer\n"
+"        The image data as bytes, a bytearray or any other buffer.\n"
 "    newWidth : int\n"
 "        The new width for the image.\n"
 "    newHeight : int\n"
 "        The new height for the image\n"
+"    out : buffer\n"
+"        An optional writable buffer the size of the new image to write the "
+        "result into. It may not share memory with data.\n"
 "\n"
 ":rtype: tuple\n"
-":returns: a tuple containing a width, height, and data as a string.\n";
+":returns: a tuple containing a width, height, and data. data is out if it was "
+    "passed in, otherwise a new bytearray.\n";
+
+typedef struct {
+    unsigned char *data, *newData;
+    int width, newWidth, channels;
+    float xRatio, yRatio; // the scaling ratios
+} quick_scale_args;
 
-PyObject *quick_scale(PyObject *pself, PyObject *pArgs)
+int quick_scale_band(void *pArgs, int start, int end)
 {
+    quick_scale_args *args = pArgs;
     int i, j, k; //  loop variables
+    int channels = args->channels;
+    Py_ssize_t oldPosition, newPosition; // position pointers for the images
+
+    // grab each pixel from a relative position in the original image and place
+    // it at (i, j) in the new image this will produce fairly good results
+    // when scaling down, less so when scaling up.
+    for (j=start; j < end; j++)
+    {
+        newPosition = (Py_ssize_t)j * args->newWidth * channels;
+        for (i=0; i < args->newWidth; i++)
+        {
+            oldPosition = ((Py_ssize_t)(int)(j * args->yRatio) * args->width +
+                    (int)(i * args->xRatio)) * channels;
+            for (k=0; k < channels; k++)
+            {
+                args->newData[newPosition++] = args->data[oldPosition + k];
+            }
+        }
+    }
+    return 0;
+}
+
+PyObject *quick_scale(PyObject *pself, PyObject *pArgs, PyObject *kwArgs)
+{
+    static char *keywords[] = {"width", "height", "data", "newWidth",
+        "newHeight", "out", NULL};
     int width, height, newWidth, newHeight, channels;
     Py_ssize_t dataLen;
-    float xRatio, yRatio; // the scaling ratios
-    unsigned char *data, *newData; // the image data
-    int oldPosition, newPosition; // position pointers for the images
-    
+    Py_buffer buffer, outBuffer; // the image data
+    PyObject *out = NULL, *result;
+    quick_scale_args args;
+    int status;
+
     // convert the passed in python argument to C types.
-    if (!PyArg_ParseTuple(pArgs, "iiy#ii", &width, &height, &data, &dataLen,
-                &newWidth, &newHeight))
+    if (!PyArg_ParseTupleAndKeywords(pArgs, kwArgs, "iiO&ii|O", keywords,
+                &width, &height, image_data, &buffer,
+                &newWidth, &newHeight, &out))
         return NULL;
 
+    dataLen = buffer.len;
     channels = dataLen / (width * height);
     if ((channels < 3) || (channels > 4))
     {
          PyErr_Format(PyExc_ValueError, "Data contained an invalid number of "
                  "channels, 3 or 4 expected, %d recieved (width: %d, "
                  "height: %d, bytes: %d)", channels, width, height, dataLen);
+         PyBuffer_Release(&buffer);
+         return NULL;
+    }
+
+    if ((newWidth < 1) || (newHeight < 1))
+    {
+         PyErr_SetString(PyExc_ValueError,
+                 "The new image must be at least 1 pixel wide and high");
+         PyBuffer_Release(&buffer);
          return NULL;
     }
 
-    if (!(newData = malloc(newWidth * newHeight * channels)))
+    if (!(result = get_output(out,
+                    (Py_ssize_t)newWidth * newHeight * channels, &outBuffer)))
     {
-            PyErr_SetString(PyExc_MemoryError,
-                    "Memory could not be allocated to create the new image");
+        PyBuffer_Release(&buffer);
+        return NULL;
+    }
+    if (buffers_overlap(&buffer, &outBuffer))
+    {
+        PyErr_SetString(PyExc_ValueError,
+                "The scaled image can not be written over the original");
+        PyBuffer_Release(&buffer);
+        PyBuffer_Release(&outBuffer);
+        Py_DECREF(result);
         return NULL;
     }
 
-    xRatio = (float)width  / (float)newWidth ;
-    yRatio = (float)height / (float)newHeight;
+    args.data = buffer.buf;
+    args.newData = outBuffer.buf;
+    args.width = width;
+    args.newWidth = newWidth;
+    args.channels = channels;
+    args.xRatio = (float)width  / (float)newWidth ;
+    args.yRatio = (float)height / (float)newHeight;
 
-    // grab each pixel from a relative position in the original image and place
-    // it at (i, j) in the new image this will produce fairly good results 
-    // when scaling down, less so when scaling up.
-    for (i=0; i < newWidth; i++)
+    Py_BEGIN_ALLOW_THREADS
+    status = run_bands(quick_scale_band, &args, newHeight, newWidth * channels);
+    Py_END_ALLOW_THREADS
+
+    PyBuffer_Release(&buffer);
+    PyBuffer_Release(&outBuffer);
+
+    if (status)
     {
-        for (j=0; j < newHeight; j++)
-        {
-            newPosition = (i + j * newWidth) * channels;
-            oldPosition = ((int)(i * xRatio) + (int)(j * yRatio) * width)
-                * channels;
-            for (k=0; k < channels; k++)
-            {
-                newData[newPosition + k] = data[oldPosition + k];
-            }
-        }
+        Py_DECREF(result);
+        return band_error(status, "Memory could not be allocated");
     }
-    
+
     // Build a python tuple and return it.
-    return Py_BuildValue("(iiy#)",  newWidth, newHeight, newData, (newWidth * newHeight * channels));
+    return Py_BuildValue("(iiN)",  newWidth, newHeight, result);
 }
 
-const static char to_rgb__doc__[] =
-" Converts image data to 3 channel RGB format.\n"
+const static char half_scale__doc__[] =
+"Halves the size of an image, averaging each 2x2 block of pixels into one. "
+    "An odd last row or column is averaged on its own.\n"
 "\n"
 ":Parameters:\n"
 "    width : int\n"
 "        The width of the image being converted\n"
 "    height : int\n"
 "        The height of the image being converted\n"
-"    data : bytes\n"
-"        A string containing the data for the image\n"
+"    data : buffer\n"
+"        The image data as bytes, a bytearray or any other buffer.\n"
+"    out : buffer\n"
+"        An optional writable buffer the size of the new image to write the "
+        "result into. It may not share memory with data.\n"
 "\n"
 ":rtype: tuple\n"
-":returns: a tuple containing a width, height, and data as a string in RGB "
-    "format\n";
+":returns: a tuple containing a width, height, and data. The new width and "
+    "height are half the old ones, rounded up. data is out if it was passed "
+    "in, otherwise a new bytearray.\n";
+
+typedef struct {
+    unsigned char *data, *newData;
+    int width, height, newWidth, channels;
+} half_scale_args;
+
+int half_scale_band(void *pArgs, int start, int end)
+{
+    half_scale_args *args = pArgs;
+    int i, j, k; // loop variables
+    int channels = args->channels;
+    Py_ssize_t stride = (Py_ssize_t)args->width * channels;
+    unsigned char *top, *bottom, *newData;
+    int right; // the offset of the right hand pixel of a block
+
+    for (j=start; j < end; j++)
+    {
+        top = args->data + 2 * j * stride;
+        // an odd last row is used as both rows of its blocks
+        bottom = (2 * j + 1 < args->height) ? top + stride : top;
+        newData = args->newData + (Py_ssize_t)j * args->newWidth * channels;
+        for (i=0; i < args->newWidth; i++)
+        {
+            right = (2 * i + 1 < args->width) ? channels : 0;
+            for (k=0; k < channels; k++)
+            {
+                *newData++ = (top[k] + top[k + right] + bottom[k] +
+                        bottom[k + right] + 2) >> 2;
+            }
+            top += 2 * channels;
+            bottom += 2 * channels;
+        }
+    }
+    return 0;
+}
+
+PyObject *half_scale(PyObject *pself, PyObject *pArgs, PyObject *kwArgs)
+{
+    static char *keywords[] = {"width", "height", "data", "out", NULL};
+    int width, height, newWidth, newHeight, channels;
+    Py_ssize_t dataLen;
+    Py_buffer buffer, outBuffer; // the image data
+    PyObject *out = NULL, *result;
+    half_scale_args args;
+    int status;
+
+    // convert the passed in python argument to C types.
+    if (!PyArg_ParseTupleAndKeywords(pArgs, kwArgs, "iiO&|O", keywords,
+                &width, &height, image_data, &buffer, &out))
+        return NULL;
+
+    dataLen = buffer.len;
+    channels = (width > 0 && height > 0) ? dataLen / (width * height) : 0;
+    if ((channels < 3) || (channels > 4) ||
+            (Py_ssize_t)width * height * channels != dataLen)
+    {
+         PyErr_Format(PyExc_ValueError, "Data contained an invalid number of "
+                 "channels, 3 or 4 expected, %d recieved (width: %d, "
+                 "height: %d, bytes: %zd)", channels, width, height, dataLen);
+         PyBuffer_Release(&buffer);
+         return NULL;
+    }
+    newWidth = (width + 1) / 2;
+    newHeight = (height + 1) / 2;
+
+    if (!(result = get_output(out,
+                    (Py_ssize_t)newWidth * newHeight * channels, &outBuffer)))
+    {
+        PyBuffer_Release(&buffer);
+        return NULL;
+    }
+    if (buffers_overlap(&buffer, &outBuffer))
+    {
+        PyErr_SetString(PyExc_ValueError,
+                "The scaled image can not be written over the original");
+        PyBuffer_Release(&buffer);
+        PyBuffer_Release(&outBuffer);
+        Py_DECREF(result);
+        return NULL;
+    }
+
+    args.data = buffer.buf;
+    args.newData = outBuffer.buf;
+    args.width = width;
+    args.height = height;
+    args.newWidth = newWidth;
+    args.channels = channels;
+
+    Py_BEGIN_ALLOW_THREADS
+    status = run_bands(half_scale_band, &args, newHeight, width * channels * 2);
+    Py_END_ALLOW_THREADS
+
+    PyBuffer_Release(&buffer);
+    PyBuffer_Release(&outBuffer);
+
+    if (status)
+    {
+        Py_DECREF(result);
+        return band_error(status, "Memory could not be allocated");
+    }
+
+    // Build a python tuple and return it.
+    return Py_BuildValue("(iiN)",  newWidth, newHeight, result);
+}
+
+typedef struct {
+    unsigned char *data, *newData;
+    int width, channels, newChannels;
+} convert_args;
+
+/**
+ * Copies the red, green and blue channels of a band of rows into an image
+ * with a different number of channels. If the new image has an alpha channel
+ * it is set to 255 (opaque).
+ */
+int convert_band(void *pArgs, int start, int end)
+{
+    convert_args *args = pArgs;
+    unsigned char *data, *newData;
+    Py_ssize_t i, last;
+
+    data = args->data + (Py_ssize_t)start * args->width * args->channels;
+    newData = args->newData +
+        (Py_ssize_t)start * args->width * args->newChannels;
+    last = (Py_ssize_t)(end - start) * args->width;
+    for (i=0; i < last; i++)
+    {
+        newData[0] = data[0];
+        newData[1] = data[1];
+        newData[2] = data[2];
+        if (args->newChannels == 4)
+            newData[3] = 255;
+        data += args->channels;
+        newData += args->newChannels;
+    }
+    return 0;
+}
 
-PyObject *to_rgb(PyObject *pself, PyObject *pArgs)
+/**
+ * Converts image data to a different number of channels. This holds the work
+ * shared by to_rgb and to_rgba.
+ *
+ * :Parameters:
+ *     pArgs, kwArgs : PyObject*
+ *         The arguments to to_rgb or to_rgba.
+ *     newChannels : int
+ *         The number of channels to convert the image to.
+ *
+ * :returntype: PyObject*
+ * :returns: A python tuple (width, height, data).
+ */
+static PyObject *convert(PyObject *pArgs, PyObject *kwArgs, int newChannels)
 {
-       unsigned int width, height, i, pixelCount;
-       Py_ssize_t dataLen;
-       unsigned char *data, *newData, channels;
+    static char *keywords[] = {"width", "height", "data", "out", NULL};
+    unsigned int width, height;
+    Py_ssize_t dataLen;
+    unsigned char channels;
+    Py_buffer buffer, outBuffer;
+    PyObject *out = NULL, *result;
+    convert_args args;
+    int status = 0;
 
     // convert the passed in python arguments to C types.
-    if (!PyArg_ParseTuple(pArgs, "iiy#", &width, &height, &data, &dataLen))
+    if (!PyArg_ParseTupleAndKeywords(pArgs, kwArgs, "iiO&|O", keywords,
+                &width, &height, image_data, &buffer, &out))
         return NULL;
 
+    dataLen = buffer.len;
     channels = dataLen / (width * height);
     if ((channels < 3) || (channels > 4))
     {
          PyErr_Format(PyExc_ValueError, "Data contained an invalid number of "
                  "channels, 3-4 expected, %d recieved (width: %d, "
                  "height: %d, bytes: %d)", channels, width, height, dataLen);
+         PyBuffer_Release(&buffer);
          return NULL;
     }
 
-    if (channels == 3)
+    if (channels == newChannels && (!out || out == Py_None))
     {
-        // return the original data, it's already in RGB format.
-        return Py_BuildValue("(iiy#)", width, height, data, dataLen);
+        // return the original data, it's already in the right format.
+        result = Py_BuildValue("(iiO)", width, height, buffer.obj);
+        PyBuffer_Release(&buffer);
+        return result;
     }
 
-    // allocate memory for the new data
-    if(!(newData = malloc(width * height * 3)))
+    // get memory for the new data
+    if (!(result = get_output(out, (Py_ssize_t)width * height * newChannels,
+                    &outBuffer)))
     {
-         PyErr_SetString(PyExc_MemoryError,
-                 "Memory could not be allocated to create the new image");
-         return NULL;
+        PyBuffer_Release(&buffer);
+        return NULL;
+    }
+
+    if (channels == newChannels)
+    {
+        if (outBuffer.buf != buffer.buf)
+            memmove(outBuffer.buf, buffer.buf, dataLen);
+    }
+    else if (buffers_overlap(&buffer, &outBuffer))
+    {
+        PyErr_SetString(PyExc_ValueError, "The converted image can not be "
+                "written over the original");
+        PyBuffer_Release(&buffer);
+        PyBuffer_Release(&outBuffer);
+        Py_DECREF(result);
+        return NULL;
+    }
+    else
+    {
+        // copy the first 3 channels, setting the alpha channel to 255 if
+        // there is a new one
+        args.data = buffer.buf;
+        args.newData = outBuffer.buf;
+        args.width = width;
+        args.channels = channels;
+        args.newChannels = newChannels;
+        Py_BEGIN_ALLOW_THREADS
+        status = run_bands(convert_band, &args, height, width * newChannels);
+        Py_END_ALLOW_THREADS
     }
 
-    pixelCount = width * height;
+    PyBuffer_Release(&buffer);
+    PyBuffer_Release(&outBuffer);
 
-    // this is an RGBA image, copy only the first 3 channels
-    for(i=0; i < pixelCount; i++)
+    if (status)
     {
-        newData[i*3  ] = data[i*channels  ];
-        newData[i*3+1] = data[i*channels+1];
-        newData[i*3+2] = data[i*channels+2];
+        Py_DECREF(result);
+        return band_error(status, "Memory could not be allocated");
     }
+
     // Build a python tuple and return it.
-    return Py_BuildValue("(iiy#)", width, height, newData,
-            (width * height * 3));
+    return Py_BuildValue("(iiN)", width, height, result);
+}
+
+const static char to_rgb__doc__[] =
+" Converts image data to 3 channel RGB format.\n"
+"\n"
+":Parameters:\n"
+"    width : int\n"
+"        The width of the image being converted\n"
+"    height : int\n"
+"        The height of the image being converted\n"
+"    data : buffer\n"
+"        The image data as bytes, a bytearray or any other buffer.\n"
+"    out : buffer\n"
+"        An optional writable buffer of width * height * 3 bytes to write the "
+        "result into. It may not share memory with data.\n"
+"\n"
+":rtype: tuple\n"
+":returns: a tuple containing a width, height, and data in RGB format. data is "
+    "out if it was passed in. Otherwise it is a new bytearray, or data itself "
+    "if it was already in RGB format.\n";
 
+PyObject *to_rgb(PyObject *pself, PyObject *pArgs, PyObject *kwArgs)
+{
+    return convert(pArgs, kwArgs, 3);
 }
 
 const static char to_rgba__doc__[] =
@@ -617,75 +1318,114 @@ const static char to_rgba__doc__[] =
 "        The width of the image being converted\n"
 "    height : int\n"
 "        The height of the image being converted\n"
-"    data : string\n"
-"        A string containing the data for the image\n"
+"    data : buffer\n"
+"        The image data as bytes, a bytearray or any other buffer.\n"
+"    out : buffer\n"
+"        An optional writable buffer of width * height * 4 bytes to write the "
+        "result into. It may not share memory with data.\n"
 "\n"
 ":rtype: tuple\n"
-":returns: a tuple containing a width, height, and data as a string in RGB "
-    "format with an Alpha Channel\n";
+":returns: a tuple containing a width, height, and data in RGB format with an "
+    "Alpha Channel. data is out if it was passed in. Otherwise it is a new "
+    "bytearray, or data itself if it already had an alpha channel.\n";
 
-PyObject *to_rgba(PyObject *pself, PyObject *pArgs)
+PyObject *to_rgba(PyObject *pself, PyObject *pArgs, PyObject *kwArgs)
 {
-       unsigned int width, height, i, pixelCount;
-       Py_ssize_t dataLen;
-       unsigned char *data, *newData, channels;
+    return convert(pArgs, kwArgs, 4);
+}
 
-    // convert the passed in python arguments to C types.
-    if (!PyArg_ParseTuple(pArgs, "iiy#", &width, &height, &data, &dataLen))
-        return NULL;
+// ================================= PROGRESS ==================================
+// see the PROGRESS section of core.h
 
-    channels = dataLen / (width * height);
-    if ((channels < 3) || (channels > 4))
-    {
-         PyErr_Format(PyExc_ValueError, "Data contained an invalid number of "
-                 "channels, 3-4 expected, %d recieved (width: %d, "
-                 "height: %d, bytes: %d)", channels, width, height, dataLen);
-         return NULL;
-    }
+#ifdef _MSC_VER
+#define THREAD_LOCAL __declspec(thread)
+#else
+#define THREAD_LOCAL __thread
+#endif
 
-    if (channels == 4)
-    {
-        // return the original data, it's already in RGBA format.
-        return Py_BuildValue("(iiy#)", width, height, data, dataLen);
-    }
+// the counter set by each thread, which is held until it is replaced.
+static THREAD_LOCAL Py_buffer *threadProgress = NULL;
 
-    // allocate memory for the new data
-    if(!(newData = malloc(width * height * 4)))
-    {
-         PyErr_SetString(PyExc_MemoryError,
-                 "Memory could not be allocated to create the new image");
-         return NULL;
-    }
+static progress_counter *get_thread_progress(void)
+{
+    return threadProgress ? threadProgress->buf : NULL;
+}
+
+static progress_api progressApi = {get_thread_progress, NULL};
+
+const static char set_progress__doc__[] =
+"Sets the progress counter for the kernels called by this thread. Use "
+    "extensions.lib.core.Progress rather than calling this directly.\n"
+"\n"
+":Parameters:\n"
+"    counter : buffer\n"
+"        A writable buffer holding 3 native 64 bit integers: the rows done, "
+        "the rows started and a flag which stops the kernels when it is set. "
+        "None removes the counter.\n";
 
-    pixelCount = width * height;
+PyObject *set_progress(PyObject *pself, PyObject *pArgs)
+{
+    PyObject *counter;
+    Py_buffer *buffer = NULL;
+
+    if (!PyArg_ParseTuple(pArgs, "O", &counter))
+        return NULL;
 
-    // this is an RGB image, copy the first 3 channels and set the alpha channel
-    // to 255
-    for(i=0; i < pixelCount; i++)
+    if (counter != Py_None)
     {
-        newData[i*4  ] = data[i*channels  ];
-        newData[i*4+1] = data[i*channels+1];
-        newData[i*4+2] = data[i*channels+2];
-        newData[i*4+3] = 255;
+        if (!(buffer = malloc(sizeof(Py_buffer))))
+            return PyErr_NoMemory();
+        if (PyObject_GetBuffer(counter, buffer,
+                    PyBUF_WRITABLE | PyBUF_C_CONTIGUOUS))
+        {
+            free(buffer);
+            return NULL;
+        }
+        if (buffer->len < (Py_ssize_t)sizeof(progress_counter))
+        {
+            PyBuffer_Release(buffer);
+            free(buffer);
+            PyErr_SetString(PyExc_ValueError,
+                    "The progress counter is too small");
+            return NULL;
+        }
     }
-    // Build a python tuple and return it.
-    return Py_BuildValue("(iiy#)", width, height, newData,
-            (width * height * 4));
-
+    if (threadProgress)
+    {
+        PyBuffer_Release(threadProgress);
+        free(threadProgress);
+    }
+    threadProgress = buffer;
+    Py_RETURN_NONE;
 }
 
+// the calling convention of functions taking an out keyword
+#define KEYWORDS (METH_VARARGS | METH_KEYWORDS)
+
 // map of function names to functions
 static struct PyMethodDef core_methods[] =
 {
 //  format is as follows:
-//  {"python_name"  , c_name       , arg_method  , doc_string         },
-    {"spatial"      , spatial      , METH_VARARGS, spatial__doc__      },
-    {"table"        , table        , METH_VARARGS, table__doc__        },
-    {"string_copy"  , string_copy  , METH_VARARGS, string_copy__doc__   },
-    {"swap_channels", swap_channels, METH_VARARGS, swap_channels__doc__},
-    {"quick_scale"  , quick_scale  , METH_VARARGS, quick_scale__doc__   },
-    {"to_rgb"       , to_rgb       , METH_VARARGS, to_rgb__doc__       },
-    {"to_rgba"      , to_rgba      , METH_VARARGS, to_rgba__doc__      },
+//  {"python_name"  , c_name                    , arg_method  ,
+//      doc_string          },
+    {"spatial"      , (PyCFunction)spatial      , KEYWORDS    ,
+        spatial__doc__      },
+    {"table"        , (PyCFunction)table        , KEYWORDS    ,
+        table__doc__        },
+    {"string_copy"  , string_copy               , METH_VARARGS,
+        string_copy__doc__  },
+    {"swap_channels", (PyCFunction)swap_channels, KEYWORDS    ,
+        swap_channels__doc__},
+    {"quick_scale"  , (PyCFunction)quick_scale  , KEYWORDS    ,
+        quick_scale__doc__  },
+    {"half_scale"   , (PyCFunction)half_scale   , KEYWORDS    ,
+        half_scale__doc__   },
+    {"to_rgb"       , (PyCFunction)to_rgb       , KEYWORDS    ,
+        to_rgb__doc__       },
+    {"to_rgba"      , (PyCFunction)to_rgba      , KEYWORDS    ,
+        to_rgba__doc__      },
+    {"set_progress" , set_progress              , METH_VARARGS,
+        set_progress__doc__ },
     {NULL, NULL} // End of functions
 };
 
@@ -699,7 +1439,30 @@ static struct PyModuleDef core_module = {
 
 PyMODINIT_FUNC PyInit_ccore(void)
 {
-    return PyModule_Create(&core_module);
+    PyObject *m = PyModule_Create(&core_module);
+
+    if (!m)
+        return NULL;
+    if (!progressApi.cancelled)
+        progressApi.cancelled = PyErr_NewExceptionWithDoc(
+                "extensions.lib.core.Cancelled",
+                "Raised by a kernel which was stopped with "
+                "Progress.cancel().", NULL, NULL);
+    if (!progressApi.cancelled)
+    {
+        Py_DECREF(m);
+        return NULL;
+    }
+    progress_functions = &progressApi;
+    Py_INCREF(progressApi.cancelled);
+    if (PyModule_AddObject(m, "Cancelled", progressApi.cancelled) ||
+            PyModule_AddObject(m, "_progress_api",
+                PyCapsule_New(&progressApi, PROGRESS_CAPSULE, NULL)))
+    {
+        Py_DECREF(m);
+        return NULL;
+    }
+    return m;
 }
 
 
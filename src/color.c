@@ -1,6 +1,7 @@
 
 #define PY_SSIZE_T_CLEAN
 #include <Python.h>
+#include <string.h>
 #include "core.h"
 
 const static char __doc__[] =
@@ -31,40 +32,92 @@ const static char toGrey__doc__[] =
     "        The width of the image being converted\n"
     "    height : int\n"
     "        The height of the image being converted\n"
-    "    data : string\n"
-    "        A string containing the data for the image\n"
+    "    data : buffer\n"
+    "        The image data as bytes, a bytearray or any other buffer.\n"
+    "    out : buffer\n"
+    "        An optional writable buffer the same size as data to write the "
+            "result into. This may be data itself.\n"
     "\n"
     ":rtype: tuple\n"
-    ":returns: a tuple containing a width, height, and data as a string\n";
+    ":returns: a tuple containing a width, height, and data. data is out if it "
+        "was passed in, otherwise a new bytearray.\n";
 
-PyObject *to_grey(PyObject *pself, PyObject *pArgs)
+typedef struct {
+    unsigned char *data, *newData;
+    int width, channels;
+} grey_args;
+
+int to_grey_band(void *pArgs, int start, int end)
+{
+    grey_args *args = pArgs;
+    unsigned char *data = args->data, *newData = args->newData;
+    Py_ssize_t i, last;
+
+    last = (Py_ssize_t)end * args->width * args->channels;
+    // set each channel the pixel's average
+    for (i = (Py_ssize_t)start * args->width * args->channels; i < last;
+            i += args->channels)
+    {
+        newData[i] = newData[i+1] = newData[i+2] =
+            (data[i] + data[i+1] + data[i+2]) / 3;
+        if (args->channels == 4)
+            newData[i+3] = data[i+3];
+    }
+    return 0;
+}
+
+PyObject *to_grey(PyObject *pself, PyObject *pArgs, PyObject *kwArgs)
 {
-    unsigned int width, height, i;
+    static char *keywords[] = {"width", "height", "data", "out", NULL};
+    unsigned int width, height;
     Py_ssize_t dataLen;
-    unsigned char *data, channels;
+    unsigned char channels;
+    Py_buffer buffer, outBuffer;
+    PyObject *out = NULL, *result;
+    grey_args args;
+    int status;
 
     // convert the passed in python arguments to C types.
-    if (!PyArg_ParseTuple(pArgs, "iiy#", &width, &height, &data, &dataLen))
+    if (!PyArg_ParseTupleAndKeywords(pArgs, kwArgs, "iiO&|O", keywords,
+                &width, &height, image_data, &buffer, &out))
         return NULL;
 
+    dataLen = buffer.len;
     channels = dataLen / (width * height);
     if ((channels < 3) || (channels > 4))
     {
         PyErr_Format(PyExc_ValueError, "Data contained an invalid number of "
                 "channels, 3 or 4 expected, %d recieved (width: %d, "
                 "height: %d, bytes: %d)", channels, width, height, dataLen);
+        PyBuffer_Release(&buffer);
         return NULL;
     }
 
-    // set each channel the pixel's average
-    for (i=0; i < dataLen; i+=channels)
+    if (!(result = get_output(out, dataLen, &outBuffer)))
     {
-        data[i] = data[i+1] = data[i+2] = 
-            (data[i] + data[i+1] + data[i+2]) / 3;
+        PyBuffer_Release(&buffer);
+        return NULL;
+    }
+
+    args.data = buffer.buf;
+    args.newData = outBuffer.buf;
+    args.width = width;
+    args.channels = channels;
+    Py_BEGIN_ALLOW_THREADS
+    status = run_bands(to_grey_band, &args, height, width * channels);
+    Py_END_ALLOW_THREADS
+
+    PyBuffer_Release(&buffer);
+    PyBuffer_Release(&outBuffer);
+
+    if (status)
+    {
+        Py_DECREF(result);
+        return band_error(status, "Memory could not be allocated");
     }
 
     // Build a python tuple and return it.
-    return Py_BuildValue("(iiy#)", width, height, data, dataLen);
+    return Py_BuildValue("(iiN)", width, height, result);
 }
 
 
@@ -76,53 +129,109 @@ const static char transform__doc__[] =
 "        The width of the image being converted\n"
 "    height : int\n"
 "        The height of the image being converted\n"
-"    data : string\n"
-"        A string containing the data for the image\n"
+"    data : buffer\n"
+"        The image data as bytes, a bytearray or any other buffer.\n"
 "    transform : tuple\n"
 "        The transform to be applied. Should be a tuple containing 9 "
 "        values, 3 for each color.\n"
 "        red   = red * t[0] + green * t[1] + blue  * t[2]\n"
 "        green = red * t[3] + green * t[4] + blue  * t[5]\n"
 "        blue  = red * t[6] + green * t[7] + blue  * t[8]\n"
+"    out : buffer\n"
+"        An optional writable buffer the same size as data to write the result "
+        "into. This may be data itself.\n"
 "\n"
 ":rtype: tuple\n"
-":returns: a tuple containing a width, height, and data as a string\n";
+":returns: a tuple containing a width, height, and data. data is out if it "
+    "was passed in, otherwise a new bytearray.\n";
+
+typedef struct {
+    unsigned char *data, *newData;
+    int width, channels;
+    float rr, rg, rb, gr, gg, gb, br, bg, bb; // values used to transform color.
+} transform_args;
 
-PyObject *transform(PyObject *pself, PyObject *pArgs)
+int transform_band(void *pArgs, int start, int end)
 {
-    unsigned int width, height, i;
-    Py_ssize_t dataLen;
-    unsigned char *data, channels;
+    transform_args *a = pArgs;
+    unsigned char *data = a->data, *newData = a->newData;
     pixel3 p3;
-    float rr, rg, rb, gr, gg, gb, br, bg, bb; // values used to transform color.
+    Py_ssize_t i, last;
+
+    last = (Py_ssize_t)end * a->width * a->channels;
+    // multiply each pixel by the transform values.
+    for (i = (Py_ssize_t)start * a->width * a->channels; i < last;
+            i += a->channels)
+    {
+        p3.red = data[i]; p3.green = data[i+1]; p3.blue = data[i+2];
+
+        newData[i  ] = clip((int)(p3.red * a->rr + p3.green * a->rg +
+                    p3.blue * a->rb));
+        newData[i+1] = clip((int)(p3.red * a->gr + p3.green * a->gg +
+                    p3.blue * a->gb));
+        newData[i+2] = clip((int)(p3.red * a->br + p3.green * a->bg +
+                    p3.blue * a->bb));
+        if (a->channels == 4)
+            newData[i+3] = data[i+3];
+    }
+    return 0;
+}
+
+PyObject *transform(PyObject *pself, PyObject *pArgs, PyObject *kwArgs)
+{
+    static char *keywords[] = {"width", "height", "data", "transform", "out",
+        NULL};
+    unsigned int width, height;
+    Py_ssize_t dataLen;
+    unsigned char channels;
+    Py_buffer buffer, outBuffer;
+    PyObject *out = NULL, *result;
+    transform_args a;
+    int status;
 
     // convert the passed in python arguments to C types.
-    if (!PyArg_ParseTuple(pArgs, "iiy#(fffffffff)", &width, &height, &data, 
-                &dataLen, &rr, &rg, &rb, &gr, &gg, &gb, &br, &bg, &bb))
+    if (!PyArg_ParseTupleAndKeywords(pArgs, kwArgs, "iiO&(fffffffff)|O",
+                keywords, &width, &height, image_data, &buffer,
+                &a.rr, &a.rg, &a.rb,
+                &a.gr, &a.gg, &a.gb, &a.br, &a.bg, &a.bb, &out))
         return NULL;
 
+    dataLen = buffer.len;
     channels = dataLen / (width * height);
     if ((channels < 3) || (channels > 4))
     {
         PyErr_Format(PyExc_ValueError, "Data contained an invalid number of "
                 "channels, 3 or 4 expected, %d recieved (width: %d, "
                 "height: %d, bytes: %d)", channels, width, height, dataLen);
+        PyBuffer_Release(&buffer);
         return NULL;
     }
 
-    // multiply each pixel by the transform values.
-    for (i=0; i < dataLen; i+=channels)
+    if (!(result = get_output(out, dataLen, &outBuffer)))
     {
-        p3.red = data[i]; p3.green = data[i+1]; p3.blue = data[i+2];
+        PyBuffer_Release(&buffer);
+        return NULL;
+    }
+
+    a.data = buffer.buf;
+    a.newData = outBuffer.buf;
+    a.width = width;
+    a.channels = channels;
+    Py_BEGIN_ALLOW_THREADS
+    status = run_bands(transform_band, &a, height, width * channels);
+    Py_END_ALLOW_THREADS
 
-        data[i  ] = clip((int)(p3.red * rr + p3.green * rg + p3.blue * rb));
-        data[i+1] = clip((int)(p3.red * gr + p3.green * gg + p3.blue * gb));
-        data[i+2] = clip((int)(p3.red * br + p3.green * bg + p3.blue * bb));
+    PyBuffer_Release(&buffer);
+    PyBuffer_Release(&outBuffer);
 
+    if (status)
+    {
+        Py_DECREF(result);
+        return band_error(status, "Memory could not be allocated");
     }
 
     // Build a python tuple and return it.
-    return Py_BuildValue("(iiy#)", width, height, data, dataLen);
+    return Py_BuildValue("(iiN)", width, height, result);
 }
 
 const static char brightness__doc__[] =
@@ -133,43 +242,98 @@ const static char brightness__doc__[] =
 "        The width of the image being converted\n"
 "    height : int\n"
 "        The height of the image being converted\n"
-"    data : string\n"
-"        A string containing the data for the image\n"
+"    data : buffer\n"
+"        The image data as bytes, a bytearray or any other buffer.\n"
+"    brightness : tuple\n"
+"        The values to be added to the red, green and blue channels.\n"
+"    out : buffer\n"
+"        An optional writable buffer the same size as data to write the result "
+        "into. This may be data itself.\n"
 "\n"
 ":rtype: tuple\n"
-":returns: a tuple containing a width, height, and data as a string\n";
+":returns: a tuple containing a width, height, and data. data is out if it "
+    "was passed in, otherwise a new bytearray.\n";
+
+typedef struct {
+    unsigned char *data, *newData;
+    int width, channels;
+    int r, g, b;
+} brightness_args;
+
+int brightness_band(void *pArgs, int start, int end)
+{
+    brightness_args *args = pArgs;
+    unsigned char *data = args->data, *newData = args->newData;
+    Py_ssize_t i, last;
+
+    last = (Py_ssize_t)end * args->width * args->channels;
+    for (i = (Py_ssize_t)start * args->width * args->channels; i < last;
+            i += args->channels)
+    {
+        newData[i  ] = clip(data[i  ] + args->r);
+        newData[i+1] = clip(data[i+1] + args->g);
+        newData[i+2] = clip(data[i+2] + args->b);
+        if (args->channels == 4)
+            newData[i+3] = data[i+3];
+    }
+    return 0;
+}
 
-PyObject *brightness(PyObject *pself, PyObject *pArgs)
+PyObject *brightness(PyObject *pself, PyObject *pArgs, PyObject *kwArgs)
 {
-    unsigned int width, height, i;
+    static char *keywords[] = {"width", "height", "data", "brightness", "out",
+        NULL};
+    unsigned int width, height;
     Py_ssize_t dataLen;
-    unsigned char *data, channels;
-    int r, g, b;
+    unsigned char channels;
+    Py_buffer buffer, outBuffer;
+    PyObject *out = NULL, *result;
+    brightness_args args;
+    int status;
 
 
     // convert the passed in python arguments to C types.
-    if (!PyArg_ParseTuple(pArgs, "iiy#(iii)",
-                &width, &height, &data, &dataLen, &r, &g, &b))
+    if (!PyArg_ParseTupleAndKeywords(pArgs, kwArgs, "iiO&(iii)|O", keywords,
+                &width, &height, image_data, &buffer,
+                &args.r, &args.g, &args.b, &out))
         return NULL;
 
+    dataLen = buffer.len;
     channels = dataLen / (width * height);
     if ((channels < 3) || (channels > 4))
     {
         PyErr_Format(PyExc_ValueError, "Data contained an invalid number of "
                 "channels, 3 or 4 expected, %d recieved (width: %d, "
                 "height: %d, bytes: %d)", channels, width, height, dataLen);
+        PyBuffer_Release(&buffer);
+        return NULL;
+    }
+
+    if (!(result = get_output(out, dataLen, &outBuffer)))
+    {
+        PyBuffer_Release(&buffer);
         return NULL;
     }
 
-    for (i=0; i < dataLen; i+=channels)
+    args.data = buffer.buf;
+    args.newData = outBuffer.buf;
+    args.width = width;
+    args.channels = channels;
+    Py_BEGIN_ALLOW_THREADS
+    status = run_bands(brightness_band, &args, height, width * channels);
+    Py_END_ALLOW_THREADS
+
+    PyBuffer_Release(&buffer);
+    PyBuffer_Release(&outBuffer);
+
+    if (status)
     {
-        data[i  ] = clip(data[i  ] + r);
-        data[i+1] = clip(data[i+1] + g);
-        data[i+2] = clip(data[i+2] + b);
+        Py_DECREF(result);
+        return band_error(status, "Memory could not be allocated");
     }
 
     // Build a python tuple and return it.
-    return Py_BuildValue("(iiy#)", width, height, data, dataLen);
+    return Py_BuildValue("(iiN)", width, height, result);
 }
 
 const static char pseudocolor__doc__[] =
@@ -184,33 +348,75 @@ const static char pseudocolor__doc__[] =
 "        The width of the image being converted\n"
 "    height : int\n"
 "        The height of the image being converted\n"
-"    data : string\n"
-"        A string containing the data for the image\n"
+"    data : buffer\n"
+"        The image data as bytes, a bytearray or any other buffer.\n"
 "    p3 : string\n"
 "        A string containing data for 16 pixels to be used for replacement."
-"\n\n"
+"\n"
+"    out : buffer\n"
+"        An optional writable buffer the same size as data to write the result "
+        "into. This may be data itself.\n"
+"\n"
 ":rtype: tuple\n"
-":returns: a tuple containing a width, height, and data as a string\n";
+":returns: a tuple containing a width, height, and data. data is out if it "
+    "was passed in, otherwise a new bytearray.\n";
+
+typedef struct {
+    unsigned char *data, *newData;
+    int width, channels;
+    pixel3 *p3;
+} pseudocolor_args;
+
+int pseudocolor_band(void *pArgs, int start, int end)
+{
+    pseudocolor_args *args = pArgs;
+    unsigned char *data = args->data, *newData = args->newData;
+    pixel3 thisPixel;
+    Py_ssize_t i, last;
+
+    last = (Py_ssize_t)end * args->width * args->channels;
+    for (i = (Py_ssize_t)start * args->width * args->channels; i < last;
+            i += args->channels)
+    {
+        // pick the appropriate replacement based on the first 3 bits of the
+        // greyscale value of this pixel.
+        thisPixel = args->p3[(((data[i] + data[i+1] + data[i+2]) / 3) >> 4)];
+        newData[i  ] = thisPixel.red;
+        newData[i+1] = thisPixel.green;
+        newData[i+2] = thisPixel.blue;
+        if (args->channels == 4)
+            newData[i+3] = data[i+3];
+    }
+    return 0;
+}
 
-PyObject *pseudocolor(PyObject *pself, PyObject *pArgs)
+PyObject *pseudocolor(PyObject *pself, PyObject *pArgs, PyObject *kwArgs)
 {
-    unsigned int width, height, i;
+    static char *keywords[] = {"width", "height", "data", "p3", "out", NULL};
+    unsigned int width, height;
     Py_ssize_t dataLen, p3Len;
-    unsigned char *data, channels;
-    pixel3 *p3, thisPixel;
+    unsigned char channels;
+    Py_buffer buffer, outBuffer;
+    PyObject *out = NULL, *result;
+    pixel3 *p3;
+    pseudocolor_args args;
+    int status;
 
 
     // convert the passed in python arguments to C types.
-    if (!PyArg_ParseTuple(pArgs, "iiy#s#", &width, &height, &data, &dataLen,
-                (char**)&p3, &p3Len))
+    if (!PyArg_ParseTupleAndKeywords(pArgs, kwArgs, "iiO&s#|O", keywords,
+                &width, &height, image_data, &buffer,
+                (char**)&p3, &p3Len, &out))
         return NULL;
 
+    dataLen = buffer.len;
     channels = dataLen / (width * height);
     if ((channels < 3) || (channels > 4))
     {
         PyErr_Format(PyExc_ValueError, "Data contained an invalid number of "
                 "channels, 3 or 4 expected, %d recieved (width: %d, "
                 "height: %d, bytes: %d)", channels, width, height, dataLen);
+        PyBuffer_Release(&buffer);
         return NULL;
     }
 
@@ -218,32 +424,290 @@ PyObject *pseudocolor(PyObject *pself, PyObject *pArgs)
     {
         PyErr_Format(PyExc_ValueError, "Replacement data contained an invalid "
                 "number of colors, 16 expected, %d recieved", p3Len/3);
+        PyBuffer_Release(&buffer);
         return NULL;
     }
 
-    for (i=0; i < dataLen; i+=channels)
+    if (!(result = get_output(out, dataLen, &outBuffer)))
     {
-        // pick the appropriate replacement based on the first 3 bits of the 
-        // greyscale value of this pixel.
-        thisPixel = p3[(((data[i] + data[i+1] + data[i+2]) / 3) >> 4)];
-        data[i  ] = thisPixel.red;
-        data[i+1] = thisPixel.green;
-        data[i+2] = thisPixel.blue;
-   }
+        PyBuffer_Release(&buffer);
+        return NULL;
+    }
+
+    args.data = buffer.buf;
+    args.newData = outBuffer.buf;
+    args.width = width;
+    args.channels = channels;
+    args.p3 = p3;
+    Py_BEGIN_ALLOW_THREADS
+    status = run_bands(pseudocolor_band, &args, height, width * channels);
+    Py_END_ALLOW_THREADS
+
+    PyBuffer_Release(&buffer);
+    PyBuffer_Release(&outBuffer);
+
+    if (status)
+    {
+        Py_DECREF(result);
+        return band_error(status, "Memory could not be allocated");
+    }
 
     // Build a python tuple and return it.
-    return Py_BuildValue("(iiy#)", width, height, data, dataLen);
+    return Py_BuildValue("(iiN)", width, height, result);
+}
+
+const static char pipeline__doc__[] =
+"Applies a number of point operations to an image in a single pass. Each "
+    "pixel is read once, run through every stage and written once. This is "
+    "normally called by extensions.lib.pipeline.Pipeline, which builds the "
+    "stages from a chain of operations.\n"
+"\n"
+":Parameters:\n"
+"    width : int\n"
+"        The width of the image being converted\n"
+"    height : int\n"
+"        The height of the image being converted\n"
+"    data : buffer\n"
+"        The image data as bytes, a bytearray or any other buffer.\n"
+"    stages : sequence\n"
+"        The stages to be applied, in order. Each is a tuple (kind, "
+        "transform, tables). kind is 0 for a table only, 1 to apply the 9 "
+        "value color transform first (as the transform function does) or 2 to "
+        "convert the pixel to grey first (as to_grey does). tables is None or "
+        "768 bytes, a 256 value substitution table for each of red, green and "
+        "blue, applied after the transform or greyscale conversion.\n"
+"    out : buffer\n"
+"        An optional writable buffer the same size as data to write the result "
+        "into. This may be data itself.\n"
+"\n"
+":rtype: tuple\n"
+":returns: a tuple containing a width, height, and data. data is out if it "
+    "was passed in, otherwise a new bytearray.\n";
+
+// the kinds of pipeline stages
+#define STAGE_TABLE 0
+#define STAGE_TRANSFORM 1
+#define STAGE_GREY 2
+
+typedef struct {
+    int kind;
+    float t[9]; // the color transform for STAGE_TRANSFORM
+    unsigned char *tables; // red, green and blue tables, or NULL for none
+} pipeline_stage;
+
+typedef struct {
+    unsigned char *data, *newData;
+    int width, channels, stageCount;
+    pipeline_stage *stages;
+} pipeline_args;
+
+int pipeline_band(void *pArgs, int start, int end)
+{
+    pipeline_args *args = pArgs;
+    unsigned char *data = args->data, *newData = args->newData;
+    pipeline_stage *stage, *lastStage = args->stages + args->stageCount;
+    int red, green, blue, tmpRed, tmpGreen;
+    Py_ssize_t i, last;
+
+    last = (Py_ssize_t)end * args->width * args->channels;
+    for (i = (Py_ssize_t)start * args->width * args->channels; i < last;
+            i += args->channels)
+    {
+        red = data[i]; green = data[i+1]; blue = data[i+2];
+        for (stage = args->stages; stage < lastStage; stage++)
+        {
+            switch (stage->kind)
+            {
+                case STAGE_TRANSFORM:
+                    tmpRed = clip((int)(red * stage->t[0] +
+                                green * stage->t[1] + blue * stage->t[2]));
+                    tmpGreen = clip((int)(red * stage->t[3] +
+                                green * stage->t[4] + blue * stage->t[5]));
+                    blue = clip((int)(red * stage->t[6] +
+                                green * stage->t[7] + blue * stage->t[8]));
+                    red = tmpRed;
+                    green = tmpGreen;
+                    break;
+                case STAGE_GREY:
+                    red = green = blue = (red + green + blue) / 3;
+                    break;
+            }
+            if (stage->tables)
+            {
+                red   = stage->tables[red];
+                green = stage->tables[256 + green];
+                blue  = stage->tables[512 + blue];
+            }
+        }
+        newData[i  ] = red;
+        newData[i+1] = green;
+        newData[i+2] = blue;
+        if (args->channels == 4)
+            newData[i+3] = data[i+3];
+    }
+    return 0;
+}
+
+/**
+ * Reads the stages of a pipeline from python.
+ *
+ * :Parameters:
+ *     pyStages : PyObject*
+ *         The sequence of (kind, transform, tables) tuples.
+ *     stages : pipeline_stage**
+ *         Set to a newly allocated array of stages, which also holds their
+ *         tables. It should be released with free().
+ *
+ * :returntype: int
+ * :returns: The number of stages, or -1 with a python exception set.
+ */
+static int parseStages(PyObject *pyStages, pipeline_stage **stages)
+{
+    PyObject *sequence, *transform, *tables;
+    Py_buffer tableBuffer;
+    pipeline_stage *stage;
+    unsigned char *tableMemory;
+    int i, stageCount;
+
+    if (!(sequence = PySequence_Fast(pyStages,
+                    "The pipeline stages must be a sequence")))
+        return -1;
+    stageCount = PySequence_Fast_GET_SIZE(sequence);
+    if (!(*stages = malloc(stageCount * (sizeof(pipeline_stage) + 768) + 1)))
+    {
+        Py_DECREF(sequence);
+        PyErr_SetString(PyExc_MemoryError,
+                "Memory could not be allocated for the pipeline");
+        return -1;
+    }
+    tableMemory = (unsigned char*)(*stages + stageCount);
+
+    for (i=0; i < stageCount; i++)
+    {
+        stage = *stages + i;
+        if (!PyArg_ParseTuple(PySequence_Fast_GET_ITEM(sequence, i), "iOO",
+                    &stage->kind, &transform, &tables))
+            break;
+        if (stage->kind < STAGE_TABLE || stage->kind > STAGE_GREY)
+        {
+            PyErr_Format(PyExc_ValueError, "Invalid pipeline stage kind %d",
+                    stage->kind);
+            break;
+        }
+        if (stage->kind == STAGE_TRANSFORM && !PyArg_ParseTuple(transform,
+                    "fffffffff", &stage->t[0], &stage->t[1], &stage->t[2],
+                    &stage->t[3], &stage->t[4], &stage->t[5], &stage->t[6],
+                    &stage->t[7], &stage->t[8]))
+            break;
+
+        stage->tables = NULL;
+        if (tables != Py_None)
+        {
+            if (PyObject_GetBuffer(tables, &tableBuffer, PyBUF_SIMPLE))
+                break;
+            if (tableBuffer.len != 768)
+            {
+                PyErr_Format(PyExc_ValueError, "Pipeline tables must be 768 "
+                        "bytes, %zd recieved", tableBuffer.len);
+                PyBuffer_Release(&tableBuffer);
+                break;
+            }
+            stage->tables = tableMemory + i * 768;
+            memcpy(stage->tables, tableBuffer.buf, 768);
+            PyBuffer_Release(&tableBuffer);
+        }
+    }
+    Py_DECREF(sequence);
+
+    if (i < stageCount)
+    {
+        free(*stages);
+        return -1;
+    }
+    return stageCount;
 }
 
+PyObject *pipeline(PyObject *pself, PyObject *pArgs, PyObject *kwArgs)
+{
+    static char *keywords[] = {"width", "height", "data", "stages", "out",
+        NULL};
+    unsigned int width, height;
+    Py_ssize_t dataLen;
+    unsigned char channels;
+    Py_buffer buffer, outBuffer;
+    PyObject *pyStages, *out = NULL, *result;
+    pipeline_args args;
+    int status;
+
+    // convert the passed in python arguments to C types.
+    if (!PyArg_ParseTupleAndKeywords(pArgs, kwArgs, "iiO&O|O", keywords,
+                &width, &height, image_data, &buffer, &pyStages, &out))
+        return NULL;
+
+    dataLen = buffer.len;
+    channels = dataLen / (width * height);
+    if ((channels < 3) || (channels > 4))
+    {
+        PyErr_Format(PyExc_ValueError, "Data contained an invalid number of "
+                "channels, 3 or 4 expected, %d recieved (width: %d, "
+                "height: %d, bytes: %d)", channels, width, height, dataLen);
+        PyBuffer_Release(&buffer);
+        return NULL;
+    }
+
+    if ((args.stageCount = parseStages(pyStages, &args.stages)) < 0)
+    {
+        PyBuffer_Release(&buffer);
+        return NULL;
+    }
+
+    if (!(result = get_output(out, dataLen, &outBuffer)))
+    {
+        free(args.stages);
+        PyBuffer_Release(&buffer);
+        return NULL;
+    }
+
+    args.data = buffer.buf;
+    args.newData = outBuffer.buf;
+    args.width = width;
+    args.channels = channels;
+    Py_BEGIN_ALLOW_THREADS
+    status = run_bands(pipeline_band, &args, height, width * channels);
+    Py_END_ALLOW_THREADS
+
+    free(args.stages);
+    PyBuffer_Release(&buffer);
+    PyBuffer_Release(&outBuffer);
+
+    if (status)
+    {
+        Py_DECREF(result);
+        return band_error(status, "Memory could not be allocated");
+    }
+
+    // Build a python tuple and return it.
+    return Py_BuildValue("(iiN)", width, height, result);
+}
+
+// the calling convention of functions taking an out keyword
+#define KEYWORDS (METH_VARARGS | METH_KEYWORDS)
 
 static PyMethodDef color_methods[] =
 {
 //  format is as follows:
-//  {"python_name"       , c_name     , arg_method  , doc_string        },
-    {"to_grey"           , to_grey    , METH_VARARGS, toGrey__doc__     },
-    {"transform"         , transform  , METH_VARARGS, transform__doc__  },
-    {"channel_brightness", brightness , METH_VARARGS, brightness__doc__ },
-    {"pseudocolor"       , pseudocolor, METH_VARARGS, pseudocolor__doc__},
+//  {"python_name"       , c_name                  , arg_method,
+//      doc_string        },
+    {"to_grey"           , (PyCFunction)to_grey    , KEYWORDS  ,
+        toGrey__doc__     },
+    {"transform"         , (PyCFunction)transform  , KEYWORDS  ,
+        transform__doc__  },
+    {"channel_brightness", (PyCFunction)brightness , KEYWORDS  ,
+        brightness__doc__ },
+    {"pseudocolor"       , (PyCFunction)pseudocolor, KEYWORDS  ,
+        pseudocolor__doc__},
+    {"pipeline"          , (PyCFunction)pipeline   , KEYWORDS  ,
+        pipeline__doc__   },
     {NULL, NULL} // End of functions
 };
 
@@ -257,6 +721,12 @@ static struct PyModuleDef color_module = {
 
 PyMODINIT_FUNC PyInit_color(void)
 {
-    return PyModule_Create(&color_module);
+    PyObject *m = PyModule_Create(&color_module);
+    if (!m || import_progress())
+    {
+        Py_XDECREF(m);
+        return NULL;
+    }
+    return m;
 }
 
@@ -1,6 +1,15 @@
 #ifndef CORE_H
 #define CORE_H
 
+#include <stdlib.h>
+#include <string.h>
+#ifdef _WIN32
+#include <windows.h>
+#else
+#include <pthread.h>
+#include <unistd.h>
+#endif
+
 // clips an integer at a value between 0 and 255. Values less than
 // 0 will be set to 0, values larger than 255 will be set to 255.
 #ifndef clip
@@ -32,5 +41,432 @@ typedef struct {
     unsigned char alpha;
 } pixel4;
 
-#endif // CORE_H
+// ============================ MULTI-THREADING ================================
+// Kernels split their work into bands of rows which are handed out to a
+// number of worker threads. The python functions release the GIL while the
+// bands are processed. The number of threads can be set with the PIMP_THREADS
+// environment variable (see extensions.lib.core.set_thread_count), and
+// defaults to the number of processors.
+
+// Images smaller than this many bytes are processed in the calling thread;
+// starting threads would cost more than they save.
+#define MINIMUM_THREADED_BYTES 262144
+
+// Jobs which report their progress are split into at least this many bands.
+#define PROGRESS_STEPS 64
+
+// A function processing the rows from start up to (not including) end. args
+// points to a structure holding whatever else the function needs. It should
+// return 0 on success and non-zero on failure (e.g. out of memory).
+typedef int (*band_function)(void *args, int start, int end);
+
+// ================================= PROGRESS ==================================
+// A thread can ask to be told how far the kernels it calls have got, and stop
+// them part way through, by setting a progress counter with
+// extensions.lib.core.set_progress. The counter belongs to the thread which
+// set it, so kernels running on other threads aren't affected. run_bands adds
+// the rows of each job to total when it starts and to done as each band
+// finishes, and stops handing out bands once cancel is set. The kernel then
+// raises extensions.lib.core.Cancelled.
+// The counter is kept by ccore and shared with the other modules through a
+// capsule, which each module imports with import_progress when it is loaded.
+// Python.h must be included before this file.
+
+// The layout of the buffer passed to set_progress, 3 native 64 bit integers.
+typedef struct {
+    volatile long long done;    // the rows which have been processed
+    volatile long long total;   // the rows of all the jobs started
+    volatile long long cancel;  // non-zero to stop processing
+} progress_counter;
+
+typedef struct {
+    // gets the counter set by the calling thread, or NULL if there is none.
+    progress_counter *(*get_progress)(void);
+    // the exception raised by kernels which were cancelled.
+    PyObject *cancelled;
+} progress_api;
+
+#define PROGRESS_MODULE "extensions.lib.ccore"
+#define PROGRESS_CAPSULE PROGRESS_MODULE "._progress_api"
+
+// the value run_bands returns when the job was cancelled.
+#define BANDS_CANCELLED -1
+
+static progress_api *progress_functions = NULL;
+
+/**
+ * Imports the progress counter functions from ccore. This must be called when
+ * a module is loaded (ccore sets progress_functions itself).
+ *
+ * returntype: int
+ * returns: 0 on success, -1 with an exception set on failure.
+ */
+static inline int import_progress(void)
+{
+    PyObject *module;
+
+    if (progress_functions)
+        return 0;
+    // PyCapsule_Import only imports the top level package itself.
+    if (!(module = PyImport_ImportModule(PROGRESS_MODULE)))
+        return -1;
+    Py_DECREF(module);
+    progress_functions = PyCapsule_Import(PROGRESS_CAPSULE, 0);
+    return progress_functions ? 0 : -1;
+}
+
+/**
+ * Sets the exception for a job run_bands didn't finish.
+ *
+ * Parameters:
+ *     status : int
+ *         The value returned by run_bands.
+ *     message : const char*
+ *         The message for the MemoryError raised if the job wasn't
+ *         cancelled.
+ *
+ * returntype: PyObject*
+ * returns: NULL, so it can be returned from the kernel.
+ */
+static inline PyObject *band_error(int status, const char *message)
+{
+    if (status == BANDS_CANCELLED)
+        PyErr_SetString(progress_functions->cancelled,
+                "The operation was cancelled");
+    else
+        PyErr_SetString(PyExc_MemoryError, message);
+    return NULL;
+}
+
+typedef struct {
+    band_function function;
+    void *args;
+    int rows;           // the total number of rows to be processed
+    int bandSize;       // the number of rows in each band
+    volatile long next; // the index of the next band to be processed
+    volatile long status;
+    progress_counter *progress; // the calling thread's counter, or NULL
+} band_job;
+
+/**
+ * Atomically adds a value to a 64 bit counter shared between threads.
+ */
+static inline void atomic_add(volatile long long *counter, long long value)
+{
+#ifdef _MSC_VER
+    InterlockedExchangeAdd64(counter, value);
+#else
+    __atomic_fetch_add(counter, value, __ATOMIC_RELAXED);
+#endif
+}
+
+/**
+ * Finds the number of threads the kernels should use.
+ *
+ * returntype: int
+ * returns: The value of PIMP_THREADS if set, otherwise the number of
+ * processors available.
+ */
+static inline int thread_count(void)
+{
+    char *setting;
+    int threads = 0;
+
+    if ((setting = getenv("PIMP_THREADS")))
+        threads = atoi(setting);
+    if (threads < 1)
+    {
+#ifdef _WIN32
+        SYSTEM_INFO info;
+        GetSystemInfo(&info);
+        threads = info.dwNumberOfProcessors;
+#else
+        threads = sysconf(_SC_NPROCESSORS_ONLN);
+#endif
+    }
+    return threads < 1 ? 1 : threads;
+}
+
+/**
+ * Processes bands of a job until there are none left.
+ */
+static inline void band_worker(band_job *job)
+{
+    long band;
+    int start, end;
 
+    for(;;)
+    {
+#ifdef _MSC_VER
+        band = InterlockedIncrement(&job->next) - 1;
+#else
+        band = __atomic_fetch_add(&job->next, 1, __ATOMIC_RELAXED);
+#endif
+        start = band * job->bandSize;
+        if (start >= job->rows)
+            return;
+        if (job->progress && job->progress->cancel)
+        {
+            job->status = BANDS_CANCELLED;
+            return;
+        }
+        end = min(start + job->bandSize, job->rows);
+        if (job->function(job->args, start, end))
+            job->status = 1;
+        if (job->progress)
+            atomic_add(&job->progress->done, end - start);
+    }
+}
+
+#ifdef _WIN32
+static inline DWORD WINAPI band_thread(LPVOID job)
+{
+    band_worker((band_job*)job);
+    return 0;
+}
+#else
+static inline void *band_thread(void *job)
+{
+    band_worker((band_job*)job);
+    return NULL;
+}
+#endif
+
+/**
+ * Splits rows 0 up to (not including) rows into bands and processes them with
+ * function, using as many threads as thread_count() allows. This does not
+ * touch any python objects, so the GIL can (and should) be released around
+ * calls to it.
+ *
+ * Parameters:
+ *     function : band_function
+ *         The function which processes a band of rows.
+ *     args : void*
+ *         The argument structure passed to function.
+ *     rows : int
+ *         The number of rows to be processed.
+ *     rowSize : Py_ssize_t
+ *         The number of bytes in a row, used to decide whether threading is
+ *         worth it for this job.
+ *
+ * returntype: int
+ * returns: 0 on success, BANDS_CANCELLED if the calling thread's progress
+ *     counter was cancelled, or another non-zero value if function failed for
+ *     any of the bands. band_error sets the matching exception.
+ */
+static inline int run_bands(band_function function, void *args, int rows,
+        Py_ssize_t rowSize)
+{
+    band_job job;
+    int threads, started, i;
+#ifdef _WIN32
+    HANDLE *handles;
+#else
+    pthread_t *handles;
+#endif
+
+    if (rows <= 0)
+        return 0;
+
+    job.progress = progress_functions ? progress_functions->get_progress() :
+        NULL;
+    if (job.progress)
+    {
+        if (job.progress->cancel)
+            return BANDS_CANCELLED;
+        atomic_add(&job.progress->total, rows);
+    }
+
+    threads = thread_count();
+    if (threads > rows)
+        threads = rows;
+    if ((Py_ssize_t)rows * rowSize < MINIMUM_THREADED_BYTES)
+        threads = 1;
+    handles = NULL;
+    if (threads > 1)
+        handles = malloc(sizeof(*handles) * threads);
+    if (!handles)
+    {
+        threads = 1;
+        // without a counter the job doesn't need to be split up at all.
+        if (!job.progress)
+            return function(args, 0, rows);
+    }
+
+    job.function = function;
+    job.args = args;
+    job.rows = rows;
+    // a few bands per thread evens out threads that get less processor time
+    job.bandSize = rows / (threads * 4);
+    // and progress is reported at least every PROGRESS_STEPS of the job.
+    if (job.progress && job.bandSize > rows / PROGRESS_STEPS)
+        job.bandSize = rows / PROGRESS_STEPS;
+    if (job.bandSize < 1)
+        job.bandSize = 1;
+    job.next = 0;
+    job.status = 0;
+
+    // start the extra threads, this thread does its share of the work too.
+    for (started = 0; started < threads - 1; started++)
+    {
+#ifdef _WIN32
+        if (!(handles[started] =
+                    CreateThread(NULL, 0, band_thread, &job, 0, NULL)))
+            break;
+#else
+        if (pthread_create(&handles[started], NULL, band_thread, &job))
+            break;
+#endif
+    }
+    band_worker(&job);
+    if (!handles)
+        return job.status;
+    for (i = 0; i < started; i++)
+    {
+#ifdef _WIN32
+        WaitForSingleObject(handles[i], INFINITE);
+        CloseHandle(handles[i]);
+#else
+        pthread_join(handles[i], NULL);
+#endif
+    }
+    free(handles);
+
+    return job.status;
+}
+
+// ================================= BUFFERS ===================================
+// Kernels read image data from any object supporting the buffer protocol
+// (bytes, bytearray, memoryview, mmap, NumPy arrays...) and write their result
+// into the buffer passed as the out keyword, or into a new bytearray if none
+// is given. The contract every kernel follows:
+//  - data is never modified, unless it is also passed as out.
+//  - data and out must be C contiguous buffers of unsigned bytes. Their shape
+//    doesn't matter, a (height, width, channels) array is fine.
+//  - out must be writable and exactly the size of the result.
+//  - Kernels which compute each pixel from that pixel alone (table,
+//    swap_channels, the color functions, invert and the equalizing pass of
+//    histogram_eq) can work in place: out may be data.
+//  - Kernels which read the neighbors of a pixel or change the image size
+//    (spatial, median_filter, nintendize, quick_scale, the channel
+//    conversions) raise ValueError if out shares any memory with data.
+//  - The result is returned as (width, height, out).
+// These functions use the python API, so Python.h must be included first.
+
+/**
+ * Checks that the format of a buffer is unsigned bytes.
+ *
+ * Parameters:
+ *     view : Py_buffer*
+ *         A buffer requested with PyBUF_FORMAT.
+ *
+ * returntype: int
+ * returns: 1 if it is, otherwise 0 with a TypeError set.
+ */
+static inline int check_bytes(Py_buffer *view)
+{
+    const char *format = view->format;
+
+    // a byte order mark makes no difference to single bytes
+    if (format && strchr("@=<>!", *format))
+        format++;
+    if (!format || !strcmp(format, "B") || !strcmp(format, "c"))
+        return 1;
+    PyErr_Format(PyExc_TypeError, "Image data must be unsigned bytes "
+            "(uint8), not '%s'", view->format);
+    return 0;
+}
+
+/**
+ * A PyArg_Parse converter ("O&") for the image data passed to a kernel. It
+ * accepts any C contiguous buffer of unsigned bytes, such as bytes, a
+ * bytearray, an mmap or a NumPy uint8 array of any shape (e.g. (height,
+ * width, channels)), without copying it. Like "y*", the buffer must be
+ * released with PyBuffer_Release.
+ */
+static inline int image_data(PyObject *object, Py_buffer *view)
+{
+    // called with NULL to clean up when a later argument fails to parse
+    if (!object)
+    {
+        PyBuffer_Release(view);
+        return 1;
+    }
+    if (PyObject_GetBuffer(object, view, PyBUF_C_CONTIGUOUS | PyBUF_FORMAT))
+        return 0;
+    if (!check_bytes(view))
+    {
+        PyBuffer_Release(view);
+        return 0;
+    }
+    return Py_CLEANUP_SUPPORTED;
+}
+
+/**
+ * Gets the buffer the result of a kernel is written to.
+ *
+ * Parameters:
+ *     out : PyObject*
+ *         The buffer passed in by the caller, or NULL/None to create a new
+ *         bytearray.
+ *     length : Py_ssize_t
+ *         The number of bytes the result needs.
+ *     view : Py_buffer*
+ *         Filled in with the writable memory of the result. It must be
+ *         released with PyBuffer_Release.
+ *
+ * returntype: PyObject*
+ * returns: A new reference to the object holding the result, or NULL with an
+ *     exception set.
+ */
+static inline PyObject *get_output(PyObject *out, Py_ssize_t length,
+        Py_buffer *view)
+{
+    PyObject *result;
+
+    if (out && out != Py_None)
+    {
+        Py_INCREF(out);
+        result = out;
+    }
+    else if (!(result = PyByteArray_FromStringAndSize(NULL, length)))
+        return NULL;
+
+    if (PyObject_GetBuffer(result, view,
+                PyBUF_WRITABLE | PyBUF_C_CONTIGUOUS | PyBUF_FORMAT))
+    {
+        Py_DECREF(result);
+        return NULL;
+    }
+    if (!check_bytes(view))
+    {
+        PyBuffer_Release(view);
+        Py_DECREF(result);
+        return NULL;
+    }
+    if (view->len != length)
+    {
+        PyErr_Format(PyExc_ValueError, "The output buffer must be %zd bytes, "
+                "%zd recieved", length, view->len);
+        PyBuffer_Release(view);
+        Py_DECREF(result);
+        return NULL;
+    }
+    return result;
+}
+
+/**
+ * Checks whether two buffers share any memory. Kernels which read the
+ * neighbors of a pixel can't write their result over their input.
+ *
+ * returntype: int
+ * returns: non-zero if the buffers overlap.
+ */
+static inline int buffers_overlap(Py_buffer *a, Py_buffer *b)
+{
+    char *aStart = a->buf, *bStart = b->buf;
+
+    return aStart < bStart + b->len && bStart < aStart + a->len;
+}
+
+#endif // CORE_H
@@ -3,6 +3,7 @@
 #include <Python.h>
 #include <stdlib.h>
 #include <stdio.h>
+#include "core.h"
 
 const static char __doc__[] =
 "histogram_eq.c\n"
@@ -35,15 +36,77 @@ const static char execute__doc__[] =
 "        The width of the image in pixels\n"
 "    height : int\n"
 "        The height of the image in pixels\n"
-"    data : string\n"
-"        The data as a binary string.\n"
+"    data : buffer\n"
+"        The image data as bytes, a bytearray or any other buffer.\n"
+"    out : buffer\n"
+"        An optional writable buffer the same size as data to write the result "
+        "into. This may be data itself.\n"
 "\n"
 ":rtype: tuple\n"
-":returns: a tuple containing a width, height, and data as a binary string.\n";
+":returns: a tuple containing a width, height, and data. data is out if it was "
+    "passed in, otherwise a new bytearray.\n";
 
-PyObject *execute(PyObject *pself, PyObject *pArgs)
+typedef struct {
+    unsigned char *data, *newData;
+    int width, channels;
+    unsigned long long *histogram_table;
+    unsigned char *histogram_sum;
+} histogram_args;
+
+/**
+ * Counts the number of greyscale pixels of each value in a band of rows.
+ */
+int count_band(void *pArgs, int start, int end)
+{
+    histogram_args *args = pArgs;
+    unsigned char *data = args->data;
+    unsigned long long histogram_table[256] = {0};
+    Py_ssize_t i, last;
+
+    last = (Py_ssize_t)end * args->width * args->channels;
+    for (i = (Py_ssize_t)start * args->width * args->channels; i < last;
+            i += args->channels)
+    {
+        histogram_table[(1 + data[i] + data[i+1] + data[i+2]) / 3 ]++;
+    }
+    // add this band's counts to the totals
+    for (i=0; i < 256; i++)
+    {
+        if (histogram_table[i])
+            atomic_add((volatile long long*)&args->histogram_table[i],
+                    histogram_table[i]);
+    }
+    return 0;
+}
+
+/**
+ * Converts a band of rows using the histogram table.
+ */
+int equalize_band(void *pArgs, int start, int end)
+{
+    histogram_args *args = pArgs;
+    unsigned char *data = args->data, *newData = args->newData;
+    unsigned char *histogram_sum = args->histogram_sum;
+    Py_ssize_t i, last;
+
+    last = (Py_ssize_t)end * args->width * args->channels;
+    for (i = (Py_ssize_t)start * args->width * args->channels; i < last;
+            i += args->channels)
+    {
+        newData[i  ] = histogram_sum[data[i  ]];
+        newData[i+1] = histogram_sum[data[i+1]];
+        newData[i+2] = histogram_sum[data[i+2]];
+        if (args->channels == 4)
+            newData[i+3] = data[i+3];
+    }
+    return 0;
+}
+
+PyObject *execute(PyObject *pself, PyObject *pArgs, PyObject *kwArgs)
 {
-    unsigned char *data;
+    static char *keywords[] = {"width", "height", "data", "out", NULL};
+    Py_buffer buffer, outBuffer;
+    PyObject *out = NULL, *result;
     unsigned int width, height;
     Py_ssize_t dataLen;
     unsigned char channels;
@@ -52,35 +115,58 @@ PyObject *execute(PyObject *pself, PyObject *pArgs)
     unsigned int i;
     float pixelcount;
     unsigned long long *histogram_table;
+    histogram_args args;
+    int status;
 
     // convert the passed in python argument to C types.
-    if (!PyArg_ParseTuple(pArgs, "iiy#", &width, &height, &data, &dataLen))
+    if (!PyArg_ParseTupleAndKeywords(pArgs, kwArgs, "iiO&|O", keywords,
+                &width, &height, image_data, &buffer, &out))
         return NULL;
 
+    dataLen = buffer.len;
     channels = dataLen / (width * height);
     if ((channels < 3) || (channels > 4))
     {
          PyErr_Format(PyExc_ValueError, "Data contained an invalid number of "
                  "channels, 3 or 4 expected, %d recieved (width: %d, "
                  "height: %d, bytes: %d)", channels, width, height, dataLen);
+         PyBuffer_Release(&buffer);
          return NULL;
     }
 
     // allocate memory
-    if (!(histogram_sum    = malloc(256 * sizeof(char))) ||
-         !(histogram_table  = calloc(256, sizeof(long long))))
+    histogram_sum = malloc(256 * sizeof(char));
+    histogram_table = calloc(256, sizeof(long long));
+    if (!histogram_sum || !histogram_table)
     {
+         free(histogram_sum);
+         free(histogram_table);
+         PyBuffer_Release(&buffer);
          PyErr_SetString(PyExc_MemoryError, "Memory could not be allocated to "
                  "create histogram tables");
          return NULL;
     }
 
-    // count the number of greyscale pixels of each value (0 - 255)
-    for (i=0; i <= (dataLen - channels); i+=channels)
+    if (!(result = get_output(out, dataLen, &outBuffer)))
     {
-        histogram_table[(1 + data[i] + data[i+1] + data[i+2]) / 3 ]++;
+        free(histogram_sum);
+        free(histogram_table);
+        PyBuffer_Release(&buffer);
+        return NULL;
     }
 
+    args.data = buffer.buf;
+    args.newData = outBuffer.buf;
+    args.width = width;
+    args.channels = channels;
+    args.histogram_table = histogram_table;
+    args.histogram_sum = histogram_sum;
+
+    // count the number of greyscale pixels of each value (0 - 255)
+    Py_BEGIN_ALLOW_THREADS
+    status = run_bands(count_band, &args, height, width * channels);
+    Py_END_ALLOW_THREADS
+
     // build a histogram table
     pixelcount = width * height;
     histogram_sum[0] = (histogram_table[0] * 255 / pixelcount);
@@ -90,21 +176,30 @@ PyObject *execute(PyObject *pself, PyObject *pArgs)
             histogram_table[i] * 255 / pixelcount + histogram_sum[i-1];
     }
 
-    // convert the image using the histogram table
-    for (i=0; i < dataLen-channels+1; i+=channels)
+    // convert the image using the histogram table. All of the counting is
+    // done, so this can safely write over the original data.
+    if (!status)
     {
-        data[i  ] = histogram_sum[data[i  ]];
-        data[i+1] = histogram_sum[data[i+1]];
-        data[i+2] = histogram_sum[data[i+2]];
+        Py_BEGIN_ALLOW_THREADS
+        status = run_bands(equalize_band, &args, height, width * channels);
+        Py_END_ALLOW_THREADS
     }
 
 
     // free all used memory
     free(histogram_table);
     free(histogram_sum);
+    PyBuffer_Release(&buffer);
+    PyBuffer_Release(&outBuffer);
+
+    if (status)
+    {
+        Py_DECREF(result);
+        return band_error(status, "Memory could not be allocated");
+    }
 
     // Build and return a python tuple.
-    return Py_BuildValue("(iiy#)", width, height, data, dataLen);
+    return Py_BuildValue("(iiN)", width, height, result);
 
 
 }
@@ -112,7 +207,8 @@ PyObject *execute(PyObject *pself, PyObject *pArgs)
 // map of function names to functions
 static PyMethodDef methods[] =
 {
-    {"execute", execute, METH_VARARGS, execute__doc__},
+    {"execute", (PyCFunction)execute, METH_VARARGS | METH_KEYWORDS,
+        execute__doc__},
     {NULL, NULL} // End of functions
 };
 
@@ -127,6 +223,11 @@ static struct PyModuleDef histogram_eq_module = {
 PyMODINIT_FUNC PyInit_histogram_eq(void)
 {
     PyObject *m = PyModule_Create(&histogram_eq_module);
+    if (!m || import_progress())
+    {
+        Py_XDECREF(m);
+        return NULL;
+    }
     PyModule_AddStringConstant(m, "MENU", "Fil&ter");
     PyModule_AddStringConstant(m, "LABEL", "&Equalize Histogram");
     PyModule_AddStringConstant(m, "DESCRIPTION",
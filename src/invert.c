@@ -3,6 +3,7 @@
 #include <Python.h>
 #include <stdlib.h>
 #include <stdio.h>
+#include "core.h"
 
 const static char __doc__[] =
 "invert.c\n"
@@ -36,50 +37,100 @@ const static char execute__doc__[] =
 "        The width of the image in pixels\n"
 "    height : int\n"
 "        The height of the image in pixels\n"
-"    data : string\n"
-"        The data as a binary string.\n"
+"    data : buffer\n"
+"        The image data as bytes, a bytearray or any other buffer.\n"
+"    out : buffer\n"
+"        An optional writable buffer the same size as data to write the result "
+        "into. This may be data itself.\n"
 "\n"
 ":rtype: tuple\n"
 ":returns: A tuple (width, height, data). Width and height are in pixels, "
-    "data is a string containing binary data for the image.\n";
+    "data is out if it was passed in, otherwise a new bytearray.\n";
 
-PyObject *invert_execute(PyObject *pself, PyObject *pArgs)
+typedef struct {
+    unsigned char *data, *newData;
+    int width, channels;
+} invert_args;
+
+int invert_band(void *pArgs, int start, int end)
+{
+    invert_args *args = pArgs;
+    unsigned char *data = args->data, *newData = args->newData;
+    Py_ssize_t i, last;
+
+    last = (Py_ssize_t)end * args->width * args->channels;
+    for (i = (Py_ssize_t)start * args->width * args->channels; i < last;
+            i += args->channels)
+    {
+        newData[i  ] = data[i  ] ^ 0xff;
+        newData[i+1] = data[i+1] ^ 0xff;
+        newData[i+2] = data[i+2] ^ 0xff;
+        if (args->channels == 4)
+            newData[i+3] = data[i+3];
+    }
+    return 0;
+}
+
+PyObject *invert_execute(PyObject *pself, PyObject *pArgs, PyObject *kwArgs)
 {
-    unsigned char *data;
-    unsigned int width, height, i;
+    static char *keywords[] = {"width", "height", "data", "out", NULL};
+    Py_buffer buffer, outBuffer;
+    PyObject *out = NULL, *result;
+    unsigned int width, height;
     Py_ssize_t dataLen;
     unsigned char channels;
+    invert_args args;
+    int status;
 
     // convert the passed in python argument to C types.
-    if (!PyArg_ParseTuple(pArgs, "iiy#", &width, &height, &data, &dataLen))
+    if (!PyArg_ParseTupleAndKeywords(pArgs, kwArgs, "iiO&|O", keywords,
+                &width, &height, image_data, &buffer, &out))
         return NULL;
 
+    dataLen = buffer.len;
     channels = dataLen / (width * height);
     if ((channels < 3) || (channels > 4))
     {
          PyErr_Format(PyExc_ValueError, "Data contained an invalid number of "
                  "channels, 3 or 4 expected, %d recieved (width: %d,"
                  "height: %d, bytes: %d)", channels, width, height, dataLen);
+         PyBuffer_Release(&buffer);
          return NULL;
     }
 
-    for (i=0; i < dataLen-channels; i+=channels)
+    if (!(result = get_output(out, dataLen, &outBuffer)))
     {
-        data[i  ] = data[i  ] ^ 0xff;
-        data[i+1] = data[i+1] ^ 0xff;
-        data[i+2] = data[i+2] ^ 0xff;
+        PyBuffer_Release(&buffer);
+        return NULL;
     }
 
+    args.data = buffer.buf;
+    args.newData = outBuffer.buf;
+    args.width = width;
+    args.channels = channels;
+    Py_BEGIN_ALLOW_THREADS
+    status = run_bands(invert_band, &args, height, width * channels);
+    Py_END_ALLOW_THREADS
+
+    PyBuffer_Release(&buffer);
+    PyBuffer_Release(&outBuffer);
+
+    if (status)
+    {
+        Py_DECREF(result);
+        return band_error(status, "Memory could not be allocated");
+    }
 
     // Build a python tuple and return it.
-    return Py_BuildValue("(iiy#)", width, height, data, dataLen);
+    return Py_BuildValue("(iiN)", width, height, result);
 
 }
 
 // map of function names to functions
 static PyMethodDef invert_methods[] =
 {
-    {"execute", invert_execute, METH_VARARGS, execute__doc__},
+    {"execute", (PyCFunction)invert_execute, METH_VARARGS | METH_KEYWORDS,
+        execute__doc__},
     {NULL, NULL} // End of functions
 };
 
@@ -94,6 +145,11 @@ static struct PyModuleDef invert_module = {
 PyMODINIT_FUNC PyInit_invert(void)
 {
     PyObject *m = PyModule_Create(&invert_module);
+    if (!m || import_progress())
+    {
+        Py_XDECREF(m);
+        return NULL;
+    }
     PyModule_AddStringConstant(m, "MENU", "Fil&ter");
     PyModule_AddStringConstant(m, "LABEL", "In&vert");
     PyModule_AddStringConstant(m, "DESCRIPTION",
@@ -0,0 +1,772 @@
+
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <stdlib.h>
+#include <string.h>
+#include <math.h>
+#include "core.h"
+
+const static char __doc__[] =
+"jpeg.c\n"
+"Copyright 2007 Thomas McGrew\n"
+"\n"
+"This file is part of The Python Image Manipulation Project.\n"
+"\n"
+"The Python Image Manipulation Project is free software: you can\n"
+"redistribute it and/or modify it under the terms of the GNU General\n"
+"Public License as published by the Free Software Foundation, either\n"
+"version 2 of the License, or (at your option) any later version.\n"
+"\n"
+"The Python Image Manipulation Project is distributed in the hope\n"
+"that it will be useful, but WITHOUT ANY WARRANTY; without even the\n"
+"implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR\n"
+"PURPOSE. See the GNU General Public License for more details.\n"
+"\n"
+"You should have received a copy of the GNU General Public License\n"
+"along with The Python Image Manipulation Project.  If not, see\n"
+"<http://www.gnu.org/licenses/>.\n"
+"\n"
+"A decoder for baseline (and extended sequential) Huffman coded JPEG files, "
+    "greyscale or with 3 color components, which can decode the image at "
+    "1/2, 1/4 or 1/8 of its size for little more than the cost of reading "
+    "the file.\n"
+"\n"
+"Each block of 8x8 DCT coefficients is turned into pixels with an inverse "
+    "DCT of the size the block covers in the result, using only the "
+    "coefficients that size can show: a 1/8 scale decode needs just the "
+    "average of each block. Subsampled color components are scaled up the "
+    "same way, so there is no separate upsampling step. The image is "
+    "decoded one row of MCUs at a time, straight into the result.\n";
+
+// the most components in a frame, and in a MCU
+#define MAX_COMPONENTS 3
+#define MAX_BLOCKS 10
+// the number of bits of a Huffman code looked up in a single table
+#define LOOKAHEAD 9
+// the largest number of samples a block is turned into in either direction,
+// a component subsampled 4 times decoded at full size.
+#define MAX_BLOCK_SIZE 32
+
+// markers
+#define SOF0 0xc0
+#define SOF1 0xc1
+#define DHT 0xc4
+#define RST0 0xd0
+#define RST7 0xd7
+#define SOI 0xd8
+#define EOI 0xd9
+#define SOS 0xda
+#define DQT 0xdb
+#define DRI 0xdd
+#define APP14 0xee
+
+// the position in a block of each coefficient, in the order they are stored
+static const unsigned char zigzag[64] = {
+     0,  1,  8, 16,  9,  2,  3, 10, 17, 24, 32, 25, 18, 11,  4,  5,
+    12, 19, 26, 33, 40, 48, 41, 34, 27, 20, 13,  6,  7, 14, 21, 28,
+    35, 42, 49, 56, 57, 50, 43, 36, 29, 22, 15, 23, 30, 37, 44, 51,
+    58, 59, 52, 45, 38, 31, 39, 46, 53, 60, 61, 54, 47, 55, 62, 63};
+
+static PyObject *Unsupported = NULL;
+
+typedef struct {
+    // (length << 8) | symbol for codes of up to LOOKAHEAD bits, indexed by
+    // the next LOOKAHEAD bits of the data, 0 for longer codes.
+    unsigned short lookup[1 << LOOKAHEAD];
+    // the largest code of each length, -1 if there are none
+    int maxcode[17];
+    // added to a code to find the index of its symbol
+    int offset[17];
+    unsigned char symbols[256];
+    int defined;
+} huffman_table;
+
+typedef struct {
+    int id, h, v;                  // the sampling factors
+    int quant, dc, ac;             // the tables used
+    int prediction;                // the last DC value
+    int blockWidth, blockHeight;   // the size of a block in the result
+    // the inverse DCT, the weight of each coefficient for each sample.
+    float across[MAX_BLOCK_SIZE * 8], down[MAX_BLOCK_SIZE * 8];
+    unsigned char *plane;          // the samples of a row of MCUs
+} component;
+
+typedef struct {
+    const unsigned char *data, *end;
+    unsigned long long bits;       // the bits read, the next in the highest
+    int count;                     // the number of bits in bits
+} bit_reader;
+
+typedef struct {
+    int width, height, components, restartInterval, rgb;
+    int maxH, maxV, scale;
+    unsigned short quant[4][64];   // in zigzag order
+    int quantDefined[4];
+    huffman_table dc[4], ac[4];
+    component component[MAX_COMPONENTS];
+    const unsigned char *scan, *end;
+    int outWidth, outHeight, planeWidth, planeHeight;
+} jpeg_decoder;
+
+/**
+ * Reads a 2 byte big endian number.
+ */
+static inline int read_short(const unsigned char *p)
+{
+    return p[0] << 8 | p[1];
+}
+
+/**
+ * Builds the lookup tables for a Huffman table.
+ *
+ * :Parameters:
+ *     table : huffman_table*
+ *         The table to fill in.
+ *     counts : unsigned char*
+ *         The number of codes of each length from 1 to 16 bits.
+ *     symbols : unsigned char*
+ *         The symbols, in order of their codes.
+ *
+ * :returntype: int
+ * :returns: 0 on success, -1 if the codes don't fit in 16 bits.
+ */
+static int build_huffman(huffman_table *table, const unsigned char *counts,
+        const unsigned char *symbols, int total)
+{
+    int length, i, fill, code = 0, k = 0;
+
+    memset(table->lookup, 0, sizeof(table->lookup));
+    memcpy(table->symbols, symbols, total);
+    for (length=1; length <= 16; length++)
+    {
+        table->offset[length] = k - code;
+        for (i=0; i < counts[length - 1]; i++, code++, k++)
+        {
+            if (code >= 1 << length)
+                return -1;
+            if (length <= LOOKAHEAD)
+                for (fill=0; fill < 1 << (LOOKAHEAD - length); fill++)
+                    table->lookup[code << (LOOKAHEAD - length) | fill] =
+                        length << 8 | symbols[k];
+        }
+        table->maxcode[length] = counts[length - 1] ? code - 1 : -1;
+        code <<= 1;
+    }
+    table->defined = 1;
+    return 0;
+}
+
+/**
+ * Fills the bit buffer with at least 57 bits. Stuffed zero bytes are
+ * skipped, and once a marker is reached zeros are read instead, so a
+ * truncated file decodes as grey rather than failing.
+ */
+static inline void fill_bits(bit_reader *reader)
+{
+    int byte;
+
+    while (reader->count <= 56)
+    {
+        byte = 0;
+        if (reader->data < reader->end)
+        {
+            byte = *reader->data;
+            if (byte != 0xff)
+                reader->data++;
+            else if (reader->data + 1 < reader->end && !reader->data[1])
+                reader->data += 2;
+            else
+                byte = 0;
+        }
+        reader->bits = reader->bits << 8 | byte;
+        reader->count += 8;
+    }
+}
+
+/**
+ * Reads a number of bits, up to 16.
+ */
+static inline int get_bits(bit_reader *reader, int count)
+{
+    if (reader->count < count)
+        fill_bits(reader);
+    reader->count -= count;
+    return (reader->bits >> reader->count) & ((1 << count) - 1);
+}
+
+/**
+ * Reads the difference encoded by a Huffman symbol: count bits, where
+ * values with a leading 0 are negative.
+ */
+static inline int get_value(bit_reader *reader, int count)
+{
+    int value;
+
+    if (!count)
+        return 0;
+    value = get_bits(reader, count);
+    if (value < 1 << (count - 1))
+        value += 1 - (1 << count);
+    return value;
+}
+
+/**
+ * Reads a Huffman coded symbol.
+ */
+static inline int get_symbol(bit_reader *reader, huffman_table *table)
+{
+    int entry, length, code;
+
+    if (reader->count < 16)
+        fill_bits(reader);
+    entry = table->lookup[(reader->bits >> (reader->count - LOOKAHEAD)) &
+        ((1 << LOOKAHEAD) - 1)];
+    if (entry)
+    {
+        reader->count -= entry >> 8;
+        return entry & 0xff;
+    }
+    code = (reader->bits >> (reader->count - 16)) & 0xffff;
+    for (length=LOOKAHEAD + 1; length <= 16; length++)
+    {
+        if ((code >> (16 - length)) <= table->maxcode[length])
+        {
+            reader->count -= length;
+            return table->symbols[(code >> (16 - length)) +
+                table->offset[length]];
+        }
+    }
+    // not a valid code, skip it.
+    reader->count -= 16;
+    return 0;
+}
+
+/**
+ * Builds the weights of an inverse DCT giving size samples from the 8
+ * coefficients of a block in one direction. Sizes under 8 only use the
+ * lowest frequencies, sizes over 8 interpolate between the samples.
+ */
+static void build_idct(float *weights, int size)
+{
+    int x, u;
+
+    for (x=0; x < size; x++)
+        for (u=0; u < 8; u++)
+            weights[x * 8 + u] = (u ? 0.5f : (float)M_SQRT1_2 / 2) *
+                (float)cos((2 * x + 1) * u * M_PI / (2 * size));
+}
+
+/**
+ * Turns a block of coefficients into samples.
+ *
+ * :Parameters:
+ *     coefficients : float*
+ *         The 64 coefficients in their natural order.
+ *     used : int
+ *         The number of columns (in the low 4 bits) and rows (in the high
+ *         bits) of coefficients which contain anything but 0.
+ *     c : component*
+ *         The component the block is part of.
+ *     out : unsigned char*
+ *         Where the top left sample is written.
+ *     stride : Py_ssize_t
+ *         The distance between rows of samples in out.
+ */
+static void idct_block(const float *coefficients, int used, component *c,
+        unsigned char *out, Py_ssize_t stride)
+{
+    int width = c->blockWidth, height = c->blockHeight;
+    int across = used & 15, down = used >> 4;
+    int x, y, u, v;
+    float sum, rows[8][MAX_BLOCK_SIZE];
+    const float *weights;
+
+    across = min(width, across);
+    down = min(height, down);
+    if (used == 0x11)
+    {
+        // only the average of the block
+        sum = coefficients[0] / 8 + 128.5f;
+        u = sum < 0 ? 0 : (sum > 255 ? 255 : (int)sum);
+        for (y=0; y < height; y++)
+            memset(out + y * stride, u, width);
+        return;
+    }
+
+    for (v=0; v < down; v++)
+    {
+        for (x=0; x < width; x++)
+        {
+            weights = c->across + x * 8;
+            sum = 0;
+            for (u=0; u < across; u++)
+                sum += coefficients[v * 8 + u] * weights[u];
+            rows[v][x] = sum;
+        }
+    }
+    for (y=0; y < height; y++)
+    {
+        weights = c->down + y * 8;
+        for (x=0; x < width; x++)
+        {
+            sum = 128.5f;
+            for (v=0; v < down; v++)
+                sum += rows[v][x] * weights[v];
+            out[y * stride + x] = sum < 0 ? 0 : (sum > 255 ? 255 : (int)sum);
+        }
+    }
+}
+
+/**
+ * Reads the markers before the first scan.
+ *
+ * :returntype: int
+ * :returns: 0 on success, otherwise -1 with an exception set.
+ */
+static int read_headers(jpeg_decoder *d, const unsigned char *p,
+        const unsigned char *end)
+{
+    int marker, length, i, j, precision, id, total, frame = 0;
+    const unsigned char *segment, *segmentEnd;
+    component *c;
+
+    if (end - p < 2 || p[0] != 0xff || p[1] != SOI)
+    {
+        PyErr_SetString(PyExc_ValueError, "Not a JPEG file");
+        return -1;
+    }
+    p += 2;
+    while (1)
+    {
+        // markers may be preceded by any number of 0xff bytes
+        while (p < end && *p != 0xff)
+            p++;
+        while (p < end && *p == 0xff)
+            p++;
+        if (p >= end)
+            break;
+        marker = *p++;
+        if (marker == SOI || (marker >= RST0 && marker <= RST7) || !marker)
+            continue;
+        if (marker == EOI)
+            break;
+        if (end - p < 2 || (length = read_short(p)) < 2 || end - p < length)
+            break;
+        segment = p + 2;
+        segmentEnd = p + length;
+        p = segmentEnd;
+
+        switch (marker)
+        {
+            case DQT:
+                while (segment < segmentEnd)
+                {
+                    precision = *segment >> 4;
+                    id = *segment++ & 15;
+                    if (id > 3 || segmentEnd - segment < (precision ? 128 : 64))
+                        goto corrupt;
+                    for (i=0; i < 64; i++)
+                        d->quant[id][i] = precision ?
+                            read_short(segment + i * 2) : segment[i];
+                    segment += precision ? 128 : 64;
+                    d->quantDefined[id] = 1;
+                }
+                break;
+
+            case DHT:
+                while (segment < segmentEnd)
+                {
+                    if (segmentEnd - segment < 17 || (*segment & 15) > 3 ||
+                            *segment >> 4 > 1)
+                        goto corrupt;
+                    for (i=0, total=0; i < 16; i++)
+                        total += segment[i + 1];
+                    if (total > 256 || segmentEnd - segment < 17 + total ||
+                            build_huffman(*segment >> 4 ? &d->ac[*segment & 15]
+                                : &d->dc[*segment & 15], segment + 1,
+                                segment + 17, total))
+                        goto corrupt;
+                    segment += 17 + total;
+                }
+                break;
+
+            case SOF0:
+            case SOF1:
+                if (segmentEnd - segment < 6)
+                    goto corrupt;
+                if (*segment != 8)
+                {
+                    PyErr_Format(Unsupported, "%d bit JPEG files are not "
+                            "supported", *segment);
+                    return -1;
+                }
+                d->height = read_short(segment + 1);
+                d->width = read_short(segment + 3);
+                d->components = segment[5];
+                if (!d->height)
+                {
+                    PyErr_SetString(Unsupported, "JPEG files with the height "
+                            "after the image (DNL) are not supported");
+                    return -1;
+                }
+                if (d->components != 1 && d->components != MAX_COMPONENTS)
+                {
+                    PyErr_Format(Unsupported, "JPEG files with %d components "
+                            "are not supported", d->components);
+                    return -1;
+                }
+                if (!d->width || segmentEnd - segment < 6 + d->components * 3)
+                    goto corrupt;
+                for (i=0; i < d->components; i++)
+                {
+                    c = &d->component[i];
+                    c->id = segment[6 + i * 3];
+                    c->h = segment[7 + i * 3] >> 4;
+                    c->v = segment[7 + i * 3] & 15;
+                    c->quant = segment[8 + i * 3];
+                    if (c->h < 1 || c->h > 4 || c->v < 1 || c->v > 4 ||
+                            c->quant > 3)
+                        goto corrupt;
+                }
+                frame = 1;
+                break;
+
+            case DRI:
+                if (segmentEnd - segment < 2)
+                    goto corrupt;
+                d->restartInterval = read_short(segment);
+                break;
+
+            case APP14:
+                // an Adobe marker says whether the colors are transformed
+                if (segmentEnd - segment >= 12 &&
+                        !memcmp(segment, "Adobe", 5))
+                    d->rgb = !segment[11];
+                break;
+
+            case SOS:
+                if (!frame || segment == segmentEnd)
+                    goto corrupt;
+                if (segment[0] != d->components)
+                {
+                    PyErr_SetString(Unsupported, "JPEG files with more than "
+                            "one scan are not supported");
+                    return -1;
+                }
+                if (segmentEnd - segment < 4 + d->components * 2)
+                    goto corrupt;
+                for (i=0; i < d->components; i++)
+                {
+                    id = segment[1 + i * 2];
+                    for (j=0; j < d->components; j++)
+                        if (d->component[j].id == id)
+                            break;
+                    // the components must be in the order of the frame
+                    if (j != i)
+                        goto corrupt;
+                    c = &d->component[j];
+                    c->dc = segment[2 + i * 2] >> 4;
+                    c->ac = segment[2 + i * 2] & 15;
+                    if (c->dc > 3 || c->ac > 3 || !d->dc[c->dc].defined ||
+                            !d->ac[c->ac].defined ||
+                            !d->quantDefined[c->quant])
+                        goto corrupt;
+                }
+                d->scan = segmentEnd;
+                d->end = end;
+                return 0;
+
+            default:
+                if (marker > SOF1 && marker <= 0xcf && marker != DHT &&
+                        marker != 0xc8 && marker != 0xcc)
+                {
+                    PyErr_SetString(Unsupported, "Only baseline and extended "
+                            "sequential Huffman coded JPEG files are "
+                            "supported");
+                    return -1;
+                }
+        }
+    }
+
+corrupt:
+    PyErr_SetString(PyExc_ValueError, "The JPEG file is corrupt or truncated");
+    return -1;
+}
+
+/**
+ * Converts a row of MCUs to RGB.
+ */
+static void convert_rows(jpeg_decoder *d, unsigned char *out, int rows)
+{
+    int x, y, luma, blue, red;
+    unsigned char *a, *b, *c;
+
+    for (y=0; y < rows; y++, out += (Py_ssize_t)d->outWidth * 3)
+    {
+        a = d->component[0].plane + (Py_ssize_t)y * d->planeWidth;
+        if (d->components == 1)
+        {
+            for (x=0; x < d->outWidth; x++)
+                out[x * 3] = out[x * 3 + 1] = out[x * 3 + 2] = a[x];
+            continue;
+        }
+        b = d->component[1].plane + (Py_ssize_t)y * d->planeWidth;
+        c = d->component[2].plane + (Py_ssize_t)y * d->planeWidth;
+        if (d->rgb)
+        {
+            for (x=0; x < d->outWidth; x++)
+            {
+                out[x * 3] = a[x];
+                out[x * 3 + 1] = b[x];
+                out[x * 3 + 2] = c[x];
+            }
+            continue;
+        }
+        // YCbCr, with 16 bits of fraction
+        for (x=0; x < d->outWidth; x++)
+        {
+            luma = a[x] << 16 | 0x8000;
+            blue = b[x] - 128;
+            red = c[x] - 128;
+            out[x * 3] = clip((luma + 91881 * red) >> 16);
+            out[x * 3 + 1] = clip((luma - 22554 * blue - 46802 * red) >> 16);
+            out[x * 3 + 2] = clip((luma + 116130 * blue) >> 16);
+        }
+    }
+}
+
+/**
+ * Decodes the scan into the result. No python functions are called, so this
+ * runs without the GIL.
+ */
+static void decode_scan(jpeg_decoder *d, unsigned char *out)
+{
+    bit_reader reader;
+    component *c;
+    float coefficients[64];
+    int mcusAcross, mcusDown, mcuX, mcuY, i, bx, by, k, symbol, used, todo;
+    int across, down;
+    int rows;
+    unsigned short *quant;
+
+    mcusAcross = (d->width + 8 * d->maxH - 1) / (8 * d->maxH);
+    mcusDown = (d->height + 8 * d->maxV - 1) / (8 * d->maxV);
+    reader.data = d->scan;
+    reader.end = d->end;
+    reader.bits = 0;
+    reader.count = 0;
+    todo = d->restartInterval;
+
+    for (mcuY=0; mcuY < mcusDown; mcuY++)
+    {
+        for (mcuX=0; mcuX < mcusAcross; mcuX++)
+        {
+            if (d->restartInterval && !todo--)
+            {
+                // skip to the restart marker and start afresh
+                reader.count = 0;
+                while (reader.data + 1 < reader.end &&
+                        !(reader.data[0] == 0xff && reader.data[1] >= RST0 &&
+                            reader.data[1] <= RST7))
+                    reader.data++;
+                if (reader.data + 1 < reader.end)
+                    reader.data += 2;
+                for (i=0; i < d->components; i++)
+                    d->component[i].prediction = 0;
+                todo = d->restartInterval - 1;
+            }
+
+            for (i=0; i < d->components; i++)
+            {
+                c = &d->component[i];
+                quant = d->quant[c->quant];
+                for (by=0; by < c->v; by++)
+                {
+                    for (bx=0; bx < c->h; bx++)
+                    {
+                        memset(coefficients, 0, sizeof(coefficients));
+                        symbol = get_symbol(&reader, &d->dc[c->dc]);
+                        c->prediction += get_value(&reader, symbol & 15);
+                        coefficients[0] = (float)c->prediction * quant[0];
+                        used = 0x11;
+                        for (k=1; k < 64; k++)
+                        {
+                            symbol = get_symbol(&reader, &d->ac[c->ac]);
+                            if (!(symbol & 15))
+                            {
+                                if (symbol != 0xf0)
+                                    break;
+                                k += 15;
+                                continue;
+                            }
+                            k += symbol >> 4;
+                            if (k > 63)
+                                break;
+                            coefficients[zigzag[k]] = (float)get_value(
+                                    &reader, symbol & 15) * quant[k];
+                            across = (zigzag[k] & 7) + 1;
+                            down = (zigzag[k] >> 3) + 1;
+                            if (across > (used & 15))
+                                used = (used & ~15) | across;
+                            if (down > used >> 4)
+                                used = (used & 15) | down << 4;
+                        }
+                        idct_block(coefficients, used, c, c->plane +
+                                (Py_ssize_t)by * c->blockHeight *
+                                d->planeWidth + (Py_ssize_t)(mcuX * c->h +
+                                    bx) * c->blockWidth, d->planeWidth);
+                    }
+                }
+            }
+        }
+
+        rows = min(d->planeHeight, d->outHeight - mcuY * d->planeHeight);
+        convert_rows(d, out + (Py_ssize_t)mcuY * d->planeHeight *
+                d->outWidth * 3, rows);
+    }
+}
+
+const static char decode__doc__[] =
+"Decodes a JPEG file.\n"
+"\n"
+":Parameters:\n"
+"    data : buffer\n"
+"        The contents of the file.\n"
+"    scale : int\n"
+"        1, 2, 4 or 8, the image is decoded at 1/scale of its size (rounded "
+        "up). Defaults to 1.\n"
+"\n"
+":rtype: tuple\n"
+":returns: A tuple (width, height, data). Width and height are in pixels, "
+    "data is a new bytearray with the red, green and blue of each pixel.\n"
+"\n"
+":raises Unsupported: for JPEG files this decoder can't read, e.g. "
+    "progressive ones.\n"
+":raises ValueError: if the file is corrupt.\n";
+
+PyObject *decode(PyObject *self, PyObject *pArgs, PyObject *kwArgs)
+{
+    static char *keywords[] = {"data", "scale", NULL};
+    Py_buffer buffer;
+    int scale = 1, i, blocks = 0;
+    jpeg_decoder *d;
+    component *c;
+    PyObject *result = NULL;
+
+    if (!PyArg_ParseTupleAndKeywords(pArgs, kwArgs, "O&|i", keywords,
+                image_data, &buffer, &scale))
+        return NULL;
+    if (scale != 1 && scale != 2 && scale != 4 && scale != 8)
+    {
+        PyErr_SetString(PyExc_ValueError, "The scale must be 1, 2, 4 or 8");
+        PyBuffer_Release(&buffer);
+        return NULL;
+    }
+    if (!(d = calloc(1, sizeof(*d))))
+    {
+        PyBuffer_Release(&buffer);
+        return PyErr_NoMemory();
+    }
+    if (read_headers(d, buffer.buf, (unsigned char *)buffer.buf + buffer.len))
+        goto done;
+
+    // a scan of a single component has one block in each MCU
+    if (d->components == 1)
+        d->component[0].h = d->component[0].v = 1;
+    for (i=0; i < d->components; i++)
+    {
+        d->maxH = max(d->maxH, d->component[i].h);
+        d->maxV = max(d->maxV, d->component[i].v);
+    }
+    d->scale = scale;
+    d->outWidth = (d->width + scale - 1) / scale;
+    d->outHeight = (d->height + scale - 1) / scale;
+    d->planeWidth = (d->width + 8 * d->maxH - 1) / (8 * d->maxH) * 8 *
+        d->maxH / scale;
+    d->planeHeight = 8 * d->maxV / scale;
+    for (i=0; i < d->components; i++)
+    {
+        c = &d->component[i];
+        blocks += c->h * c->v;
+        if (d->maxH % c->h || d->maxV % c->v)
+        {
+            PyErr_SetString(Unsupported, "JPEG files with this chroma "
+                    "subsampling are not supported");
+            goto done;
+        }
+        c->blockWidth = 8 / scale * (d->maxH / c->h);
+        c->blockHeight = 8 / scale * (d->maxV / c->v);
+        build_idct(c->across, c->blockWidth);
+        build_idct(c->down, c->blockHeight);
+    }
+    if (blocks > MAX_BLOCKS)
+        goto corrupt;
+
+    if (!(result = PyByteArray_FromStringAndSize(NULL,
+                    (Py_ssize_t)d->outWidth * d->outHeight * 3)))
+        goto done;
+    for (i=0; i < d->components; i++)
+    {
+        if (!(d->component[i].plane = malloc((Py_ssize_t)d->planeWidth *
+                        d->planeHeight)))
+        {
+            Py_CLEAR(result);
+            PyErr_NoMemory();
+            goto done;
+        }
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    decode_scan(d, (unsigned char *)PyByteArray_AS_STRING(result));
+    Py_END_ALLOW_THREADS
+    goto done;
+
+corrupt:
+    PyErr_SetString(PyExc_ValueError, "The JPEG file is corrupt");
+
+done:
+    for (i=0; i < MAX_COMPONENTS; i++)
+        free(d->component[i].plane);
+    PyBuffer_Release(&buffer);
+    if (result)
+        result = Py_BuildValue("(iiN)", d->outWidth, d->outHeight, result);
+    free(d);
+    return result;
+}
+
+// map of function names to functions
+static PyMethodDef jpeg_methods[] =
+{
+    {"decode", (PyCFunction)decode, METH_VARARGS | METH_KEYWORDS,
+        decode__doc__},
+    {NULL, NULL} // End of functions
+};
+
+static struct PyModuleDef jpeg_module = {
+    PyModuleDef_HEAD_INIT,
+    "jpeg",
+    __doc__,
+    -1,
+    jpeg_methods
+};
+
+PyMODINIT_FUNC PyInit_jpeg(void)
+{
+    PyObject *m = PyModule_Create(&jpeg_module);
+
+    if (!m)
+        return NULL;
+    if (!Unsupported)
+        Unsupported = PyErr_NewExceptionWithDoc(
+                "extensions.lib.jpeg.Unsupported",
+                "Raised for JPEG files which are valid, but use features this "
+                "decoder doesn't have.", PyExc_ValueError, NULL);
+    Py_XINCREF(Unsupported);
+    if (!Unsupported || PyModule_AddObject(m, "Unsupported", Unsupported))
+    {
+        Py_XDECREF(Unsupported);
+        Py_DECREF(m);
+        return NULL;
+    }
+    return m;
+}
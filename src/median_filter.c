@@ -1,6 +1,7 @@
 
 #define PY_SSIZE_T_CLEAN
 #include <Python.h>
+#include "core.h"
 
 const static char __doc__[] =
 "median_filter.c\n"
@@ -22,69 +23,58 @@ const static char __doc__[] =
 "along with The Python Image Manipulation Project.  If not, see\n"
 "<http://www.gnu.org/licenses/>.\n";
 
+// the histograms are searched 16 values at a time before looking at the
+// individual values within the matching coarse bin.
+#define COARSE_BINS 16
+
 /**
- * Optimized selection sort algorithm. This function only sorts as many
- * values as are required by the caller. For the median function, this is
- * slightly more than half, thus speeding up processing significantly.
+ * Finds the value with the given rank in a sliding histogram.
  *
  * :Parameters:
- *     valueList : char*
- *        The list of values to be sorted
- *     valueListLength : int
- *        The number of elements in the list
- *     valuesNeeded : int
- *        The number of values that need to be sorted
+ *     fine : int*
+ *         A 256 bin histogram of the values in the window
+ *     coarse : int*
+ *         A 16 bin histogram of the values in the window, where each bin
+ *         holds the total of 16 consecutive fine bins
+ *     rank : int
+ *         The number of values in the window which are smaller than, or
+ *         come before, the value to be found.
  *
- * :returntype: void
+ * :returntype: int
+ * :returns: The value with the requested rank.
  */
-void sort(unsigned char *valueList, int valueListLength, int valuesNeeded)
+static int findRank(int *fine, int *coarse, int rank)
 {
-    // selection sort
-    int i, j, lowest, tmp;
-
-    if (valuesNeeded == 0)
-    {
-        valuesNeeded = valueListLength - 1;
-    }
+    int i, value;
 
-    for (i=0; i <= valuesNeeded; i++)
-    {
-        lowest = i;
-        for (j=i+1; j < valueListLength; j++)
-        {
-            if (valueList[j] < valueList[lowest])
-                lowest = j;
-       }
-        tmp = valueList[lowest];
-        valueList[lowest] = valueList[i];
-        valueList[i] = tmp;
-    }
+    for (i=0; rank >= coarse[i]; i++)
+        rank -= coarse[i];
+    for (value=i * COARSE_BINS; rank >= fine[value]; value++)
+        rank -= fine[value];
+    return value;
 }
 
 /**
- * Finds the median value in a list of characters (bytes)
+ * Finds the median value in a sliding histogram. For windows containing an
+ * even number of values the two middle values are averaged.
  *
  * :Parameters:
- *     valueList : char*
- *         The list of values to find the median of
- *     valueListLength : int
- *        The lenghth of the above list
+ *     fine : int*
+ *         A 256 bin histogram of the values in the window
+ *     coarse : int*
+ *         The 16 bin coarse histogram of the values in the window
+ *     count : int
+ *         The number of values in the window
  *
  * :returntype: int
- * :returns: The median of the values contained in the list.
+ * :returns: The median of the values contained in the histogram.
  */
-int findMedian(unsigned char *valueList, int valueListLength)
+static int findMedian(int *fine, int *coarse, int count)
 {
-    int valuesNeeded;
-
-    valuesNeeded = (valueListLength >> 1) + 1;
-
-
-    sort(valueList, valueListLength, valuesNeeded);
-    if (valueListLength & 1)
-        return valueList[valuesNeeded - 1];
-    return (valueList[valuesNeeded - 2] + valueList[valuesNeeded - 1]) >> 1;
-
+    if (count & 1)
+        return findRank(fine, coarse, count >> 1);
+    return (findRank(fine, coarse, (count >> 1) - 1) +
+            findRank(fine, coarse, count >> 1)) >> 1;
 }
 
 const static char median_filter__doc__[] =
@@ -98,30 +88,114 @@ const static char median_filter__doc__[] =
 "        The width of the image in pixels\n"
 "    height : int\n"
 "        The height of the image in pixels\n"
-"    data : string\n"
-"        The data as a binary string.\n"
+"    data : buffer\n"
+"        The image data as bytes, a bytearray or any other buffer.\n"
+"    size : int\n"
+"        The width and height of the square of pixels the median is taken "
+        "from. Defaults to 3.\n"
+"    out : buffer\n"
+"        An optional writable buffer the same size as data to write the result "
+        "into. It may not share memory with data.\n"
 "\n"
 ":rtype: tuple\n"
 ":returns: A tuple (width, height, data). Width and height are in pixels, "
-    "data is a string containing binary image data.\n";
+    "data is out if it was passed in, otherwise a new bytearray.\n";
 
-PyObject *median_filter(PyObject *pself, PyObject *pArgs)
+typedef struct {
+    unsigned char *data, *newData;
+    int width, channels, size;
+} median_args;
+
+/**
+ * Applies the median filter to a band of rows, counted from the first row
+ * which is not part of the padding.
+ *
+ * Each row is processed with a sliding histogram (Huang's algorithm). The
+ * histogram is filled from the window of the first pixel, and as the window
+ * moves right one column of values is removed and one is added, so the cost
+ * per pixel grows with the filter size rather than the filter area.
+ */
+int median_band(void *pArgs, int start, int end)
 {
-    int i, j, k, m, position; // for loop variables
+    median_args *args = pArgs;
+    int i, j, m, c; // for loop variables
+    Py_ssize_t k, rowLength;
+    unsigned char *column;
+    int size = args->size;
+    int channels = args->channels;
+    int padding = size / 2;
+    int count = size * size;
+    int fine[3][256], coarse[3][COARSE_BINS];
+
+    rowLength = (Py_ssize_t)args->width * channels;
+    for (j=start + padding; j < end + padding; j++)
+    {
+        memset(fine, 0, sizeof(fine));
+        memset(coarse, 0, sizeof(coarse));
+
+        // fill the histogram with the window for the first pixel in the row
+        column = args->data + (j - padding) * rowLength;
+        for (i=0; i < size; i++)
+        {
+            for (m=0; m < size; m++)
+            {
+                for (c=0; c < 3; c++)
+                {
+                    fine[c][column[m * rowLength + c]]++;
+                    coarse[c][column[m * rowLength + c] >> 4]++;
+                }
+            }
+            column += channels;
+        }
+
+        for (i=padding; i < args->width - padding; i++)
+        {
+            k = i * channels + j * rowLength;
+            for (c=0; c < 3; c++)
+                args->newData[k + c] = findMedian(fine[c], coarse[c], count);
+
+            if (i + 1 >= args->width - padding)
+                break;
+
+            // slide the window one column to the right
+            column = args->data + (j - padding) * rowLength +
+                (Py_ssize_t)(i - padding) * channels;
+            for (m=0; m < size; m++)
+            {
+                for (c=0; c < 3; c++)
+                {
+                    fine[c][column[m * rowLength + c]]--;
+                    coarse[c][column[m * rowLength + c] >> 4]--;
+                    fine[c][column[m * rowLength + size * channels + c]]++;
+                    coarse[c][column[m * rowLength + size * channels + c]
+                        >> 4]++;
+                }
+            }
+        }
+    }
+
+    return 0;
+}
+
+PyObject *median_filter(PyObject *pself, PyObject *pArgs, PyObject *kwArgs)
+{
+    static char *keywords[] = {"width", "height", "data", "size", "out",
+        NULL};
     int width, height;
     Py_ssize_t dataLen;
-    unsigned char *data, *newData;
+    Py_buffer buffer, outBuffer;
     int size=3; // the default size for a median filter
-    unsigned char *valueList; // the list of values to find the median of.
-    int valueListLength; // the number of values in the valueList
     int channels; // the number of color channels in this image
-    int padding;
+    int status;
+    PyObject *out = NULL, *result;
+    median_args args;
 
     // read in the arguments from python
-    if (!PyArg_ParseTuple(pArgs, "iiy#|i",
-                &width, &height, &data, &dataLen, &size))
+    if (!PyArg_ParseTupleAndKeywords(pArgs, kwArgs, "iiO&|iO", keywords,
+                &width, &height, image_data, &buffer, &size, &out))
         return NULL;
 
+    dataLen = buffer.len;
     channels = dataLen / (width * height);
     
     if ((channels < 3) || (channels > 4))
@@ -129,53 +203,67 @@ PyObject *median_filter(PyObject *pself, PyObject *pArgs)
         PyErr_Format(PyExc_ValueError, "Data contained an invalid number of "
                 "channels, 3 or 4 expected, %d recieved (width: %d, "
                 "height: %d, bytes: %d)", channels, width, height, dataLen);
+        PyBuffer_Release(&buffer);
         return NULL;
     }
 
-    valueListLength = size * size;
-    if (!(valueList = (unsigned char*)malloc(sizeof(char) * valueListLength)))
+    if (size < 1)
     {
-        PyErr_SetString(PyExc_MemoryError,
-                "Memory could not be allocated for the value array");
+        PyErr_SetString(PyExc_ValueError,
+                "The size of the median filter must be at least 1");
+        PyBuffer_Release(&buffer);
         return NULL;
     }
 
-    padding = size / 2; // padding to leave around the image in the main loop
-    
-    if(!(newData = (unsigned char*)calloc(sizeof(char), dataLen)))
+    if(!(result = get_output(out, dataLen, &outBuffer)))
+    {
+        PyBuffer_Release(&buffer);
+        return NULL;
+    }
+    if (buffers_overlap(&buffer, &outBuffer))
     {
-        PyErr_SetString(PyExc_MemoryError,
-                "Memory could not be allocated for the new image");
+        PyErr_SetString(PyExc_ValueError, "The output of the median filter "
+                "can not be written over its input");
+        PyBuffer_Release(&buffer);
+        PyBuffer_Release(&outBuffer);
+        Py_DECREF(result);
         return NULL;
     }
+    memset(outBuffer.buf, 0, dataLen);
 
-    for (i=padding; i < width - padding; i++)
+    args.data = buffer.buf;
+    args.newData = outBuffer.buf;
+    args.width = width;
+    args.channels = channels;
+    args.size = size;
+
+    // padding (size / 2) is left around the image in the main loop. An image
+    // narrower or shorter than the filter is all padding, and has no rows
+    // to filter.
+    Py_BEGIN_ALLOW_THREADS
+    status = run_bands(median_band, &args,
+            size > width ? 0 : height - (size / 2) * 2, width * channels);
+    Py_END_ALLOW_THREADS
+
+    PyBuffer_Release(&buffer);
+    PyBuffer_Release(&outBuffer);
+
+    if (status)
     {
-        for (j=padding; j < height - padding; j++)
-        {
-            k = i * channels + j * width * channels;
-            for (position = k; position < k+3; position++)
-            {
-                // a list of the values that form a square around this pixel
-                for (m=0; m < valueListLength; m++)
-                {
-                    valueList[m] = data[position + 
-                        ((m / size - padding) * width * channels) +
-                        ((m % size - padding) * channels)];
-                }
-                newData[position] = findMedian(valueList, valueListLength);
-            }
-        }
+        Py_DECREF(result);
+        return band_error(status,
+                "Memory could not be allocated for the filter");
     }
-    
+
     // Build a python tuple and return it.
-    return Py_BuildValue("(iiy#)", width, height, newData, dataLen);
+    return Py_BuildValue("(iiN)", width, height, result);
 
 }
 
 static PyMethodDef median_methods[] =
 {
-    {"execute", median_filter, METH_VARARGS, median_filter__doc__},
+    {"execute", (PyCFunction)median_filter, METH_VARARGS | METH_KEYWORDS,
+        median_filter__doc__},
     {NULL, NULL} // End of functions
 };
 
@@ -190,6 +278,11 @@ static struct PyModuleDef median_module = {
 PyMODINIT_FUNC PyInit_median_filter(void)
 {
     PyObject *m = PyModule_Create(&median_module);
+    if (!m || import_progress())
+    {
+        Py_XDECREF(m);
+        return NULL;
+    }
     PyModule_AddStringConstant(m, "MENU", "Fil&ter");
     PyModule_AddStringConstant(m, "LABEL", "&Median Filter");
     PyModule_AddStringConstant(m, "DESCRIPTION",
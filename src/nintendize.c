@@ -35,31 +35,111 @@ const static char nintendize__doc__[] =
 "        The width of the image in pixels\n"
 "    height : int\n"
 "        The height of the image in pixels\n"
-"    data : string\n"
-"        The data as a binary string.\n"
+"    data : buffer\n"
+"        The image data as bytes, a bytearray or any other buffer.\n"
+"    resolution : int\n"
+"        The resolution to pixellate the image to. Defaults to 200.\n"
+"    colorlevel : int\n"
+"        The number of bits to keep for each color channel. Defaults to 3.\n"
+"    out : buffer\n"
+"        An optional writable buffer the same size as data to write the result "
+        "into. It may not share memory with data.\n"
 "\n"
 ":rtype: tuple\n"
-":returns: A tuple (width, height, data). Width and height are in pixels, data "
-    "is a binary string.\n";
+":returns: A tuple (width, height, data). Width and height are in pixels, "
+    "data is out if it was passed in, otherwise a new bytearray.\n";
 
-PyObject *nintendize(PyObject *pself, PyObject *pArgs)
+typedef struct {
+    unsigned char *data, *newData;
+    int width, channels, size, maxi;
+    unsigned int colorlevel;
+    int mask;
+} nintendize_args;
+
+/**
+ * Pixellates a band of rows of blocks. Each row of blocks is size pixels high.
+ */
+int nintendize_band(void *pArgs, int start, int end)
 {
-    int i, j, k, m, position, maxi, maxj; // for loop variables
+    nintendize_args *args = pArgs;
+    int i, j, k, m; // for loop variables
+    int size = args->size;
+    int channels = args->channels;
+    Py_ssize_t position, thisPixel, rowLength;
+    int tmp_red, tmp_blue, tmp_green;
+
+    rowLength = (Py_ssize_t)args->width * channels;
+    for (j=size/2 + start * size; j < size/2 + end * size; j+=size)
+    {
+        for (i=size/2; i <= args->maxi; i+=size)
+        {
+            position = (i * channels + j * rowLength);
+            tmp_red = tmp_blue = tmp_green = 0;
+            for (k = 0; k < size; k++)
+            {
+                // find the average color
+                for(m = 0; m < size; m++)
+                {
+                    thisPixel = position + (k - size/2) * rowLength +
+                        ((m - size/2) * channels);
+                    tmp_red   += args->data[thisPixel    ];
+                    tmp_green += args->data[thisPixel + 1];
+                    tmp_blue  += args->data[thisPixel + 2];
+               }
+            }
+            // mask each color
+            tmp_red    = clip(tmp_red   / (size * size)) & args->mask;
+            tmp_green  = clip(tmp_green / (size * size)) & args->mask;
+            tmp_blue   = clip(tmp_blue  / (size * size)) & args->mask;
+            // replace the masked off bits with copies of the remaining bits so
+            // the image doesn't darken
+            for(k = args->colorlevel; k < 8; k *= 2)
+            {
+                tmp_red   |= tmp_red   >> k;
+                tmp_green |= tmp_green >> k;
+                tmp_blue  |= tmp_blue  >> k;
+            }
+            // fill in the block with the average color
+            for (k = 0; k < size; k++)
+            {
+                for(m = 0; m < size; m++)
+                {
+                    thisPixel = position + (k - size/2) * rowLength +
+                        ((m - size/2) * channels);
+                    args->newData[thisPixel    ] = tmp_red;
+                    args->newData[thisPixel + 1] = tmp_green;
+                    args->newData[thisPixel + 2] = tmp_blue;
+
+                }
+            }
+        }
+    }
+    return 0;
+}
+
+PyObject *nintendize(PyObject *pself, PyObject *pArgs, PyObject *kwArgs)
+{
+    static char *keywords[] = {"width", "height", "data", "resolution",
+        "colorlevel", "out", NULL};
+    int maxj;
     int width, height;
     Py_ssize_t dataLen;
-    unsigned char *data, *newData;
+    Py_buffer buffer, outBuffer;
     int size; // the size for a median filter
     unsigned int colorlevel = 3; // the number of bits to save per color channel
     unsigned int resolution = 200; // the resolution to pixellate the image to.
     int channels; // the number of color channels in this image
-    int thisPixel;
-    int tmp_red, tmp_blue, tmp_green;
     int mask;
+    PyObject *out = NULL, *result;
+    nintendize_args args;
+    int status;
 
     // read in the arguments from python
-    if (!PyArg_ParseTuple(pArgs, "iiy#|ii", &width, &height, &data, &dataLen,
-                &resolution, &colorlevel))
+    if (!PyArg_ParseTupleAndKeywords(pArgs, kwArgs, "iiO&|iiO", keywords,
+                &width, &height, image_data, &buffer,
+                &resolution, &colorlevel, &out))
         return NULL;
+    dataLen = buffer.len;
 
     // make sure colorlevel is 8 or less (it always should be)
     colorlevel = min(colorlevel, 8);
@@ -78,72 +158,61 @@ PyObject *nintendize(PyObject *pself, PyObject *pArgs)
         PyErr_Format(PyExc_ValueError, "Data contained an invalid number of "
                 "channels, 3 or 4 expected, %d recieved (width: %d, "
                 "height: %d, bytes: %d)", channels, width, height, dataLen);
+        PyBuffer_Release(&buffer);
         return NULL;
     }
 
-    if(!(newData = (unsigned char*)calloc(sizeof(char), dataLen)))
+    if(!(result = get_output(out, dataLen, &outBuffer)))
     {
-        PyErr_SetString(PyExc_MemoryError,
-                "Memory could not be allocated for the new image");
+        PyBuffer_Release(&buffer);
         return NULL;
     }
-
-    maxi = (int)((float)width  - (float)size/2);
-    maxj = (int)((float)height - (float)size/2);
-    for (i=size/2; i <= maxi; i+=size)
+    if (buffers_overlap(&buffer, &outBuffer))
     {
-        for (j=size/2; j <= maxj; j+=size)
-        {
-            position = (i * channels + j * width * channels);
-            tmp_red = tmp_blue = tmp_green = 0;
-            for (k = 0; k < size; k++)
-            {
-                // find the average color
-                for(m = 0; m < size; m++)
-                {
-                    thisPixel = position + ((k - size/2) * channels) * width + 
-                        ((m - size/2) * channels);
-                    tmp_red   += data[thisPixel    ];
-                    tmp_green += data[thisPixel + 1];
-                    tmp_blue  += data[thisPixel + 2];
-               }
-            }
-            // mask each color
-            tmp_red    = clip(tmp_red   / (size * size)) & mask;
-            tmp_green  = clip(tmp_green / (size * size)) & mask;
-            tmp_blue   = clip(tmp_blue  / (size * size)) & mask;
-            // replace the masked off bits with copies of the remaining bits so
-            // the image doesn't darken
-            for(k = colorlevel; k < 8; k *= 2)
-            {
-                tmp_red   |= tmp_red   >> k;
-                tmp_green |= tmp_green >> k;
-                tmp_blue  |= tmp_blue  >> k;
-            }
-            // fill in the block with the average color
-            for (k = 0; k < size; k++)
-            {
-                for(m = 0; m < size; m++)
-                {
-                    thisPixel = position + ((k - size/2) * channels) * width +
-                        ((m - size/2) * channels);
-                    newData[thisPixel    ] = tmp_red;
-                    newData[thisPixel + 1] = tmp_green;
-                    newData[thisPixel + 2] = tmp_blue;
+        PyErr_SetString(PyExc_ValueError, "The pixellated image can not be "
+                "written over the original");
+        PyBuffer_Release(&buffer);
+        PyBuffer_Release(&outBuffer);
+        Py_DECREF(result);
+        return NULL;
+    }
+    memset(outBuffer.buf, 0, dataLen);
+
+    args.data = buffer.buf;
+    args.newData = outBuffer.buf;
+    args.width = width;
+    args.channels = channels;
+    args.size = size;
+    args.colorlevel = colorlevel;
+    args.mask = mask;
+    args.maxi = (int)((float)width  - (float)size/2);
+    maxj = (int)((float)height - (float)size/2);
 
-                }
-            }
-        }
+    // each band is a number of rows of blocks
+    Py_BEGIN_ALLOW_THREADS
+    status = run_bands(nintendize_band, &args,
+            maxj < size/2 ? 0 : (maxj - size/2) / size + 1,
+            (Py_ssize_t)width * channels * size);
+    Py_END_ALLOW_THREADS
+
+    PyBuffer_Release(&buffer);
+    PyBuffer_Release(&outBuffer);
+
+    if (status)
+    {
+        Py_DECREF(result);
+        return band_error(status, "Memory could not be allocated");
     }
 
     // Build a python tuple and return it.
-    return Py_BuildValue("(iiy#)", width, height, newData, dataLen);
+    return Py_BuildValue("(iiN)", width, height, result);
 
 }
 
 static PyMethodDef nintendize_methods[] =
 {
-    {"execute", nintendize, METH_VARARGS, nintendize__doc__},
+    {"execute", (PyCFunction)nintendize, METH_VARARGS | METH_KEYWORDS,
+        nintendize__doc__},
     {NULL, NULL} // End of functions
 };
 
@@ -159,6 +228,11 @@ static struct PyModuleDef nintendize_module =
 PyMODINIT_FUNC PyInit_nintendize(void)
 {
     PyObject *m = PyModule_Create(&nintendize_module);
+    if (!m || import_progress())
+    {
+        Py_XDECREF(m);
+        return NULL;
+    }
     PyModule_AddStringConstant(m, "MENU", "Fil&ter.&Comic");
     PyModule_AddStringConstant(m, "LABEL", "Nindendi&ze");
     PyModule_AddStringConstant(m, "DESCRIPTION", "Nintendize it!");
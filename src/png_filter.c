@@ -0,0 +1,665 @@
+
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <stdlib.h>
+#include <string.h>
+#include "core.h"
+
+const static char __doc__[] =
+"png_filter.c\n"
+"Copyright 2007 Thomas McGrew\n"
+"\n"
+"This file is part of The Python Image Manipulation Project.\n"
+"\n"
+"The Python Image Manipulation Project is free software: you can\n"
+"redistribute it and/or modify it under the terms of the GNU General\n"
+"Public License as published by the Free Software Foundation, either\n"
+"version 2 of the License, or (at your option) any later version.\n"
+"\n"
+"The Python Image Manipulation Project is distributed in the hope\n"
+"that it will be useful, but WITHOUT ANY WARRANTY; without even the\n"
+"implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR\n"
+"PURPOSE. See the GNU General Public License for more details.\n"
+"\n"
+"You should have received a copy of the GNU General Public License\n"
+"along with The Python Image Manipulation Project.  If not, see\n"
+"<http://www.gnu.org/licenses/>.\n"
+"\n"
+"The parts of reading and writing PNG files which work on every byte of the "
+    "image: the row filters, and unpacking the pixel formats a PNG file can "
+    "hold into 8-bit RGB or RGBA. The chunks and the compression are handled "
+    "by extensions/format/png.py.\n";
+
+// the filter types, the first byte of each row of a PNG image
+#define FILTER_NONE 0
+#define FILTER_SUB 1
+#define FILTER_UP 2
+#define FILTER_AVERAGE 3
+#define FILTER_PAETH 4
+#define FILTER_TYPES 5
+
+// the color types
+#define GREY 0
+#define RGB 2
+#define PALETTE 3
+#define GREY_ALPHA 4
+#define RGBA 6
+
+/**
+ * The Paeth predictor: whichever of the bytes to the left, above and above
+ * left is closest to left + above - above left.
+ *
+ * :Parameters:
+ *     a : int
+ *         The byte to the left.
+ *     b : int
+ *         The byte above.
+ *     c : int
+ *         The byte above and to the left.
+ *
+ * :returntype: int
+ * :returns: The predicted byte.
+ */
+static inline int paeth(int a, int b, int c)
+{
+    int p = a + b - c;
+    int pa = abs(p - a), pb = abs(p - b), pc = abs(p - c);
+
+    if (pa <= pb && pa <= pc)
+        return a;
+    if (pb <= pc)
+        return b;
+    return c;
+}
+
+const static char filter__doc__[] =
+"Filters rows of pixels for a PNG file. Each row is filtered with every "
+    "filter type, and the one giving the smallest sum of the absolute values "
+    "of its (signed) bytes is kept, as that usually compresses best.\n"
+"\n"
+":Parameters:\n"
+"    data : buffer\n"
+"        The rows to filter, 8 bits per sample.\n"
+"    row_bytes : int\n"
+"        The number of bytes in a row.\n"
+"    bpp : int\n"
+"        The number of bytes in a pixel.\n"
+"    prior : buffer\n"
+"        The row before the first one in data, or None if the first row is "
+        "the top of the image.\n"
+"    out : buffer\n"
+"        An optional writable buffer to write the result into. It must hold "
+        "row_bytes + 1 bytes for each row.\n"
+"\n"
+":rtype: buffer\n"
+":returns: The filtered rows, each preceded by its filter type. This is out "
+    "if it was passed in, otherwise a new bytearray.\n";
+
+typedef struct {
+    unsigned char *data, *newData;
+    const unsigned char *prior;
+    Py_ssize_t rowBytes;
+    int bpp;
+} filter_args;
+
+/**
+ * Filters a band of rows. The rows only depend on the unfiltered data, so
+ * the bands can be filtered in any order.
+ */
+int filter_band(void *pArgs, int start, int end)
+{
+    filter_args *args = pArgs;
+    Py_ssize_t i, rowBytes = args->rowBytes;
+    int j, k, a, b, c, x, best;
+    int bpp = args->bpp;
+    long long sums[FILTER_TYPES];
+    const unsigned char *row, *up;
+    unsigned char *out;
+
+    for (j=start; j < end; j++)
+    {
+        row = args->data + j * rowBytes;
+        up = j ? row - rowBytes : args->prior;
+        out = args->newData + j * (rowBytes + 1);
+
+        memset(sums, 0, sizeof(sums));
+        for (i=0; i < rowBytes; i++)
+        {
+            x = row[i];
+            a = i >= bpp ? row[i - bpp] : 0;
+            b = up ? up[i] : 0;
+            c = up && i >= bpp ? up[i - bpp] : 0;
+            sums[FILTER_NONE] += abs((signed char)x);
+            sums[FILTER_SUB] += abs((signed char)(x - a));
+            sums[FILTER_UP] += abs((signed char)(x - b));
+            sums[FILTER_AVERAGE] += abs((signed char)(x - ((a + b) >> 1)));
+            sums[FILTER_PAETH] += abs((signed char)(x - paeth(a, b, c)));
+        }
+        best = FILTER_NONE;
+        for (k=1; k < FILTER_TYPES; k++)
+            if (sums[k] < sums[best])
+                best = k;
+
+        *out++ = best;
+        for (i=0; i < rowBytes; i++)
+        {
+            x = row[i];
+            a = i >= bpp ? row[i - bpp] : 0;
+            b = up ? up[i] : 0;
+            c = up && i >= bpp ? up[i - bpp] : 0;
+            switch (best)
+            {
+                case FILTER_NONE:    out[i] = x; break;
+                case FILTER_SUB:     out[i] = x - a; break;
+                case FILTER_UP:      out[i] = x - b; break;
+                case FILTER_AVERAGE: out[i] = x - ((a + b) >> 1); break;
+                default:             out[i] = x - paeth(a, b, c);
+            }
+        }
+    }
+    return 0;
+}
+
+/**
+ * Gets the prior row argument of filter and unfilter.
+ *
+ * :returntype: int
+ * :returns: 0 on success, -1 with an exception set if prior isn't a buffer
+ *     of row_bytes bytes.
+ */
+static int get_prior(PyObject *prior, Py_ssize_t rowBytes, Py_buffer *view)
+{
+    if (!prior || prior == Py_None)
+    {
+        view->buf = NULL;
+        view->obj = NULL;
+        return 0;
+    }
+    if (!image_data(prior, view))
+        return -1;
+    if (view->len != rowBytes)
+    {
+        PyErr_Format(PyExc_ValueError, "The prior row must be %zd bytes, "
+                "%zd recieved", rowBytes, view->len);
+        PyBuffer_Release(view);
+        return -1;
+    }
+    return 0;
+}
+
+PyObject *filter(PyObject *self, PyObject *pArgs, PyObject *kwArgs)
+{
+    static char *keywords[] = {"data", "row_bytes", "bpp", "prior", "out",
+        NULL};
+    Py_buffer buffer, priorBuffer, outBuffer;
+    Py_ssize_t rowBytes, rows;
+    int bpp, status;
+    PyObject *prior = NULL, *out = NULL, *result;
+    filter_args args;
+
+    if (!PyArg_ParseTupleAndKeywords(pArgs, kwArgs, "O&ni|OO", keywords,
+                image_data, &buffer, &rowBytes, &bpp, &prior, &out))
+        return NULL;
+
+    if (rowBytes < 1 || bpp < 1 || buffer.len % rowBytes ||
+            buffer.len / rowBytes > INT_MAX)
+    {
+        PyErr_Format(PyExc_ValueError, "The data (%zd bytes) must be a whole "
+                "number of rows of %zd bytes", buffer.len, rowBytes);
+        PyBuffer_Release(&buffer);
+        return NULL;
+    }
+    rows = buffer.len / rowBytes;
+    if (get_prior(prior, rowBytes, &priorBuffer))
+    {
+        PyBuffer_Release(&buffer);
+        return NULL;
+    }
+    if (!(result = get_output(out, rows * (rowBytes + 1), &outBuffer)))
+    {
+        PyBuffer_Release(&buffer);
+        PyBuffer_Release(&priorBuffer);
+        return NULL;
+    }
+
+    args.data = buffer.buf;
+    args.newData = outBuffer.buf;
+    args.prior = priorBuffer.buf;
+    args.rowBytes = rowBytes;
+    args.bpp = bpp;
+
+    Py_BEGIN_ALLOW_THREADS
+    status = run_bands(filter_band, &args, rows, rowBytes);
+    Py_END_ALLOW_THREADS
+
+    PyBuffer_Release(&buffer);
+    PyBuffer_Release(&priorBuffer);
+    PyBuffer_Release(&outBuffer);
+
+    if (status)
+    {
+        Py_DECREF(result);
+        return band_error(status, "The rows could not be filtered");
+    }
+    return result;
+}
+
+const static char unfilter__doc__[] =
+"Reverses the filters applied to rows of a PNG image.\n"
+"\n"
+":Parameters:\n"
+"    data : buffer\n"
+"        The filtered rows, each preceded by its filter type.\n"
+"    row_bytes : int\n"
+"        The number of bytes in a row, not counting the filter type.\n"
+"    bpp : int\n"
+"        The number of bytes in a pixel, rounded up to 1.\n"
+"    prior : buffer\n"
+"        The unfiltered row before the first one in data, or None if the first "
+        "row is the top of the image (or of an interlaced pass).\n"
+"    out : buffer\n"
+"        An optional writable buffer to write the result into. It must hold "
+        "row_bytes bytes for each row.\n"
+"\n"
+":rtype: buffer\n"
+":returns: The unfiltered rows. This is out if it was passed in, otherwise a "
+    "new bytearray.\n";
+
+/**
+ * Reverses the filters of a number of rows. Each row depends on the one
+ * before it, so this can't be split into bands.
+ *
+ * :returntype: int
+ * :returns: 0 on success, otherwise the invalid filter type which was found.
+ */
+static int unfilter_rows(const unsigned char *in, unsigned char *out,
+        const unsigned char *up, Py_ssize_t rowBytes, int bpp, Py_ssize_t rows)
+{
+    Py_ssize_t i, j;
+    int type, a, b, c;
+
+    for (j=0; j < rows; j++)
+    {
+        type = *in++;
+        for (i=0; i < rowBytes; i++)
+        {
+            a = i >= bpp ? out[i - bpp] : 0;
+            b = up ? up[i] : 0;
+            switch (type)
+            {
+                case FILTER_NONE:
+                    out[i] = in[i];
+                    break;
+                case FILTER_SUB:
+                    out[i] = in[i] + a;
+                    break;
+                case FILTER_UP:
+                    out[i] = in[i] + b;
+                    break;
+                case FILTER_AVERAGE:
+                    out[i] = in[i] + ((a + b) >> 1);
+                    break;
+                case FILTER_PAETH:
+                    c = up && i >= bpp ? up[i - bpp] : 0;
+                    out[i] = in[i] + paeth(a, b, c);
+                    break;
+                default:
+                    return type;
+            }
+        }
+        up = out;
+        in += rowBytes;
+        out += rowBytes;
+    }
+    return 0;
+}
+
+PyObject *unfilter(PyObject *self, PyObject *pArgs, PyObject *kwArgs)
+{
+    static char *keywords[] = {"data", "row_bytes", "bpp", "prior", "out",
+        NULL};
+    Py_buffer buffer, priorBuffer, outBuffer;
+    Py_ssize_t rowBytes, rows;
+    int bpp, status;
+    PyObject *prior = NULL, *out = NULL, *result;
+
+    if (!PyArg_ParseTupleAndKeywords(pArgs, kwArgs, "O&ni|OO", keywords,
+                image_data, &buffer, &rowBytes, &bpp, &prior, &out))
+        return NULL;
+
+    if (rowBytes < 1 || bpp < 1 || buffer.len % (rowBytes + 1))
+    {
+        PyErr_Format(PyExc_ValueError, "The data (%zd bytes) must be a whole "
+                "number of rows of %zd bytes", buffer.len, rowBytes + 1);
+        PyBuffer_Release(&buffer);
+        return NULL;
+    }
+    rows = buffer.len / (rowBytes + 1);
+    if (get_prior(prior, rowBytes, &priorBuffer))
+    {
+        PyBuffer_Release(&buffer);
+        return NULL;
+    }
+    if (!(result = get_output(out, rows * rowBytes, &outBuffer)))
+    {
+        PyBuffer_Release(&buffer);
+        PyBuffer_Release(&priorBuffer);
+        return NULL;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    status = unfilter_rows(buffer.buf, outBuffer.buf, priorBuffer.buf,
+            rowBytes, bpp, rows);
+    Py_END_ALLOW_THREADS
+
+    PyBuffer_Release(&buffer);
+    PyBuffer_Release(&priorBuffer);
+    PyBuffer_Release(&outBuffer);
+
+    if (status)
+    {
+        Py_DECREF(result);
+        PyErr_Format(PyExc_ValueError, "Invalid PNG filter type %d", status);
+        return NULL;
+    }
+    return result;
+}
+
+const static char unpack__doc__[] =
+"Converts unfiltered rows of a PNG image to 8-bit RGB or RGBA.\n"
+"\n"
+":Parameters:\n"
+"    data : buffer\n"
+"        The unfiltered rows.\n"
+"    width : int\n"
+"        The number of pixels in a row.\n"
+"    color_type : int\n"
+"        The PNG color type: 0 (grey), 2 (RGB), 3 (palette), 4 (grey and "
+        "alpha) or 6 (RGBA).\n"
+"    depth : int\n"
+"        The number of bits per sample: 1, 2, 4, 8 or 16.\n"
+"    channels : int\n"
+"        The number of channels to produce, 3 or 4. Alpha is opaque for color "
+        "types without it, unless it comes from the palette or transparent.\n"
+"    palette : buffer\n"
+"        For color type 3, the red, green, blue and alpha of 256 colors.\n"
+"    transparent : tuple\n"
+"        For color types 0 and 2, the samples of the color which is "
+        "transparent (grey, grey, grey for type 0), or None.\n"
+"    out : buffer\n"
+"        An optional writable buffer to write the result into.\n"
+"\n"
+":rtype: buffer\n"
+":returns: The pixels. This is out if it was passed in, otherwise a new "
+    "bytearray.\n";
+
+typedef struct {
+    unsigned char *data, *newData;
+    const unsigned char *palette;
+    Py_ssize_t rowBytes;
+    int width, colorType, depth, samples, channels;
+    int transparent[3], hasTransparent;
+} unpack_args;
+
+/**
+ * Gets a sample from a row of a PNG image.
+ *
+ * :Parameters:
+ *     row : unsigned char*
+ *         The unfiltered row.
+ *     index : Py_ssize_t
+ *         The number of the sample in the row.
+ *     depth : int
+ *         The number of bits per sample.
+ *
+ * :returntype: int
+ * :returns: The value of the sample.
+ */
+static inline int get_sample(const unsigned char *row, Py_ssize_t index,
+        int depth)
+{
+    Py_ssize_t bit;
+
+    switch (depth)
+    {
+        case 8:
+            return row[index];
+        case 16:
+            return row[index * 2] << 8 | row[index * 2 + 1];
+        default:
+            // samples smaller than a byte start from the most significant bits
+            bit = index * depth;
+            return (row[bit >> 3] >> (8 - depth - (bit & 7))) &
+                ((1 << depth) - 1);
+    }
+}
+
+/**
+ * Scales a sample to the range 0-255.
+ */
+static inline int scale_sample(int value, int depth)
+{
+    switch (depth)
+    {
+        case 1:  return value * 255;
+        case 2:  return value * 85;
+        case 4:  return value * 17;
+        case 16: return (value * 255 + 32767) / 65535;
+        default: return value;
+    }
+}
+
+/**
+ * Unpacks a band of rows.
+ */
+int unpack_band(void *pArgs, int start, int end)
+{
+    unpack_args *args = pArgs;
+    Py_ssize_t i;
+    int j, c, value, opaque;
+    int samples[4];
+    int depth = args->depth, channels = args->channels;
+    const unsigned char *row, *color;
+    unsigned char *out;
+
+    for (j=start; j < end; j++)
+    {
+        row = args->data + j * args->rowBytes;
+        out = args->newData + (Py_ssize_t)j * args->width * channels;
+
+        // the pixels are already in the right format
+        if (depth == 8 && ((args->colorType == RGB && channels == 3 &&
+                        !args->hasTransparent) ||
+                    (args->colorType == RGBA && channels == 4)))
+        {
+            memcpy(out, row, (Py_ssize_t)args->width * channels);
+            continue;
+        }
+
+        for (i=0; i < args->width; i++, out += channels)
+        {
+            if (args->colorType == PALETTE)
+            {
+                color = args->palette + get_sample(row, i, depth) * 4;
+                for (c=0; c < channels; c++)
+                    out[c] = color[c];
+                continue;
+            }
+
+            for (c=0; c < args->samples; c++)
+                samples[c] = get_sample(row, i * args->samples + c, depth);
+            switch (args->colorType)
+            {
+                case GREY:
+                case GREY_ALPHA:
+                    samples[3] = samples[1];
+                    samples[1] = samples[2] = samples[0];
+                    opaque = args->colorType == GREY;
+                    break;
+                default:
+                    opaque = args->colorType == RGB;
+            }
+
+            for (c=0; c < 3; c++)
+                out[c] = scale_sample(samples[c], depth);
+            if (channels < 4)
+                continue;
+            if (!opaque)
+                value = scale_sample(samples[3], depth);
+            else if (args->hasTransparent &&
+                    samples[0] == args->transparent[0] &&
+                    samples[1] == args->transparent[1] &&
+                    samples[2] == args->transparent[2])
+                value = 0;
+            else
+                value = 255;
+            out[3] = value;
+        }
+    }
+    return 0;
+}
+
+PyObject *unpack(PyObject *self, PyObject *pArgs, PyObject *kwArgs)
+{
+    static char *keywords[] = {"data", "width", "color_type", "depth",
+        "channels", "palette", "transparent", "out", NULL};
+    Py_buffer buffer, paletteBuffer, outBuffer;
+    Py_ssize_t rows;
+    int status;
+    PyObject *palette = NULL, *transparent = NULL, *out = NULL, *result;
+    unpack_args args;
+
+    if (!PyArg_ParseTupleAndKeywords(pArgs, kwArgs, "O&iiii|OOO", keywords,
+                image_data, &buffer, &args.width, &args.colorType,
+                &args.depth, &args.channels, &palette, &transparent, &out))
+        return NULL;
+
+    switch (args.colorType)
+    {
+        case GREY:
+        case PALETTE:    args.samples = 1; break;
+        case RGB:        args.samples = 3; break;
+        case GREY_ALPHA: args.samples = 2; break;
+        case RGBA:       args.samples = 4; break;
+        default:         args.samples = 0;
+    }
+    if (!args.samples || (args.depth != 1 && args.depth != 2 &&
+                args.depth != 4 && args.depth != 8 && args.depth != 16) ||
+            (args.colorType == PALETTE && args.depth > 8) ||
+            (args.samples > 1 && args.depth < 8))
+    {
+        PyErr_Format(PyExc_ValueError, "Unsupported PNG pixel format (color "
+                "type %d, %d bits per sample)", args.colorType, args.depth);
+        PyBuffer_Release(&buffer);
+        return NULL;
+    }
+    if (args.channels < 3 || args.channels > 4 || args.width < 1)
+    {
+        PyErr_Format(PyExc_ValueError, "Invalid width (%d) or number of "
+                "channels (%d)", args.width, args.channels);
+        PyBuffer_Release(&buffer);
+        return NULL;
+    }
+    args.rowBytes = ((Py_ssize_t)args.width * args.samples * args.depth + 7) /
+        8;
+    if (buffer.len % args.rowBytes || buffer.len / args.rowBytes > INT_MAX)
+    {
+        PyErr_Format(PyExc_ValueError, "The data (%zd bytes) must be a whole "
+                "number of rows of %zd bytes", buffer.len, args.rowBytes);
+        PyBuffer_Release(&buffer);
+        return NULL;
+    }
+    rows = buffer.len / args.rowBytes;
+
+    args.hasTransparent = transparent && transparent != Py_None;
+    if (args.hasTransparent && !PyArg_ParseTuple(transparent, "iii",
+                &args.transparent[0], &args.transparent[1],
+                &args.transparent[2]))
+    {
+        PyBuffer_Release(&buffer);
+        return NULL;
+    }
+
+    paletteBuffer.obj = NULL;
+    if (args.colorType == PALETTE)
+    {
+        if (!palette || palette == Py_None)
+        {
+            PyErr_SetString(PyExc_ValueError, "A palette is needed for color "
+                    "type 3");
+            PyBuffer_Release(&buffer);
+            return NULL;
+        }
+        if (!image_data(palette, &paletteBuffer))
+        {
+            PyBuffer_Release(&buffer);
+            return NULL;
+        }
+        if (paletteBuffer.len != 256 * 4)
+        {
+            PyErr_Format(PyExc_ValueError, "The palette must be 1024 bytes, "
+                    "%zd recieved", paletteBuffer.len);
+            PyBuffer_Release(&buffer);
+            PyBuffer_Release(&paletteBuffer);
+            return NULL;
+        }
+    }
+
+    if (!(result = get_output(out, rows * args.width * args.channels,
+                    &outBuffer)))
+    {
+        PyBuffer_Release(&buffer);
+        PyBuffer_Release(&paletteBuffer);
+        return NULL;
+    }
+
+    args.data = buffer.buf;
+    args.newData = outBuffer.buf;
+    args.palette = paletteBuffer.buf;
+
+    Py_BEGIN_ALLOW_THREADS
+    status = run_bands(unpack_band, &args, rows, args.rowBytes);
+    Py_END_ALLOW_THREADS
+
+    PyBuffer_Release(&buffer);
+    PyBuffer_Release(&paletteBuffer);
+    PyBuffer_Release(&outBuffer);
+
+    if (status)
+    {
+        Py_DECREF(result);
+        return band_error(status, "The pixels could not be unpacked");
+    }
+    return result;
+}
+
+// map of function names to functions
+static PyMethodDef png_filter_methods[] =
+{
+    {"filter", (PyCFunction)filter, METH_VARARGS | METH_KEYWORDS,
+        filter__doc__},
+    {"unfilter", (PyCFunction)unfilter, METH_VARARGS | METH_KEYWORDS,
+        unfilter__doc__},
+    {"unpack", (PyCFunction)unpack, METH_VARARGS | METH_KEYWORDS,
+        unpack__doc__},
+    {NULL, NULL} // End of functions
+};
+
+static struct PyModuleDef png_filter_module = {
+    PyModuleDef_HEAD_INIT,
+    "png_filter",
+    __doc__,
+    -1,
+    png_filter_methods
+};
+
+PyMODINIT_FUNC PyInit_png_filter(void)
+{
+    PyObject *m = PyModule_Create(&png_filter_module);
+    if (!m || import_progress())
+    {
+        Py_XDECREF(m);
+        return NULL;
+    }
+    return m;
+}
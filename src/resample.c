@@ -0,0 +1,447 @@
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <stdlib.h>
+#include <string.h>
+#include <math.h>
+#include "core.h"
+
+const static char __doc__[] =
+"resample.c\n"
+"Copyright 2007 Thomas McGrew\n"
+"\n"
+"This file is part of The Python Image Manipulation Project.\n"
+"\n"
+"The Python Image Manipulation Project is free software: you can\n"
+"redistribute it and/or modify it under the terms of the GNU General\n"
+"Public License as published by the Free Software Foundation, either\n"
+"version 2 of the License, or (at your option) any later version.\n"
+"\n"
+"The Python Image Manipulation Project is distributed in the hope\n"
+"that it will be useful, but WITHOUT ANY WARRANTY; without even the\n"
+"implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR\n"
+"PURPOSE. See the GNU General Public License for more details.\n"
+"\n"
+"You should have received a copy of the GNU General Public License\n"
+"along with The Python Image Manipulation Project.  If not, see\n"
+"<http://www.gnu.org/licenses/>.\n"
+"\n"
+"Scales images with a choice of filters. The image is scaled across, then "
+    "down, each output pixel being a weighted sum of the input pixels under "
+    "the filter. The filter is widened when shrinking an image, so every "
+    "input pixel contributes and the result doesn't alias.\n";
+
+#ifndef M_PI
+#define M_PI 3.14159265358979323846
+#endif
+
+// the weights are fixed point numbers with this many bits after the point
+#define WEIGHT_BITS 14
+#define WEIGHT_ONE (1 << WEIGHT_BITS)
+
+// a resampling filter, which is zero outside of -support to support
+typedef struct {
+    const char *name;
+    double support;
+    double (*function)(double x);
+} resample_filter;
+
+static double box(double x)
+{
+    return (x >= -0.5 && x < 0.5) ? 1.0 : 0.0;
+}
+
+static double triangle(double x)
+{
+    x = fabs(x);
+    return x < 1.0 ? 1.0 - x : 0.0;
+}
+
+static double cubic(double x)
+{
+    // Keys' cubic convolution with a = -0.5
+    const double a = -0.5;
+    x = fabs(x);
+    if (x < 1.0)
+        return ((a + 2.0) * x - (a + 3.0)) * x * x + 1.0;
+    if (x < 2.0)
+        return (((x - 5.0) * x + 8.0) * x - 4.0) * a;
+    return 0.0;
+}
+
+static double sinc(double x)
+{
+    if (x == 0.0)
+        return 1.0;
+    x *= M_PI;
+    return sin(x) / x;
+}
+
+static double lanczos3(double x)
+{
+    return (x > -3.0 && x < 3.0) ? sinc(x) * sinc(x / 3.0) : 0.0;
+}
+
+static const resample_filter filters[] =
+{
+    {"box"     , 0.5, box     },
+    {"bilinear", 1.0, triangle},
+    {"bicubic" , 2.0, cubic   },
+    {"lanczos3", 3.0, lanczos3},
+    {NULL, 0, NULL}
+};
+
+// The pixels of the input which contribute to each pixel of the output along
+// one direction: output pixel i is the sum of the pixels from first[i] to
+// first[i] + count[i] - 1, multiplied by weights[i * taps] onwards.
+typedef struct {
+    int *first;
+    int *count;
+    int *weights;
+    int taps;
+} coefficients;
+
+static void free_coefficients(coefficients *c)
+{
+    free(c->first);
+    free(c->count);
+    free(c->weights);
+}
+
+/**
+ * Builds the weights for scaling one direction of an image.
+ *
+ * Parameters:
+ *     c : coefficients*
+ *         Filled in with the weights. It must be freed with free_coefficients.
+ *     size : int
+ *         The number of pixels in the input.
+ *     newSize : int
+ *         The number of pixels in the output.
+ *     filter : const resample_filter*
+ *         The filter to use.
+ *
+ * returntype: int
+ * returns: 0 on success, -1 if memory could not be allocated.
+ */
+static int make_coefficients(coefficients *c, int size, int newSize,
+        const resample_filter *filter)
+{
+    double scale = (double)size / newSize;
+    // the filter is stretched over more input pixels when shrinking.
+    double filterScale = scale > 1.0 ? scale : 1.0;
+    double support = filter->support * filterScale;
+    double center, total, *weights;
+    int i, x, first, last;
+
+    c->taps = (int)ceil(support) * 2 + 1;
+    c->first = malloc(sizeof(int) * newSize);
+    c->count = malloc(sizeof(int) * newSize);
+    c->weights = malloc(sizeof(int) * newSize * c->taps);
+    weights = malloc(sizeof(double) * c->taps);
+    if (!c->first || !c->count || !c->weights || !weights)
+    {
+        free_coefficients(c);
+        free(weights);
+        c->first = c->count = c->weights = NULL;
+        return -1;
+    }
+
+    for (i=0; i < newSize; i++)
+    {
+        center = (i + 0.5) * scale;
+        first = (int)floor(center - support + 0.5);
+        last = (int)floor(center + support + 0.5);
+        if (first < 0)
+            first = 0;
+        if (last > size)
+            last = size;
+        if (last - first > c->taps)
+            last = first + c->taps;
+
+        total = 0.0;
+        for (x=first; x < last; x++)
+        {
+            weights[x - first] =
+                filter->function((x + 0.5 - center) / filterScale);
+            total += weights[x - first];
+        }
+        // nothing fell under the filter, use the nearest pixel.
+        if (total == 0.0)
+        {
+            first = min((int)center, size - 1);
+            last = first + 1;
+            weights[0] = total = 1.0;
+        }
+        c->first[i] = first;
+        c->count[i] = last - first;
+        for (x=0; x < last - first; x++)
+            c->weights[i * c->taps + x] =
+                (int)lround(weights[x] / total * WEIGHT_ONE);
+    }
+    free(weights);
+    return 0;
+}
+
+// rounds a weighted sum back to a byte, the filters with negative lobes can
+// overshoot either way.
+static inline unsigned char to_byte(int sum)
+{
+    sum = (sum + (WEIGHT_ONE >> 1)) >> WEIGHT_BITS;
+    return clip(sum);
+}
+
+typedef struct {
+    unsigned char *data, *newData;
+    int width, newWidth, channels;
+    coefficients *c;
+} horizontal_args;
+
+int horizontal_band(void *pArgs, int start, int end)
+{
+    horizontal_args *args = pArgs;
+    coefficients *c = args->c;
+    int channels = args->channels;
+    int i, j, k, x, sum[4], *weights;
+    unsigned char *row, *pixel, *newPixel;
+
+    for (j=start; j < end; j++)
+    {
+        row = args->data + (Py_ssize_t)j * args->width * channels;
+        newPixel = args->newData + (Py_ssize_t)j * args->newWidth * channels;
+        for (i=0; i < args->newWidth; i++)
+        {
+            weights = c->weights + i * c->taps;
+            pixel = row + (Py_ssize_t)c->first[i] * channels;
+            sum[0] = sum[1] = sum[2] = sum[3] = 0;
+            for (x=0; x < c->count[i]; x++)
+            {
+                for (k=0; k < channels; k++)
+                    sum[k] += pixel[k] * weights[x];
+                pixel += channels;
+            }
+            for (k=0; k < channels; k++)
+                *newPixel++ = to_byte(sum[k]);
+        }
+    }
+    return 0;
+}
+
+typedef struct {
+    unsigned char *data, *newData;
+    int rowLength; // the width times the channels of both images
+    coefficients *c;
+} vertical_args;
+
+int vertical_band(void *pArgs, int start, int end)
+{
+    vertical_args *args = pArgs;
+    coefficients *c = args->c;
+    int rowLength = args->rowLength;
+    int i, j, y, weight, *sums;
+    unsigned char *row, *newRow;
+
+    if (!(sums = malloc(sizeof(int) * rowLength)))
+        return 1;
+
+    // each output row is built up from whole input rows, so the input is
+    // read in order.
+    for (j=start; j < end; j++)
+    {
+        memset(sums, 0, sizeof(int) * rowLength);
+        for (y=0; y < c->count[j]; y++)
+        {
+            row = args->data + (Py_ssize_t)(c->first[j] + y) * rowLength;
+            weight = c->weights[j * c->taps + y];
+            for (i=0; i < rowLength; i++)
+                sums[i] += row[i] * weight;
+        }
+        newRow = args->newData + (Py_ssize_t)j * rowLength;
+        for (i=0; i < rowLength; i++)
+            newRow[i] = to_byte(sums[i]);
+    }
+    free(sums);
+    return 0;
+}
+
+const static char resample__doc__[] =
+"Scales an image using a resampling filter.\n"
+"\n"
+":Parameters:\n"
+"    width : int\n"
+"        The width of the image in pixels\n"
+"    height : int\n"
+"        The height of the image in pixels\n"
+"    data : buffer\n"
+"        The image data as bytes, a bytearray or any other buffer.\n"
+"    newWidth : int\n"
+"        The new width for the image.\n"
+"    newHeight : int\n"
+"        The new height for the image\n"
+"    method : str\n"
+"        The filter to use, one of METHODS: \"box\", \"bilinear\" (the "
+        "default), \"bicubic\" or \"lanczos3\". They are listed from fastest "
+        "to sharpest.\n"
+"    out : buffer\n"
+"        An optional writable buffer the size of the new image to write the "
+        "result into. It may not share memory with data.\n"
+"\n"
+":rtype: tuple\n"
+":returns: a tuple containing a width, height, and data. data is out if it was "
+    "passed in, otherwise a new bytearray.\n";
+
+PyObject *resample(PyObject *pself, PyObject *pArgs, PyObject *kwArgs)
+{
+    static char *keywords[] = {"width", "height", "data", "newWidth",
+        "newHeight", "method", "out", NULL};
+    int width, height, newWidth, newHeight, channels;
+    Py_ssize_t dataLen;
+    Py_buffer buffer, outBuffer; // the image data
+    PyObject *out = NULL, *result;
+    const char *method = "bilinear";
+    const resample_filter *filter;
+    coefficients across = {NULL}, down = {NULL};
+    unsigned char *scaled = NULL; // the image scaled across
+    horizontal_args hArgs;
+    vertical_args vArgs;
+    int status = 0;
+
+    // convert the passed in python argument to C types.
+    if (!PyArg_ParseTupleAndKeywords(pArgs, kwArgs, "iiO&ii|sO", keywords,
+                &width, &height, image_data, &buffer,
+                &newWidth, &newHeight, &method,
+                &out))
+        return NULL;
+
+    for (filter = filters; filter->name; filter++)
+        if (!strcmp(filter->name, method))
+            break;
+    if (!filter->name)
+    {
+        PyErr_Format(PyExc_ValueError, "Unknown resampling method '%s'",
+                method);
+        PyBuffer_Release(&buffer);
+        return NULL;
+    }
+
+    dataLen = buffer.len;
+    channels = dataLen / (width * height);
+    if ((channels < 3) || (channels > 4))
+    {
+         PyErr_Format(PyExc_ValueError, "Data contained an invalid number of "
+                 "channels, 3 or 4 expected, %d recieved (width: %d, "
+                 "height: %d, bytes: %d)", channels, width, height, dataLen);
+         PyBuffer_Release(&buffer);
+         return NULL;
+    }
+
+    if ((newWidth < 1) || (newHeight < 1))
+    {
+         PyErr_SetString(PyExc_ValueError,
+                 "The new image must be at least 1 pixel wide and high");
+         PyBuffer_Release(&buffer);
+         return NULL;
+    }
+
+    if (!(result = get_output(out,
+                    (Py_ssize_t)newWidth * newHeight * channels, &outBuffer)))
+    {
+        PyBuffer_Release(&buffer);
+        return NULL;
+    }
+    if (buffers_overlap(&buffer, &outBuffer))
+    {
+        PyErr_SetString(PyExc_ValueError,
+                "The scaled image can not be written over the original");
+        PyBuffer_Release(&buffer);
+        PyBuffer_Release(&outBuffer);
+        Py_DECREF(result);
+        return NULL;
+    }
+
+    // a direction which doesn't change size is left out.
+    if ((newWidth != width &&
+                make_coefficients(&across, width, newWidth, filter)) ||
+            (newHeight != height &&
+                make_coefficients(&down, height, newHeight, filter)) ||
+            (newWidth != width && newHeight != height &&
+                !(scaled = malloc((Py_ssize_t)newWidth * height * channels))))
+        status = 1;
+
+    hArgs.data = buffer.buf;
+    hArgs.newData = newHeight == height ? outBuffer.buf : scaled;
+    hArgs.width = width;
+    hArgs.newWidth = newWidth;
+    hArgs.channels = channels;
+    hArgs.c = &across;
+    vArgs.data = newWidth == width ? buffer.buf : scaled;
+    vArgs.newData = outBuffer.buf;
+    vArgs.rowLength = newWidth * channels;
+    vArgs.c = &down;
+
+    Py_BEGIN_ALLOW_THREADS
+    if (!status && newWidth == width && newHeight == height)
+        memcpy(outBuffer.buf, buffer.buf, dataLen);
+    if (!status && newWidth != width)
+        status = run_bands(horizontal_band, &hArgs, height,
+                newWidth * channels);
+    if (!status && newHeight != height)
+        status = run_bands(vertical_band, &vArgs, newHeight,
+                newWidth * channels);
+    Py_END_ALLOW_THREADS
+
+    free(scaled);
+    free_coefficients(&across);
+    free_coefficients(&down);
+    PyBuffer_Release(&buffer);
+    PyBuffer_Release(&outBuffer);
+
+    if (status)
+    {
+        Py_DECREF(result);
+        return band_error(status,
+                "Memory could not be allocated to scale the image");
+    }
+
+    // Build a python tuple and return it.
+    return Py_BuildValue("(iiN)",  newWidth, newHeight, result);
+}
+
+// map of function names to functions
+static PyMethodDef resample_methods[] =
+{
+    {"resample", (PyCFunction)resample, METH_VARARGS | METH_KEYWORDS,
+        resample__doc__},
+    {NULL, NULL} // End of functions
+};
+
+static struct PyModuleDef resample_module = {
+    PyModuleDef_HEAD_INIT,
+    "resample",
+    __doc__,
+    -1,
+    resample_methods
+};
+
+PyMODINIT_FUNC PyInit_resample(void)
+{
+    PyObject *m = PyModule_Create(&resample_module);
+    PyObject *methods;
+    int i;
+
+    if (!m || import_progress())
+    {
+        Py_XDECREF(m);
+        return NULL;
+    }
+    // the names of the filters, in the order they are listed above.
+    methods = PyTuple_New(sizeof(filters) / sizeof(*filters) - 1);
+    for (i=0; methods && filters[i].name; i++)
+        PyTuple_SET_ITEM(methods, i, PyUnicode_FromString(filters[i].name));
+    if (!methods || PyModule_AddObject(m, "METHODS", methods))
+    {
+        Py_XDECREF(methods);
+        Py_DECREF(m);
+        return NULL;
+    }
+    return m;
+}